@@ -0,0 +1,28 @@
+"""Add orders keyset pagination indexes
+
+Revision ID: 3a42872c17d3
+Revises: 3e86b0215494
+Create Date: 2026-10-16 13:02:17.509114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = '3a42872c17d3'
+down_revision: Union[str, Sequence[str], None] = '3e86b0215494'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_orders_created_at_id', 'orders', ['created_at', 'id'], unique=False)
+    op.create_index('ix_orders_user_id_created_at_id', 'orders', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_user_id_created_at_id', table_name='orders')
+    op.drop_index('ix_orders_created_at_id', table_name='orders')
@@ -0,0 +1,74 @@
+"""Add orders full-text search index (FTS5)
+
+Revision ID: 3e86b0215494
+Revises: a52ba2727159
+Create Date: 2026-10-16 12:10:41.218733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = '3e86b0215494'
+down_revision: Union[str, Sequence[str], None] = 'a52ba2727159'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Колонки заказа, по которым ведется полнотекстовый поиск
+FTS_COLUMNS = "order_text, full_name, delivery_address, username, contact_phone, delivery_notes"
+NEW_VALUES = ", ".join(f"new.{column.strip()}" for column in FTS_COLUMNS.split(","))
+OLD_VALUES = ", ".join(f"old.{column.strip()}" for column in FTS_COLUMNS.split(","))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # External content таблица: текст хранится только в orders, FTS5 хранит лишь индекс.
+    # Токенизатор trigram с case_sensitive 0 сохраняет поиск по подстроке (как прежний LIKE '%q%')
+    # и сам выполняет Unicode-свертку регистра, включая кириллицу.
+    op.execute(
+        f"""
+        CREATE VIRTUAL TABLE orders_fts USING fts5(
+            {FTS_COLUMNS},
+            content='orders',
+            content_rowid='id',
+            tokenize='trigram case_sensitive 0'
+        )
+        """
+    )
+
+    # Триггеры поддерживают индекс в актуальном состоянии
+    op.execute(
+        f"""
+        CREATE TRIGGER orders_fts_ai AFTER INSERT ON orders BEGIN
+            INSERT INTO orders_fts(rowid, {FTS_COLUMNS}) VALUES (new.id, {NEW_VALUES});
+        END
+        """
+    )
+    op.execute(
+        f"""
+        CREATE TRIGGER orders_fts_ad AFTER DELETE ON orders BEGIN
+            INSERT INTO orders_fts(orders_fts, rowid, {FTS_COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES});
+        END
+        """
+    )
+    # Срабатывает только при изменении индексируемых колонок (смена статуса индекс не трогает)
+    op.execute(
+        f"""
+        CREATE TRIGGER orders_fts_au AFTER UPDATE OF {FTS_COLUMNS} ON orders BEGIN
+            INSERT INTO orders_fts(orders_fts, rowid, {FTS_COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES});
+            INSERT INTO orders_fts(rowid, {FTS_COLUMNS}) VALUES (new.id, {NEW_VALUES});
+        END
+        """
+    )
+
+    # Заполняем индекс существующими заказами
+    op.execute("INSERT INTO orders_fts(orders_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS orders_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS orders_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS orders_fts_ai")
+    op.execute("DROP TABLE IF EXISTS orders_fts")
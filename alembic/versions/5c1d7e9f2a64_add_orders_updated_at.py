@@ -0,0 +1,32 @@
+"""Add orders updated_at column
+
+Revision ID: 5c1d7e9f2a64
+Revises: 3a42872c17d3
+Create Date: 2026-10-16 14:41:08.731245
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '5c1d7e9f2a64'
+down_revision: Union[str, Sequence[str], None] = '3a42872c17d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('orders', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+    # Существующие заказы считаем не изменявшимися после создания
+    op.execute("UPDATE orders SET updated_at = created_at")
+    op.create_index(op.f('ix_orders_updated_at'), 'orders', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_orders_updated_at'), table_name='orders')
+    # Без batch-режима: пересоздание таблицы удалило бы триггеры orders_fts (нужен SQLite 3.35+)
+    op.drop_column('orders', 'updated_at')
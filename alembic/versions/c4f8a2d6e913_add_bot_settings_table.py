@@ -0,0 +1,33 @@
+"""Add bot_settings table
+
+Revision ID: c4f8a2d6e913
+Revises: b7e3c9a4d215
+Create Date: 2026-10-16 23:48:37.905214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c4f8a2d6e913'
+down_revision: Union[str, Sequence[str], None] = 'b7e3c9a4d215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'bot_settings',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('bot_settings')
@@ -0,0 +1,129 @@
+"""
+Бенчмарк экспорта заказов: CSV (generate_orders_csv) против XLSX (generate_orders_xlsx).
+
+Создает временную SQLite-базу с заданным количеством заказов и замеряет для каждого формата
+время генерации файла, размер файла и пиковое потребление памяти Python (tracemalloc).
+
+Запуск из корневой папки проекта:
+    python benchmarks/bench_export.py --rows 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+# Тестовая база должна быть указана до импорта db.py
+BENCH_DB_PATH = os.path.join(tempfile.gettempdir(), "orders_bot_bench_export.db")
+os.environ["DATABASE_NAME"] = BENCH_DB_PATH
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from config import ORDER_STATUS_KEYS  # noqa: E402
+from models import Base  # noqa: E402
+
+STATUSES = ORDER_STATUS_KEYS
+PAYMENT_METHODS = ["cash", "card_on_delivery"]
+WORDS = ["Молоко", "Хлеб", "Сыр", "Яблоки", "Кофе", "Чай", "Сахар", "Масло", "Рис", "Гречка", "Order", "Pizza"]
+
+
+def seed_database(rows: int):
+    """
+    Создает схему через SQLAlchemy и заполняет таблицу orders случайными заказами.
+    """
+    if os.path.exists(BENCH_DB_PATH):
+        os.remove(BENCH_DB_PATH)
+    engine = create_engine(f"sqlite:///{BENCH_DB_PATH}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(42)
+    started_at = datetime(2024, 1, 1)
+    connection = sqlite3.connect(BENCH_DB_PATH)
+    with connection:
+        connection.executemany(
+            "INSERT INTO orders (user_id, username, order_text, created_at, status, full_name, delivery_address, "
+            "payment_method, contact_phone, delivery_notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    rng.randint(1, 5000),
+                    f"user{index % 5000}",
+                    ", ".join(rng.choices(WORDS, k=rng.randint(2, 8))),
+                    (started_at + timedelta(minutes=index)).strftime("%Y-%m-%d %H:%M:%S"),
+                    rng.choice(STATUSES),
+                    f"Иван Петров {index}",
+                    f"г. Киев, ул. Крещатик, д. {index % 300}",
+                    rng.choice(PAYMENT_METHODS),
+                    f"+38099{index:07d}",
+                    rng.choice(["-", "Позвонить заранее", None]),
+                )
+                for index in range(rows)
+            )
+        )
+    connection.close()
+
+
+async def run_export(export_function, lang: str, trace_memory: bool):
+    """
+    Выполняет один экспорт и возвращает (секунды, размер файла в байтах, пик памяти в байтах или None).
+    """
+    from handlers.admin.admin_export import remove_export_file
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    file_path, _ = await export_function(lang)
+    elapsed = time.perf_counter() - started
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    file_size = os.path.getsize(file_path)
+    remove_export_file(file_path)
+    return elapsed, file_size, peak_memory
+
+
+async def main(rows: int, repeat: int, lang: str):
+    import db
+    from handlers.admin.admin_export import generate_orders_csv, generate_orders_xlsx, shutdown_export_executor
+
+    print(f"Заказов: {rows}, повторов: {repeat}, язык: {lang}")
+    try:
+        for name, export_function in (("CSV", generate_orders_csv), ("XLSX", generate_orders_xlsx)):
+            timings = []
+            file_size = 0
+            for _ in range(repeat):
+                elapsed, file_size, _ = await run_export(export_function, lang, trace_memory=False)
+                timings.append(elapsed)
+            # Память замеряется отдельным прогоном: tracemalloc заметно замедляет выполнение
+            _, _, peak_memory = await run_export(export_function, lang, trace_memory=True)
+            best = min(timings)
+            print(
+                f"{name:>4}: лучшее время {best:.2f} с ({rows / best:,.0f} строк/с), "
+                f"размер {file_size / 1024 / 1024:.1f} МБ, пик памяти Python {peak_memory / 1024 / 1024:.1f} МБ"
+            )
+    finally:
+        shutdown_export_executor()
+        await db.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк экспорта заказов в CSV и XLSX.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Количество заказов в тестовой базе.")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество замеров времени для каждого формата.")
+    parser.add_argument("--lang", default="uk", help="Язык локализации экспорта.")
+    args = parser.parse_args()
+
+    seed_database(args.rows)
+    try:
+        asyncio.run(main(args.rows, args.repeat, args.lang))
+    finally:
+        os.remove(BENCH_DB_PATH)
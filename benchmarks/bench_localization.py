@@ -0,0 +1,93 @@
+"""
+Бенчмарк локализации: получение сообщения и подстановка полей.
+
+Сравнивает прежнюю схему (поиск в загруженном JSON с проверками и запасным языком при каждом вызове,
+затем str.format) с собранным при запуске каталогом: get_localized_message(...).format(...).
+Перед замером проверяет, что для всех ключей всех языков результаты совпадают.
+
+Запуск из корневой папки проекта:
+    python benchmarks/bench_localization.py --number 200000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from localization import LOCALES_DIR, DEFAULT_LANGUAGE, get_available_languages, get_localized_message, \
+    preload_locales  # noqa: E402
+
+# Сообщения без полей, с двумя и с четырьмя полями
+CASES = [
+    ("not_specified", {}),
+    ("my_orders_list_title", {"current_page": 2, "total_pages": 10}),
+    ("admin_search_results_title", {"query_text": "pizza", "current_page": 1, "total_pages": 3, "total_orders": 25}),
+]
+
+
+def load_raw_locales() -> dict:
+    raw_locales = {}
+    for lang_code in get_available_languages():
+        with open(os.path.join(LOCALES_DIR, f"{lang_code}.json"), encoding="utf-8") as f:
+            raw_locales[lang_code] = json.load(f)
+    return raw_locales
+
+
+def make_legacy_lookup(raw_locales: dict):
+    """
+    Прежний get_localized_message (без логирования): проверка загрузки, два поиска и str() на каждый вызов.
+    """
+    def legacy_get_localized_message(key: str, lang_code: str, default_lang_code: str = DEFAULT_LANGUAGE) -> str:
+        if lang_code not in raw_locales and default_lang_code not in raw_locales:
+            return key
+        message = raw_locales.get(lang_code, {}).get(key)
+        if message is None and lang_code != default_lang_code:
+            message = raw_locales.get(default_lang_code, {}).get(key)
+        if message is None:
+            return key
+        return str(message)
+    return legacy_get_localized_message
+
+
+def check_results(raw_locales: dict, legacy_get_localized_message):
+    """
+    Проверяет, что каталог дает те же строки, что и прежняя схема.
+    """
+    checked = 0
+    for lang_code in raw_locales:
+        for key in raw_locales[DEFAULT_LANGUAGE]:
+            legacy_message = legacy_get_localized_message(key, lang_code)
+            assert get_localized_message(key, lang_code) == legacy_message, (lang_code, key)
+            checked += 1
+    print(f"Результаты совпадают для {checked} сообщений.")
+
+
+def main(number: int, lang: str):
+    raw_locales = load_raw_locales()
+    legacy_get_localized_message = make_legacy_lookup(raw_locales)
+    preload_locales()
+    check_results(raw_locales, legacy_get_localized_message)
+
+    print(f"Вызовов: {number}, язык: {lang}")
+    for key, values in CASES:
+        variants = (
+            ("прежний поиск + format", lambda: legacy_get_localized_message(key, lang).format(**values)),
+            ("каталог + format", lambda: get_localized_message(key, lang).format(**values)),
+        )
+        print(f"{key} (полей: {len(values)}):")
+        baseline = None
+        for name, call in variants:
+            best = min(timeit.repeat(call, number=number, repeat=5))
+            baseline = baseline or best
+            print(f"  {name:>22}: {number / best:,.0f} вызовов/с ({baseline / best:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк получения и форматирования локализованных сообщений.")
+    parser.add_argument("--number", type=int, default=200_000, help="Количество вызовов в одном замере.")
+    parser.add_argument("--lang", default="ru", help="Язык локализации.")
+    args = parser.parse_args()
+    main(args.number, args.lang)
@@ -0,0 +1,175 @@
+"""
+Бенчмарк профилей соединения SQLite (config.SQLITE_PROFILES): "default" против "tuned".
+
+Для каждого профиля создается отдельная временная база с заданным количеством заказов и выполняются:
+    insert - несколько конкурентных писателей, каждая вставка заказа в своей транзакции (как add_new_order);
+    mixed  - писатели и читатели одновременно; читатели запрашивают страницу заказов и их количество
+             (как get_all_orders).
+Выводятся операции в секунду, перцентили задержки и количество ошибок "database is locked".
+
+Запуск из корневой папки проекта:
+    python benchmarks/bench_sqlite_profile.py --rows 50000 --writers 4 --readers 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+# Основная база бота не должна затрагиваться при импорте db.py
+os.environ["DATABASE_NAME"] = os.path.join(tempfile.gettempdir(), "orders_bot_bench_profile_unused.db")
+
+from sqlalchemy import create_engine, select, func, insert  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from config import SQLITE_PROFILES  # noqa: E402
+from db import create_sqlite_engine  # noqa: E402
+from models import Base, Order  # noqa: E402
+
+orders_table = Order.__table__
+
+
+def seed_database(database_path: str, rows: int):
+    """
+    Создает схему и заполняет таблицу orders заказами (без профиля, одной транзакцией).
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+    sync_engine = create_engine(f"sqlite:///{database_path}")
+    Base.metadata.create_all(sync_engine)
+    started_at = datetime(2024, 1, 1)
+    with sync_engine.begin() as connection:
+        connection.execute(insert(orders_table), [
+            {
+                "user_id": index % 5000,
+                "username": f"user{index % 5000}",
+                "order_text": f"Заказ {index}: молоко, хлеб, сыр",
+                "created_at": started_at + timedelta(seconds=index),
+                "status": "new",
+                "full_name": f"Иван Петров {index}",
+                "delivery_address": f"г. Киев, ул. Крещатик, д. {index % 300}",
+                "contact_phone": f"+38099{index:07d}",
+            }
+            for index in range(rows)
+        ])
+    sync_engine.dispose()
+
+
+def percentile(latencies, fraction: float) -> float:
+    """
+    Возвращает перцентиль задержки в миллисекундах.
+    """
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000
+
+
+class Stats:
+    """
+    Счетчики операций одного вида: задержки успешных операций и количество ошибок блокировки.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.locked_errors = 0
+
+    def report(self, name: str, elapsed: float) -> str:
+        return (f"{name}: {len(self.latencies) / elapsed:8.0f} оп/с, "
+                f"p50 {percentile(self.latencies, 0.5):6.1f} мс, p99 {percentile(self.latencies, 0.99):7.1f} мс, "
+                f"ошибок блокировки: {self.locked_errors}")
+
+
+async def writer(engine, stats: Stats, user_id: int, deadline: float, max_inserts: int):
+    """
+    Вставляет заказы по одному в отдельных транзакциях до дедлайна или до max_inserts вставок.
+    """
+    inserted = 0
+    while time.perf_counter() < deadline and inserted < max_inserts:
+        started = time.perf_counter()
+        try:
+            async with engine.begin() as connection:
+                await connection.execute(
+                    insert(orders_table).values(user_id=user_id, username=f"user{user_id}", order_text="Новый заказ",
+                                                status="new", created_at=func.now())
+                )
+            stats.latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            stats.locked_errors += 1
+        inserted += 1
+
+
+async def reader(engine, stats: Stats, deadline: float):
+    """
+    Читает первую страницу заказов и общее количество до дедлайна.
+    """
+    page_stmt = select(orders_table).order_by(orders_table.c.created_at.desc(), orders_table.c.id.desc()).limit(10)
+    count_stmt = select(func.count()).select_from(orders_table)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            async with engine.connect() as connection:
+                (await connection.execute(count_stmt)).scalar_one()
+                (await connection.execute(page_stmt)).all()
+            stats.latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            stats.locked_errors += 1
+
+
+async def run_profile(profile: str, args) -> None:
+    database_path = os.path.join(tempfile.gettempdir(), f"orders_bot_bench_profile_{profile}.db")
+    seed_database(database_path, args.rows)
+    engine = create_sqlite_engine(database_path, SQLITE_PROFILES[profile])
+    try:
+        # Прогрев пула: соединения открываются и получают PRAGMA до замеров
+        await asyncio.gather(*(reader(engine, Stats(), time.perf_counter() + 0.1) for _ in range(args.readers)))
+
+        insert_stats = Stats()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            writer(engine, insert_stats, user_id, float("inf"), args.inserts // args.writers)
+            for user_id in range(args.writers)
+        ))
+        insert_elapsed = time.perf_counter() - started
+
+        write_stats, read_stats = Stats(), Stats()
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *(writer(engine, write_stats, user_id, deadline, sys.maxsize) for user_id in range(args.writers)),
+            *(reader(engine, read_stats, deadline) for _ in range(args.readers)),
+        )
+
+        print(f"Профиль '{profile}':")
+        print("  " + insert_stats.report("insert        ", insert_elapsed))
+        print("  " + write_stats.report("mixed, запись ", args.duration))
+        print("  " + read_stats.report("mixed, чтение ", args.duration))
+    finally:
+        await engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+
+
+async def main(args):
+    print(f"Заказов: {args.rows}, писателей: {args.writers}, читателей: {args.readers}, "
+          f"вставок: {args.inserts}, длительность mixed: {args.duration} с")
+    for profile in args.profiles:
+        await run_profile(profile, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк профилей соединения SQLite.")
+    parser.add_argument("--rows", type=int, default=50_000, help="Количество заказов в тестовой базе.")
+    parser.add_argument("--writers", type=int, default=4, help="Количество конкурентных писателей.")
+    parser.add_argument("--readers", type=int, default=8, help="Количество конкурентных читателей (mixed).")
+    parser.add_argument("--inserts", type=int, default=2000, help="Общее количество вставок в тесте insert.")
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность теста mixed, секунд.")
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES), choices=list(SQLITE_PROFILES),
+                        help="Профили для сравнения.")
+    asyncio.run(main(parser.parse_args()))
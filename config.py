@@ -9,6 +9,48 @@ load_dotenv()
 # --- Настройки бота ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Способ получения обновлений: "polling" (long polling) или "webhook" (aiohttp-сервер, см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"Неизвестный BOT_MODE '{BOT_MODE}', допустимые значения: polling, webhook")
+# Максимум одновременно обрабатываемых обновлений в обоих режимах (0 - без ограничения)
+UPDATES_CONCURRENCY_LIMIT = int(os.getenv("UPDATES_CONCURRENCY_LIMIT", 100)) or None
+# Обновления, накопившиеся за время остановки бота, по умолчанию обрабатываются при запуске (update_offset.py);
+# true - пропускать их, как раньше
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").lower() in ("1", "true", "yes")
+# Поллинг: сколько накопившихся обновлений обрабатывать одновременно при запуске (обновления одного
+# пользователя - по порядку) и как часто сохранять в БД ID последнего обработанного обновления, сек
+UPDATES_CATCH_UP_CONCURRENCY = int(os.getenv("UPDATES_CATCH_UP_CONCURRENCY", 50))
+UPDATE_OFFSET_SAVE_INTERVAL = float(os.getenv("UPDATE_OFFSET_SAVE_INTERVAL", 1))
+# Команды меню устанавливаются в Telegram только при их изменении (по сохраненному в БД хэшу);
+# true - при каждом запуске (например, если команды меняли вручную через BotFather)
+FORCE_COMMANDS_SYNC = os.getenv("FORCE_COMMANDS_SYNC", "false").lower() in ("1", "true", "yes")
+
+# --- Вебхук (BOT_MODE=webhook) ---
+# Публичный https-адрес бота без пути; если не задан, вебхук не регистрируется в Telegram (локальная проверка)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token; запросы без него отклоняются.
+# Если не задан при заданном WEBHOOK_URL, секрет генерируется при каждом запуске (см. webhook.py)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")  # Адрес и порт, которые слушает aiohttp-сервер
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# Без секрета и без WEBHOOK_URL сервер принимал бы поддельные обновления (в том числе команды админов
+# от чужого from.id) от любого, кто может к нему подключиться, поэтому так можно слушать только локальный адрес
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET and not WEBHOOK_URL \
+        and WEBHOOK_HOST not in ("127.0.0.1", "localhost", "::1"):
+    raise ValueError(f"WEBHOOK_SECRET не задан, а сервер вебхука слушает '{WEBHOOK_HOST}': задайте WEBHOOK_SECRET "
+                     f"или WEBHOOK_HOST=127.0.0.1 для локальной проверки")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))  # Одновременных соединений от Telegram (1-100)
+
+# --- Несколько процессов (sharding.py) ---
+# WORKERS > 1: основной (фронт) процесс только получает обновления и распределяет их по WORKERS процессам-воркерам
+# по user_id; воркеры - процессы бота, принимающие обновления от фронта по локальному вебхуку
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 8081))  # Воркер N слушает 127.0.0.1:WORKER_BASE_PORT+N
+# Номер воркера; задается фронтом при запуске воркера (в одиночном режиме и во фронте не задан)
+WORKER_INDEX = int(os.environ["WORKER_INDEX"]) if os.getenv("WORKER_INDEX") else None
+
 # ID администраторов
 # ADMIN_IDS: список целых чисел, представляющих Telegram ID администраторов.
 # Если переменная окружения ADMIN_IDS не установлена или пуста, список будет пустым.
@@ -16,6 +58,102 @@ ADMIN_IDS = list(map(int, filter(None, os.getenv("ADMIN_IDS", "").split(','))))
 
 # --- Настройки базы данных ---
 DATABASE_NAME = os.getenv("DATABASE_NAME", "orders_bot.db")
+# Одна сессия БД на обновление Telegram (unit of work) вместо отдельной сессии на каждый вызов db.py
+DB_UNIT_OF_WORK = os.getenv("DB_UNIT_OF_WORK", "true").lower() in ("1", "true", "yes")
+# Интервал (сек) пакетной записи накопленного в памяти времени активности пользователей (users.last_activity_at)
+USER_ACTIVITY_FLUSH_INTERVAL = float(os.getenv("USER_ACTIVITY_FLUSH_INTERVAL", 30))
+# Максимум пользователей, для которых в памяти хранится последняя запись get_or_create_user
+USER_TOUCH_CACHE_SIZE = int(os.getenv("USER_TOUCH_CACHE_SIZE", 10000))
+# Кэш языка и статуса уведомлений пользователей (LRU + TTL), включая отрицательные ответы для неизвестных пользователей
+USER_SETTINGS_CACHE_SIZE = int(os.getenv("USER_SETTINGS_CACHE_SIZE", 10000))
+USER_SETTINGS_CACHE_TTL = float(os.getenv("USER_SETTINGS_CACHE_TTL", 300))  # Время жизни записи кэша, сек
+# Время жизни кэша активных сообщений помощи, сек (0 - до изменения). Воркер не узнает об изменениях, сделанных
+# админом в другом воркере, поэтому для воркеров кэш по умолчанию устаревает через 30 секунд
+HELP_MESSAGES_CACHE_TTL = float(os.getenv("HELP_MESSAGES_CACHE_TTL", 30 if WORKER_INDEX is not None else 0))
+
+# Хранилище FSM: "sqlite" - таблица fsm_records (незавершенные заказы переживают перезапуск), "memory" - в памяти
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+if FSM_STORAGE not in ("sqlite", "memory"):
+    raise ValueError(f"Неизвестный FSM_STORAGE '{FSM_STORAGE}', допустимые значения: sqlite, memory")
+# Сколько ключей FSM хранить в памяти (LRU) для хранилища "sqlite"; 0 - читать состояние из БД на каждое обновление
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+# Ограничения хранилища "memory" (fsm_storage.BoundedMemoryStorage): брошенные диалоги удаляются после
+# FSM_STATE_TTL секунд простоя (0 - не удалять), число записей не больше FSM_MAX_RECORDS
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", 24 * 60 * 60))
+FSM_MAX_RECORDS = int(os.getenv("FSM_MAX_RECORDS", 100000))
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", 600))  # Как часто удалять просроченные записи, сек
+
+# --- Профиль соединения SQLite ---
+# PRAGMA, выполняемые для каждого нового соединения (None - оставить значение SQLite по умолчанию).
+# "tuned": WAL (читатели не блокируют писателя), synchronous=NORMAL (без fsync на каждый коммит в WAL),
+# ожидание блокировки вместо "database is locked", mmap и увеличенный кэш страниц, временные таблицы в памяти.
+# "default": прежнее поведение - rollback journal и настройки SQLite по умолчанию.
+SQLITE_PROFILES = {
+    "default": {
+        "busy_timeout": 5000,  # мс, как timeout=5 в sqlite3 по умолчанию
+        "journal_mode": None,
+        "synchronous": None,
+        "mmap_size": None,
+        "cache_size": None,
+        "temp_store": None,
+    },
+    "tuned": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,  # байт
+        "cache_size": -64 * 1024,  # отрицательное значение - размер в КиБ (64 МиБ)
+        "temp_store": "MEMORY",
+    },
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned").lower()
+if DB_PROFILE not in SQLITE_PROFILES:
+    raise ValueError(f"Неизвестный DB_PROFILE '{DB_PROFILE}', допустимые значения: {', '.join(SQLITE_PROFILES)}")
+# Отдельные PRAGMA профиля можно переопределить переменными окружения SQLITE_<PRAGMA>, например SQLITE_MMAP_SIZE=0
+SQLITE_PRAGMAS = {
+    pragma: os.getenv(f"SQLITE_{pragma.upper()}", value)
+    for pragma, value in SQLITE_PROFILES[DB_PROFILE].items()
+}
+# Пул соединений aiosqlite: каждое соединение - отдельный поток; проверка соединения (pre-ping) для
+# локального файла не нужна и только добавляет запрос на каждое получение соединения из пула
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", 10))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# Все записи в БД идут через одно выделенное соединение, которое обслуживает очередь записи (db.start_db_writer):
+# несколько небольших записей объединяются в одну транзакцию, а чтения идут через отдельный read-only пул
+DB_WRITE_QUEUE = os.getenv("DB_WRITE_QUEUE", "true").lower() in ("1", "true", "yes")
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", 50))  # Максимум записей в одной транзакции очереди записи
+# Статистика SQL-запросов (db_metrics.py): гистограммы задержек по функциям db.py и лог медленных запросов.
+# Статистику с момента запуска админ смотрит командой /dbstats [N]
+DB_QUERY_STATS = os.getenv("DB_QUERY_STATS", "true").lower() in ("1", "true", "yes")
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))  # Запросы дольше порога (мс) пишутся в лог db.slow_queries
+DB_QUERY_STATS_TOP = int(os.getenv("DB_QUERY_STATS_TOP", 10))  # Сколько запросов показывать в /dbstats по умолчанию
+
+# --- Уведомления ---
+# Максимум одновременных запросов к Telegram при рассылке уведомлений (например, админам о новом заказе)
+NOTIFICATION_CONCURRENCY = int(os.getenv("NOTIFICATION_CONCURRENCY", 5))
+# Сколько раз повторять отправку после ответа Telegram "Too Many Requests" (TelegramRetryAfter), если отправки
+# не проходят через планировщик исходящих сообщений (с ним повторяет только планировщик, см. OUTBOUND_MAX_RETRIES)
+NOTIFICATION_MAX_RETRIES = int(os.getenv("NOTIFICATION_MAX_RETRIES", 3))
+
+# --- Планировщик исходящих сообщений (outbound.py) ---
+# Отправка и изменение сообщений ограничиваются ведрами токенов: общим и отдельным для каждого чата.
+# Ответы на действия пользователя обслуживаются раньше фоновых отправок (рассылки, экспорт).
+OUTBOUND_SCHEDULER = os.getenv("OUTBOUND_SCHEDULER", "true").lower() in ("1", "true", "yes")
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 25))  # Сообщений в секунду на всего бота
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", 1))  # Сообщений в секунду в один личный чат
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", 20 / 60))  # Сообщений в секунду в одну группу
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", 3))  # Допустимая пачка сообщений в один чат
+# Сколько раз планировщик повторяет запрос после TelegramRetryAfter, прежде чем вернуть ошибку
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 5))
+
+# --- Рассылки (handlers/admin/admin_broadcast_jobs.py) ---
+# Рассылка отправляется с самым низким приоритетом планировщика исходящих сообщений и собственным лимитом,
+# оставляя запас общего лимита для ответов пользователям и уведомлений
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 20))  # Сообщений рассылки в секунду
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 200))  # Получателей в пачке; прогресс сохраняется после пачки
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))  # Одновременных запросов к Telegram
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))  # Как часто обновлять статус у админа, сек
 
 # --- Настройки логирования ---
 LOGGING_LEVEL = logging.INFO  # Уровень логирования: INFO, DEBUG, WARNING, ERROR, CRITICAL
@@ -28,6 +166,14 @@ MAX_PREVIEW_TEXT_LENGTH = int(
 # --- Настройки отображения заказов для ПОЛЬЗОВАТЕЛЕЙ ---
 USER_ORDERS_PER_PAGE = int(os.getenv("USER_ORDERS_PER_PAGE", 5)) # Количество заказов на одной странице в пагинации для ПОЛЬЗОВАТЕЛЕЙ
 
+# --- Настройки экспорта заказов ---
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))  # Количество заказов, читаемых из БД за один раз при экспорте
+EXPORT_TMP_DIR = os.getenv("EXPORT_TMP_DIR") or None  # Каталог для временных файлов экспорта (по умолчанию системный)
+EXPORT_EXECUTOR = os.getenv("EXPORT_EXECUTOR", "thread").lower()  # Пул для рендеринга экспорта: "thread" или "process"
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))  # Количество воркеров в пуле экспорта
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))  # Максимум одновременно выполняемых экспортов
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", 3))  # Минимальный интервал (сек) между сообщениями о прогрессе экспорта
+
 # --- Системные ключи для статусов заказов ---
 # Эти ключи будут использоваться для получения локализованных названий из JSON.
 # 'ORDER_STATUS_MAP' удален, так как его содержимое теперь в локализациях.
@@ -1,21 +1,50 @@
+import asyncio
 import logging
-from typing import List, Optional, Tuple
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple, AsyncIterator, Sequence, Any
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import partial
 
-from sqlalchemy import select, func, or_, event
+from sqlalchemy import select, insert, update, delete, func, or_, and_, event, literal, literal_column, union_all, \
+    type_coerce, Table, MetaData, Column, Integer, Float, String, Select, bindparam
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.dialects.sqlite.aiosqlite import AsyncAdapt_aiosqlite_connection
 
-from config import DATABASE_NAME, LOGGING_LEVEL
-from models import Base, Order, HelpMessage, User
+from config import DATABASE_NAME, LOGGING_LEVEL, EXPORT_CHUNK_SIZE, USER_ACTIVITY_FLUSH_INTERVAL, \
+    USER_TOUCH_CACHE_SIZE, USER_SETTINGS_CACHE_SIZE, USER_SETTINGS_CACHE_TTL, HELP_MESSAGES_CACHE_TTL, DB_PROFILE, SQLITE_PRAGMAS, DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_PRE_PING, \
+    DB_WRITE_QUEUE, DB_WRITE_BATCH_SIZE, DB_QUERY_STATS, BROADCAST_CHUNK_SIZE
+from db_metrics import instrument_engine
+from models import Base, Order, HelpMessage, User, Broadcast, FsmRecord, BotSetting
 
 # Настройка логирования
 logging.basicConfig(level=LOGGING_LEVEL)
 logger = logging.getLogger(__name__)
 
 
+# Полнотекстовый индекс заказов (FTS5). Создается миграцией Alembic и поддерживается триггерами,
+# поэтому объявлен в отдельной MetaData, а не в Base.metadata.
+orders_fts = Table(
+    "orders_fts",
+    MetaData(),
+    Column("rowid", Integer),
+    Column("rank", Float),
+)
+
+# Минимальная длина запроса для триграммного индекса; более короткие ищутся через LIKE
+FTS_MIN_QUERY_LENGTH = 3
+# Ранг точного совпадения по ID: bm25 в FTS5 отрицателен, меньше - релевантнее
+EXACT_ID_MATCH_RANK = -1e9
+
+
 # Пользовательская функция LOWER для SQLite с поддержкой Unicode
+# (нужна только резервному поиску по коротким запросам, основной поиск идет через orders_fts)
 def _sqlite_unicode_lower(value: str | None) -> str | None:
     """
     Пользовательская функция для SQLite, которая корректно переводит
@@ -26,12 +55,79 @@ def _sqlite_unicode_lower(value: str | None) -> str | None:
     return value.lower()
 
 
-# Асинхронный движок базы данных
-engine: AsyncEngine = create_async_engine(
-    f"sqlite+aiosqlite:///{DATABASE_NAME}",
-    echo=False,  # Установите в True, чтобы видеть сгенерированные SQL-запросы в консоли
-    pool_pre_ping=True  # Проверяет соединение перед использованием из пула
+def _set_sqlite_pragma(pragmas: Dict[str, Any], dbapi_connection, _connection_record):
+    """
+    Устанавливает PRAGMA для SQLite: внешние ключи, параметры профиля соединения (config.SQLITE_PRAGMAS)
+    и пользовательскую функцию LOWER.
+    """
+    if isinstance(dbapi_connection, AsyncAdapt_aiosqlite_connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        # busy_timeout задается первым, чтобы смена journal_mode тоже ждала освобождения блокировки
+        for pragma, value in pragmas.items():
+            if value is not None:
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        # Регистрируем пользовательскую функцию LOWER для SQLite
+        dbapi_connection.create_function("LOWER", 1, _sqlite_unicode_lower)
+        cursor.close()
+
+
+def _disable_pysqlite_transactions(dbapi_connection, _connection_record):
+    """
+    Отключает собственное управление транзакциями драйвера sqlite3: транзакции открывает слушатель "begin".
+    """
+    dbapi_connection.isolation_level = None
+
+
+def _begin_immediate(connection):
+    """
+    Открывает транзакцию сразу с блокировкой записи (BEGIN IMMEDIATE), а не при первом изменении.
+    Вместе с _disable_pysqlite_transactions это также делает рабочими SAVEPOINT (session.begin_nested()).
+    """
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def create_sqlite_engine(
+        database_name: str,
+        pragmas: Dict[str, Any],
+        pool_size: int = DB_POOL_SIZE,
+        max_overflow: int = DB_POOL_MAX_OVERFLOW,
+        begin_immediate: bool = False
+) -> AsyncEngine:
+    """
+    Создает асинхронный движок SQLite (aiosqlite) с профилем соединения pragmas и настройками пула из config.py.
+    begin_immediate=True включает явные транзакции BEGIN IMMEDIATE (используется движком записи).
+    """
+    new_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_name}",
+        echo=False,  # Установите в True, чтобы видеть сгенерированные SQL-запросы в консоли
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_size=pool_size,
+        max_overflow=max_overflow
+    )
+    event.listen(new_engine.sync_engine, "connect", partial(_set_sqlite_pragma, pragmas))
+    if begin_immediate:
+        event.listen(new_engine.sync_engine, "connect", _disable_pysqlite_transactions)
+        event.listen(new_engine.sync_engine, "begin", _begin_immediate)
+    return new_engine
+
+
+# Асинхронный движок базы данных. При включенной очереди записи (DB_WRITE_QUEUE) он только читает:
+# соединения пула открываются с query_only, а все изменения идут через write_engine.
+engine: AsyncEngine = create_sqlite_engine(
+    DATABASE_NAME, {**SQLITE_PRAGMAS, "query_only": "ON" if DB_WRITE_QUEUE else None}
 )
+logger.info(f"Профиль соединения SQLite '{DB_PROFILE}': {SQLITE_PRAGMAS}")
+
+# Движок записи: одно соединение, которое обслуживает очередь записи (start_db_writer)
+write_engine: AsyncEngine = create_sqlite_engine(
+    DATABASE_NAME, SQLITE_PRAGMAS, pool_size=1, max_overflow=0, begin_immediate=True
+) if DB_WRITE_QUEUE else engine
+
+if DB_QUERY_STATS:
+    instrument_engine(engine)
+    if write_engine is not engine:
+        instrument_engine(write_engine)
 
 # Создание асинхронной сессии
 AsyncSessionLocal = sessionmaker(
@@ -40,26 +136,154 @@ AsyncSessionLocal = sessionmaker(
     bind=engine
 )
 
+# Сессии очереди записи
+WriteSessionLocal = sessionmaker(
+    expire_on_commit=False,
+    class_=AsyncSession,
+    bind=write_engine
+)
+
+
+# Сессия текущего обновления Telegram (unit of work).
+# Устанавливается DbSessionMiddleware через unit_of_work(); вне обновления равна None.
+_update_session: ContextVar[Optional[AsyncSession]] = ContextVar("_update_session", default=None)
+
 
-@event.listens_for(engine.sync_engine, "connect")
-def _set_sqlite_pragma(dbapi_connection, _connection_record):
+@event.listens_for(Session, "after_flush")
+def _mark_session_writes_on_flush(session, _flush_context):
     """
-    Устанавливает PRAGMA для SQLite для поддержки внешних ключей и пользовательской функции LOWER.
+    Помечает сессию как пишущую, если ORM сбросил в БД изменения объектов.
     """
-    if isinstance(dbapi_connection, AsyncAdapt_aiosqlite_connection):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        # Регистрируем пользовательскую функцию LOWER для SQLite
-        dbapi_connection.create_function("LOWER", 1, _sqlite_unicode_lower)
-        cursor.close()
+    session.info["has_writes"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_session_writes_on_execute(orm_execute_state):
+    """
+    Помечает сессию как пишущую при выполнении INSERT/UPDATE/DELETE через session.execute().
+    """
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _refresh_objects_after_external_writes(orm_execute_state):
+    """
+    После записи через очередь (get_write_session) объекты в сессии обновления могут быть устаревшими:
+    последующие SELECT этой сессии перезаписывают их загруженными из БД значениями.
+    """
+    if orm_execute_state.is_select and orm_execute_state.session.info.get("external_writes"):
+        orm_execute_state.update_execution_options(populate_existing=True)
+
+
+def _call_after_commit(session: AsyncSession, callback: Callable[[], None]):
+    """
+    Вызывает callback после фиксации внешней транзакции сессии. При откате транзакции или точки
+    сохранения, в которой callback зарегистрирован (запроса в пачке очереди записи), callback не вызывается.
+    """
+    session.info.setdefault("after_commit_callbacks", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit_callbacks(session):
+    # Событие срабатывает и при фиксации точки сохранения: ее изменения еще не записаны
+    if session.in_nested_transaction():
+        return
+    for callback in session.info.pop("after_commit_callbacks", ()):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике фиксации транзакции: {e}", exc_info=True)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_after_commit_callbacks(session, previous_transaction):
+    """
+    Отбрасывает callbacks при откате внешней транзакции. Откат точки сохранения их не трогает:
+    callbacks запроса, откатившего свою точку сохранения, отбрасывает _run_write_request.
+    """
+    if not previous_transaction.nested:
+        session.info.pop("after_commit_callbacks", None)
+
+
+def _session_has_writes(session: AsyncSession) -> bool:
+    """
+    Проверяет, выполнялись ли в сессии изменения, которые нужно зафиксировать.
+    """
+    return bool(session.info.get("has_writes") or session.new or session.dirty or session.deleted)
+
+
+async def _commit_if_has_writes(session: AsyncSession):
+    """
+    Фиксирует транзакцию только если в ней были записи.
+    Для read-only обновлений коммит пропускается: транзакция закрывается вместе с сессией.
+    """
+    if _session_has_writes(session):
+        await session.commit()
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """
+    Открывает одну сессию базы данных на всё обновление Telegram (unit of work).
+    Все функции db.py, вызванные внутри блока, переиспользуют эту сессию вместо открытия своей
+    (или получают ее явно через параметр session) в одной транзакции. Транзакция фиксируется один раз
+    в конце (и пропускается, если обновление только читало данные) либо раньше, перед запросом
+    к Telegram API: тогда ее соединение возвращается в пул на время запроса (release_update_connection).
+    Используется DbSessionMiddleware.
+    """
+    async with AsyncSessionLocal() as session:
+        token = _update_session.set(session)
+        try:
+            yield session
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка транзакции базы данных в рамках обновления: {e}")
+            await session.rollback()
+            raise
+        except Exception:
+            # Ошибка вне БД (например, Telegram API) не должна терять уже выполненные записи,
+            # как это было и при отдельной сессии на каждый вызов.
+            await _commit_if_has_writes(session)
+            raise
+        else:
+            # Изменения, сделанные хендлером напрямую через сессию обновления
+            await _commit_if_has_writes(session)
+        finally:
+            _update_session.reset(token)
+
+
+async def release_update_connection(session: Optional[AsyncSession] = None):
+    """
+    Завершает транзакцию сессии текущего обновления (или переданной session) и возвращает ее соединение
+    в пул перед ожиданием вне БД: запросом к Telegram API, очередью планировщика исходящих сообщений
+    или очередью записи. Уже выполненные записи фиксируются: SQLite не должен держать блокировку записи
+    во время сетевого запроса. Объекты сессии остаются загруженными (expire_on_commit=False).
+    """
+    update_session = session if session is not None else _update_session.get()
+    if update_session is not None and update_session.in_transaction():
+        await update_session.commit()
+        update_session.info.pop("has_writes", None)
 
 
 @asynccontextmanager
-async def get_db_session():
+async def get_db_session(session: Optional[AsyncSession] = None):
     """
     Предоставляет асинхронную сессию базы данных.
     Используется как контекстный менеджер (async with).
+    Если передана session или вызов происходит внутри unit_of_work(), возвращает эту сессию
+    без отдельной фиксации: транзакцию завершит unit_of_work().
     """
+    shared_session = session if session is not None else _update_session.get()
+    if shared_session is not None:
+        try:
+            yield shared_session
+        finally:
+            # После неудачного flush сессия непригодна до отката
+            if not shared_session.is_active:
+                await shared_session.rollback()
+                shared_session.info.pop("has_writes", None)
+        return
+
     async with AsyncSessionLocal() as session:
         try:
             yield session
@@ -70,6 +294,180 @@ async def get_db_session():
             raise
 
 
+# --- Очередь записи (один писатель SQLite) ---
+
+@dataclass
+class _WriteRequest:
+    """
+    Запрос на запись в очереди. Писатель передает сессию через session_ready, вызывающий код
+    сообщает о завершении своих изменений через body_done (True - успешно), а писатель сообщает
+    о фиксации пачки через committed.
+    """
+    session_ready: asyncio.Future
+    body_done: asyncio.Future
+    committed: asyncio.Future
+
+
+# Очередь запросов на запись и задача писателя; None, если писатель не запущен
+_write_queue: Optional[asyncio.Queue] = None
+_db_writer: Optional[asyncio.Task] = None
+
+
+async def _run_write_request(session: AsyncSession, request: _WriteRequest):
+    """
+    Выполняет изменения одного запроса в отдельной точке сохранения (SAVEPOINT) транзакции пачки:
+    ошибка одного запроса откатывает только его изменения и его обработчики фиксации (_call_after_commit).
+    """
+    if request.session_ready.done():
+        return  # Вызывающий код отменен, пока ждал очереди
+
+    after_commit_callbacks = session.info.setdefault("after_commit_callbacks", [])
+    callbacks_before = len(after_commit_callbacks)
+    savepoint = await session.begin_nested()
+    request.session_ready.set_result(session)
+    try:
+        body_succeeded = await request.body_done
+        if body_succeeded:
+            await savepoint.commit()
+            return
+    except Exception as e:
+        # Ошибка при сбросе изменений запроса (например, нарушение ограничения)
+        if not request.committed.done():
+            request.committed.set_exception(e)
+    await savepoint.rollback()
+    del after_commit_callbacks[callbacks_before:]
+
+
+async def _run_db_writer(write_queue: asyncio.Queue):
+    """
+    Писатель: забирает запросы из очереди и выполняет их по одному в общей транзакции,
+    добавляя в пачку запросы, пришедшие за время ее выполнения (не более DB_WRITE_BATCH_SIZE).
+    Пачка фиксируется одним COMMIT. Пустой запрос (None) останавливает писателя.
+    """
+    stop_requested = False
+    while not stop_requested:
+        request = await write_queue.get()
+        if request is None:
+            return
+
+        requests = [request]
+        async with WriteSessionLocal() as session:
+            try:
+                index = 0
+                while index < len(requests):
+                    await _run_write_request(session, requests[index])
+                    index += 1
+                    while not stop_requested and len(requests) < DB_WRITE_BATCH_SIZE and not write_queue.empty():
+                        next_request = write_queue.get_nowait()
+                        if next_request is None:
+                            stop_requested = True
+                        else:
+                            requests.append(next_request)
+                await session.commit()
+            except BaseException as e:
+                logger.error(f"Ошибка транзакции очереди записи ({len(requests)} запросов): {e}")
+                failure = e if isinstance(e, Exception) else SQLAlchemyError("Очередь записи остановлена")
+                for failed_request in requests:
+                    for future in (failed_request.session_ready, failed_request.committed):
+                        if not future.done():
+                            future.set_exception(failure)
+                if not isinstance(e, Exception):
+                    raise
+                continue
+
+        for committed_request in requests:
+            if not committed_request.committed.done():
+                committed_request.committed.set_result(None)
+        logger.debug(f"Очередь записи зафиксировала пачку из {len(requests)} запросов.")
+
+
+def start_db_writer():
+    """
+    Запускает писателя очереди записи. Вызывается при запуске бота; без DB_WRITE_QUEUE ничего не делает.
+    """
+    global _write_queue, _db_writer
+    if DB_WRITE_QUEUE and _db_writer is None:
+        _write_queue = asyncio.Queue()
+        _db_writer = asyncio.create_task(_run_db_writer(_write_queue), name="db-writer")
+        logger.info(f"Запущена очередь записи в БД (пачка до {DB_WRITE_BATCH_SIZE} запросов).")
+
+
+async def stop_db_writer():
+    """
+    Останавливает писателя, дождавшись фиксации уже поставленных в очередь запросов. Вызывается при остановке бота.
+    """
+    global _write_queue, _db_writer
+    if _db_writer is None:
+        return
+    # Новые записи сразу идут мимо очереди, поэтому за маркером остановки запросов не появится
+    write_queue, _write_queue = _write_queue, None
+    write_queue.put_nowait(None)
+    try:
+        await _db_writer
+    except Exception as e:
+        logger.error(f"Ошибка при остановке очереди записи: {e}")
+    _db_writer = None
+    logger.info("Очередь записи в БД остановлена.")
+
+
+async def _after_external_write(session: Optional[AsyncSession] = None):
+    """
+    Завершает читающую транзакцию сессии обновления (или явно переданной session) после записи через очередь:
+    в режиме WAL открытая транзакция продолжала бы видеть снимок БД до записи.
+    """
+    update_session = session if session is not None else _update_session.get()
+    if update_session is not None:
+        update_session.info["external_writes"] = True
+        await update_session.commit()
+
+
+@asynccontextmanager
+async def get_write_session(session: Optional[AsyncSession] = None):
+    """
+    Предоставляет сессию для изменения данных (async with).
+    При запущенной очереди записи изменения выполняются единственным писателем в общей с другими
+    запросами транзакции и считаются записанными после выхода из блока (фиксации пачки).
+    Внутри блока должны быть только операции с БД: пока он выполняется, остальные записи ждут.
+    Без DB_WRITE_QUEUE работает как get_db_session(session), а до запуска писателя открывает отдельную
+    сессию записи. Переданная session (сессия обновления) при очереди записи только обновляется после записи.
+    """
+    if not DB_WRITE_QUEUE:
+        async with get_db_session(session) as db:
+            yield db
+        return
+
+    if _write_queue is None:
+        async with WriteSessionLocal() as db:
+            try:
+                yield db
+                await db.commit()
+            except Exception as e:
+                logger.error(f"Ошибка транзакции записи: {e}")
+                await db.rollback()
+                raise
+        await _after_external_write(session)
+        return
+
+    # Пока запрос ждет писателя, читающая транзакция обновления не должна держать соединение пула
+    await release_update_connection(session)
+    loop = asyncio.get_running_loop()
+    request = _WriteRequest(loop.create_future(), loop.create_future(), loop.create_future())
+    _write_queue.put_nowait(request)
+    try:
+        # Отмена во время ожидания отменяет и session_ready (писатель пропустит запрос), но если писатель
+        # уже передал сессию, он ждет body_done: его нужно завершить и в этом случае
+        write_session = await request.session_ready
+        yield write_session
+    except BaseException:
+        if not request.body_done.done():
+            request.body_done.set_result(False)
+        raise
+    if not request.body_done.done():
+        request.body_done.set_result(True)
+    await request.committed
+    await _after_external_write(session)
+
+
 # Функция create_tables_async больше не нужна для создания таблиц,
 # так как это будет делать Alembic.
 # Если она используется для чего-то еще, оставьте ее, но удалите вызов create_all.
@@ -83,111 +481,357 @@ async def create_tables_async():
     pass  # Или удалите эту функцию, если она больше не нужна вовсе
 
 
+async def warm_up_db():
+    """
+    Прогревает БД при запуске бота: одновременно открывает соединения пула чтения (с PRAGMA профиля SQLite)
+    и соединение записи и загружает кэш активных сообщений помощи, чтобы первые обновления не ждали этого.
+    """
+    async def _open_connection(db_engine: AsyncEngine):
+        async with db_engine.connect() as connection:
+            await connection.exec_driver_sql("SELECT 1")
+
+    # Соединения открыты одновременно, поэтому это разные соединения; пул сохранит их для следующих запросов
+    await asyncio.gather(
+        *(_open_connection(engine) for _ in range(DB_POOL_SIZE)),
+        *([_open_connection(write_engine)] if write_engine is not engine else []),
+        get_active_help_messages()
+    )
+
+
 # --- Функции для работы с пользователями ---
 
+# Последние записанные get_or_create_user данные пользователей: user_id -> (username, first_name, last_name)
+_user_touches: "OrderedDict[int, Tuple[Optional[str], Optional[str], Optional[str]]]" = OrderedDict()
+
+
+def _is_user_data_unchanged(
+        user_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str]
+) -> bool:
+    """
+    Проверяет, что username и имена пользователя совпадают с последними записанными в БД этим процессом.
+    """
+    return _user_touches.get(user_id) == (username, first_name, last_name)
+
+
+def _remember_user_touch(
+        user_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str]
+):
+    """
+    Запоминает записанные данные пользователя; самые давние записи вытесняются при превышении USER_TOUCH_CACHE_SIZE.
+    """
+    _user_touches[user_id] = (username, first_name, last_name)
+    _user_touches.move_to_end(user_id)
+    while len(_user_touches) > USER_TOUCH_CACHE_SIZE:
+        _user_touches.popitem(last=False)
+
+
 async def get_or_create_user(
         user_id: int,
         username: Optional[str] = None,
         first_name: Optional[str] = None,
         last_name: Optional[str] = None,
+        session: Optional[AsyncSession] = None,
 ) -> User:
     """
     Получает пользователя по user_id или создает нового, если он не существует.
-    Обновляет username, first_name, last_name и last_activity_at при каждом обращении.
+    Обновляет username, first_name, last_name и last_activity_at одним запросом
+    INSERT ... ON CONFLICT(user_id) DO UPDATE ... RETURNING.
+    Если данные не изменились, запись пропускается: пользователь только читается,
+    а время активности записывается через буфер активности (touch_user_activity).
     """
-    async with get_db_session() as db:
-        stmt = select(User).where(User.user_id == user_id)
-        result = await db.execute(stmt)
-        user = result.scalar_one_or_none()
-
-        if user:
-            # Обновляем данные пользователя, если они изменились
-            user.username = username
-            user.first_name = first_name
-            user.last_name = last_name
-            user.last_activity_at = func.now()  # Использование last_activity_at
-            logger.debug(f"Пользователь {user_id} обновлен в БД.")
-        else:
-            # Создаем нового пользователя
-            user = User(
-                user_id=user_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name
-            )
-            db.add(user)
-            logger.info(f"Новый пользователь {user_id} добавлен в БД.")
+    if _is_user_data_unchanged(user_id, username, first_name, last_name):
+        async with get_db_session(session) as db:
+            user = (await db.execute(select(User).where(User.user_id == user_id))).scalar_one_or_none()
+        if user is not None:
+            touch_user_activity(user_id)
+            return user
 
-        await db.flush()  # Убедимся, что user.id доступен, если это новый пользователь
-        await db.refresh(user)  # Обновляем объект, чтобы получить актуальные данные
-        return user
+    async with get_write_session(session) as db:
+        insert_stmt = sqlite_insert(User).values(
+            user_id=user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name
+        )
+        upsert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[User.user_id],
+            set_={
+                "username": insert_stmt.excluded.username,
+                "first_name": insert_stmt.excluded.first_name,
+                "last_name": insert_stmt.excluded.last_name,
+                "last_activity_at": func.now(),
+            }
+        ).returning(User)
+        result = await db.execute(upsert_stmt, execution_options={"populate_existing": True})
+        user = result.scalar_one()
+        _mark_user_settings_changed(db, user_id)
+    _remember_user_touch(user_id, username, first_name, last_name)
+    _remember_user_settings(user_id, (user.language_code, user.notifications_enabled))
+    logger.debug(f"Пользователь {user_id} добавлен или обновлен в БД.")
+    return user
+
+
+# --- Буфер активности пользователей (write-behind) ---
+
+# Время последней активности пользователей, еще не записанное в БД: user_id -> datetime (UTC)
+_pending_activity: Dict[int, datetime] = {}
+# Фоновая задача периодической записи буфера активности
+_activity_flusher: Optional[asyncio.Task] = None
+
+
+def touch_user_activity(user_id: int):
+    """
+    Отмечает активность пользователя в памяти, без обращения к БД.
+    Накопленные отметки записываются одним пакетным UPDATE (flush_user_activity)
+    каждые USER_ACTIVITY_FLUSH_INTERVAL секунд и при остановке бота.
+    """
+    _pending_activity[user_id] = datetime.now(timezone.utc)
 
 
-async def get_user_language_code(user_id: int) -> str:
+async def flush_user_activity() -> int:
     """
-    Получает код языка пользователя из базы данных.
+    Записывает накопленные отметки активности в users.last_activity_at одной транзакцией (executemany).
+    При ошибке отметки возвращаются в буфер до следующей попытки.
+    Возвращает количество записанных отметок.
+    """
+    global _pending_activity
+    if not _pending_activity:
+        return 0
+
+    pending_activity, _pending_activity = _pending_activity, {}
+    users_table = User.__table__
+    stmt = (
+        users_table.update()
+        .where(users_table.c.user_id == bindparam("touched_user_id"))
+        .values(last_activity_at=bindparam("touched_at", type_=users_table.c.last_activity_at.type))
+    )
+    try:
+        async with get_write_session() as db:
+            await db.execute(stmt, [
+                {"touched_user_id": user_id, "touched_at": touched_at}
+                for user_id, touched_at in pending_activity.items()
+            ])
+    except Exception as e:
+        logger.error(f"Ошибка при записи активности пользователей ({len(pending_activity)}): {e}")
+        # Более свежие отметки, сделанные во время записи, не перезаписываем
+        for user_id, touched_at in pending_activity.items():
+            _pending_activity.setdefault(user_id, touched_at)
+        raise
+
+    logger.debug(f"Записана активность пользователей: {len(pending_activity)}.")
+    return len(pending_activity)
+
+
+async def _flush_user_activity_periodically():
+    """
+    Фоновая задача: записывает буфер активности каждые USER_ACTIVITY_FLUSH_INTERVAL секунд.
+    """
+    while True:
+        await asyncio.sleep(USER_ACTIVITY_FLUSH_INTERVAL)
+        try:
+            await flush_user_activity()
+        except Exception:
+            pass  # Ошибка уже залогирована, отметки остались в буфере
+
+
+def start_user_activity_flusher():
+    """
+    Запускает фоновую запись буфера активности. Вызывается при запуске бота.
+    """
+    global _activity_flusher
+    if _activity_flusher is None:
+        _activity_flusher = asyncio.create_task(_flush_user_activity_periodically(), name="user-activity-flusher")
+        logger.info(f"Запущена запись активности пользователей каждые {USER_ACTIVITY_FLUSH_INTERVAL} с.")
+
+
+async def stop_user_activity_flusher():
+    """
+    Останавливает фоновую запись и записывает оставшиеся отметки активности. Вызывается при остановке бота.
+    """
+    global _activity_flusher
+    if _activity_flusher is not None:
+        _activity_flusher.cancel()
+        try:
+            await _activity_flusher
+        except asyncio.CancelledError:
+            pass
+        _activity_flusher = None
+    try:
+        flushed = await flush_user_activity()
+        logger.info(f"Буфер активности пользователей записан при остановке ({flushed}).")
+    except Exception as e:
+        logger.error(f"Не удалось записать буфер активности пользователей при остановке: {e}")
+
+
+# --- Кэш настроек пользователей (язык и уведомления) ---
+
+# user_id -> (момент устаревания по time.monotonic(), (language_code, notifications_enabled) или None,
+# если пользователя нет в БД). Самые давние записи вытесняются при превышении USER_SETTINGS_CACHE_SIZE.
+_user_settings_cache: "OrderedDict[int, Tuple[float, Optional[Tuple[str, bool]]]]" = OrderedDict()
+
+
+def _remember_user_settings(user_id: int, settings: Optional[Tuple[str, bool]]):
+    """
+    Сохраняет настройки пользователя (или их отсутствие) в кэше на USER_SETTINGS_CACHE_TTL секунд.
+    """
+    _user_settings_cache[user_id] = (time.monotonic() + USER_SETTINGS_CACHE_TTL, settings)
+    _user_settings_cache.move_to_end(user_id)
+    while len(_user_settings_cache) > USER_SETTINGS_CACHE_SIZE:
+        _user_settings_cache.popitem(last=False)
+
+
+def invalidate_user_settings(user_id: int):
+    """
+    Удаляет настройки пользователя из кэша; следующее обращение прочитает их из БД.
+    """
+    _user_settings_cache.pop(user_id, None)
+
+
+def _mark_user_settings_changed(session: AsyncSession, user_id: int):
+    """
+    Отмечает, что транзакция сессии изменяет настройки пользователя: после ее фиксации или отката
+    запись кэша удаляется (она могла быть прочитана из незафиксированных данных).
+    """
+    session.info.setdefault("changed_user_settings", set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_user_settings_after_transaction(session):
+    # Точка сохранения запроса в пачке очереди записи: изменения станут видны только после COMMIT пачки
+    if session.in_nested_transaction():
+        return
+    for user_id in session.info.pop("changed_user_settings", ()):
+        invalidate_user_settings(user_id)
+
+
+async def _get_user_settings(user_id: int, session: Optional[AsyncSession] = None) -> Optional[Tuple[str, bool]]:
+    """
+    Возвращает (language_code, notifications_enabled) пользователя или None, если его нет в БД.
+    Повторные обращения в пределах USER_SETTINGS_CACHE_TTL обслуживаются из кэша без запроса к БД.
+    """
+    cached = _user_settings_cache.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        _user_settings_cache.move_to_end(user_id)
+        return cached[1]
+
+    async with get_db_session(session) as db:
+        stmt = select(User.language_code, User.notifications_enabled).where(User.user_id == user_id)
+        row = (await db.execute(stmt)).one_or_none()
+    settings = (row.language_code, row.notifications_enabled) if row is not None else None
+    _remember_user_settings(user_id, settings)
+    return settings
+
+
+async def get_user_language_code(user_id: int, session: Optional[AsyncSession] = None) -> str:
+    """
+    Получает код языка пользователя (через кэш настроек пользователей).
     Возвращает 'uk' (украинский) по умолчанию, если пользователь не найден.
     """
-    async with get_db_session() as db:
-        stmt = select(User.language_code).where(User.user_id == user_id)
-        result = await db.execute(stmt)
-        language_code = result.scalar_one_or_none()
-        if language_code:
-            return language_code
-        return 'uk'  # Язык по умолчанию
+    settings = await _get_user_settings(user_id, session)
+    if settings is not None and settings[0]:
+        return settings[0]
+    return 'uk'  # Язык по умолчанию
+
+
+async def get_users_language_codes(user_ids: Sequence[int], session: Optional[AsyncSession] = None) -> Dict[int, str]:
+    """
+    Получает коды языков нескольких пользователей: из кэша настроек, а отсутствующие в нем - одним запросом.
+    Для пользователей, не найденных в БД, возвращается 'uk'.
+    """
+    now = time.monotonic()
+    settings_by_user: Dict[int, Optional[Tuple[str, bool]]] = {}
+    missing_user_ids = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = _user_settings_cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            settings_by_user[user_id] = cached[1]
+        else:
+            missing_user_ids.append(user_id)
 
+    if missing_user_ids:
+        async with get_db_session(session) as db:
+            stmt = select(User.user_id, User.language_code, User.notifications_enabled) \
+                .where(User.user_id.in_(missing_user_ids))
+            rows = {row.user_id: (row.language_code, row.notifications_enabled) for row in await db.execute(stmt)}
+        for user_id in missing_user_ids:
+            settings_by_user[user_id] = rows.get(user_id)
+            _remember_user_settings(user_id, rows.get(user_id))
 
-async def update_user_language(user_id: int, new_language_code: str) -> Optional[User]:
+    return {
+        user_id: settings[0] if settings is not None and settings[0] else 'uk'
+        for user_id, settings in settings_by_user.items()
+    }
+
+
+async def update_user_language(
+        user_id: int,
+        new_language_code: str,
+        session: Optional[AsyncSession] = None
+) -> Optional[User]:
     """
-    Обновляет код языка для пользователя в базе данных.
+    Обновляет код языка для пользователя в базе данных одним запросом UPDATE ... RETURNING.
     Возвращает обновленный объект User или None, если пользователь не найден.
     """
-    async with get_db_session() as db:
-        stmt = select(User).where(User.user_id == user_id)
-        result = await db.execute(stmt)
-        user = result.scalar_one_or_none()
-        if user:
-            user.language_code = new_language_code
-            user.last_activity_at = func.now()  # Использование last_activity_at
-            logger.info(f"Язык пользователя {user_id} обновлен на '{new_language_code}'.")
-            return user
-        logger.warning(f"Пользователь с ID {user_id} не найден для обновления языка.")
-        return None
+    async with get_write_session(session) as db:
+        stmt = (
+            update(User)
+            .where(User.user_id == user_id)
+            .values(language_code=new_language_code, last_activity_at=func.now())
+            .returning(User)
+        )
+        user = (await db.execute(stmt, execution_options={"populate_existing": True})).scalar_one_or_none()
+        _mark_user_settings_changed(db, user_id)
+    if user:
+        _remember_user_settings(user_id, (user.language_code, user.notifications_enabled))
+        logger.info(f"Язык пользователя {user_id} обновлен на '{new_language_code}'.")
+        return user
+    logger.warning(f"Пользователь с ID {user_id} не найден для обновления языка.")
+    return None
 
 
-async def get_user_notifications_status(user_id: int) -> Optional[bool]:
+async def get_user_notifications_status(user_id: int, session: Optional[AsyncSession] = None) -> Optional[bool]:
     """
-    Получает статус уведомлений пользователя из базы данных.
+    Получает статус уведомлений пользователя (через кэш настроек пользователей).
     Возвращает True/False или None, если пользователь не найден.
     """
-    async with get_db_session() as db:
-        # Исправлено: используем select().where() для поиска по user_id (Telegram ID)
-        stmt = select(User).where(User.user_id == user_id)
-        result = await db.execute(stmt)
-        user = result.scalar_one_or_none()
-        if user:
-            return user.notifications_enabled
-        logger.warning(f"Пользователь с ID {user_id} не найден для получения статуса уведомлений.")
-        return None
+    settings = await _get_user_settings(user_id, session)
+    if settings is not None:
+        return settings[1]
+    logger.warning(f"Пользователь с ID {user_id} не найден для получения статуса уведомлений.")
+    return None
 
 
-async def update_user_notifications_status(user_id: int, status: bool) -> Optional[User]:
+async def update_user_notifications_status(
+        user_id: int,
+        status: bool,
+        session: Optional[AsyncSession] = None
+) -> Optional[User]:
     """
-    Обновляет статус уведомлений пользователя в базе данных.
+    Обновляет статус уведомлений пользователя в базе данных одним запросом UPDATE ... RETURNING.
     Возвращает обновленный объект User или None, если пользователь не найден.
     """
-    async with get_db_session() as db:
-        # Исправлено: используем select().where() для поиска по user_id (Telegram ID)
-        stmt = select(User).where(User.user_id == user_id)
-        result = await db.execute(stmt)
-        user = result.scalar_one_or_none()
-        if user:
-            user.notifications_enabled = status
-            user.last_activity_at = func.now()
-            logger.info(f"Статус уведомлений пользователя {user_id} обновлен на '{status}'.")
-            return user
-        logger.warning(f"Пользователь с ID {user_id} не найден для обновления статуса уведомлений.")
-        return None
+    async with get_write_session(session) as db:
+        stmt = (
+            update(User)
+            .where(User.user_id == user_id)
+            .values(notifications_enabled=status, last_activity_at=func.now())
+            .returning(User)
+        )
+        user = (await db.execute(stmt, execution_options={"populate_existing": True})).scalar_one_or_none()
+        _mark_user_settings_changed(db, user_id)
+    if user:
+        _remember_user_settings(user_id, (user.language_code, user.notifications_enabled))
+        logger.info(f"Статус уведомлений пользователя {user_id} обновлен на '{status}'.")
+        return user
+    logger.warning(f"Пользователь с ID {user_id} не найден для обновления статуса уведомлений.")
+    return None
 
 
 # --- Функции для работы с заказами ---
@@ -201,13 +845,15 @@ async def add_new_order(
         payment_method: Optional[str] = None,
         contact_phone: Optional[str] = None,
         delivery_notes: Optional[str] = None,
-        status: str = 'new'
+        status: str = 'new',
+        session: Optional[AsyncSession] = None
 ) -> Order:
     """
-    Добавляет новый заказ в базу данных.
+    Добавляет новый заказ в базу данных одним запросом INSERT ... RETURNING.
+    Возвращает созданный заказ со сгенерированными БД полями (id, created_at).
     """
-    async with get_db_session() as db:
-        new_order = Order(
+    async with get_write_session(session) as db:
+        stmt = insert(Order).values(
             user_id=user_id,
             username=username,
             order_text=order_text,
@@ -217,152 +863,414 @@ async def add_new_order(
             contact_phone=contact_phone,
             delivery_notes=delivery_notes,
             status=status
-        )
-        db.add(new_order)
-        await db.flush()  # Для получения ID нового заказа
-        await db.refresh(new_order)  # Обновляем объект, чтобы получить актуальные данные (например, created_at)
+        ).returning(Order)
+        new_order = (await db.execute(stmt)).scalar_one()
         logger.info(f"Новый заказ ID {new_order.id} добавлен от пользователя {user_id}.")
         return new_order
 
 
-async def get_order_by_id(order_id: int) -> Optional[Order]:
+async def get_order_by_id(order_id: int, session: Optional[AsyncSession] = None) -> Optional[Order]:
     """
     Получает заказ по его ID.
     """
-    async with get_db_session() as db:
+    async with get_db_session(session) as db:
         stmt = select(Order).where(Order.id == order_id)
         result = await db.execute(stmt)
         return result.scalar_one_or_none()
 
 
-async def update_order_status(order_id: int, new_status: str) -> bool:
+async def update_order_status(
+        order_id: int,
+        new_status: str,
+        session: Optional[AsyncSession] = None
+) -> Optional[Order]:
     """
-    Обновляет статус заказа по его ID.
+    Обновляет статус заказа по его ID одним запросом UPDATE ... RETURNING.
+    Возвращает обновленный заказ или None, если заказ не найден.
     """
-    async with get_db_session() as db:
-        order = await db.get(Order, order_id)
+    async with get_write_session(session) as db:
+        stmt = (
+            update(Order)
+            .where(Order.id == order_id)
+            .values(status=new_status, updated_at=func.now())
+            .returning(Order)
+        )
+        order = (await db.execute(stmt, execution_options={"populate_existing": True})).scalar_one_or_none()
         if order:
-            order.status = new_status
-            order.updated_at = func.now()
             logger.info(f"Статус заказа ID {order_id} обновлен на '{new_status}'.")
-            return True
+            return order
         logger.warning(f"Попытка обновить статус несуществующего заказа ID {order_id}.")
-        return False
+        return None
 
 
-async def update_order_text(order_id: int, new_text: str) -> bool:
+async def update_order_text(order_id: int, new_text: str, session: Optional[AsyncSession] = None) -> bool:
     """
-    Обновляет текст заказа по его ID.
+    Обновляет текст заказа по его ID одним запросом UPDATE ... RETURNING.
     """
-    async with get_db_session() as db:
-        order = await db.get(Order, order_id)
-        if order:
-            order.order_text = new_text
-            order.updated_at = func.now()
+    async with get_write_session(session) as db:
+        stmt = (
+            update(Order)
+            .where(Order.id == order_id)
+            .values(order_text=new_text, updated_at=func.now())
+            .returning(Order.id)
+        )
+        if (await db.execute(stmt)).scalar_one_or_none() is not None:
             logger.info(f"Текст заказа ID {order_id} обновлен.")
             return True
         logger.warning(f"Попытка обновить текст несуществующего заказа ID {order_id}.")
         return False
 
 
-async def delete_order(order_id: int) -> bool:
+async def delete_order(order_id: int, session: Optional[AsyncSession] = None) -> bool:
     """
-    Удаляет заказ из базы данных по ID.
+    Удаляет заказ из базы данных по ID одним запросом DELETE ... RETURNING.
     """
-    async with get_db_session() as db:
-        order = await db.get(Order, order_id)
-        if order:
-            await db.delete(order)
+    async with get_write_session(session) as db:
+        stmt = (
+            delete(Order)
+            .where(Order.id == order_id)
+            .returning(Order.id)
+        )
+        if (await db.execute(stmt)).scalar_one_or_none() is not None:
             logger.info(f"Заказ ID {order_id} успешно удален из БД.")
             return True
         logger.warning(f"Попытка удалить несуществующий заказ ID {order_id}.")
         return False
 
 
-async def get_all_orders(offset: int = 0, limit: int = 10) -> Tuple[List[Order], int]:
+# --- Keyset-пагинация заказов по (created_at, id) ---
+
+# Направления keyset-пагинации (списки заказов отсортированы от новых к старым)
+PAGE_OLDER = "older"  # заказы после курсора (следующие страницы)
+PAGE_FROM_CURSOR = "from"  # заказы начиная с курсора включительно (повторный показ страницы)
+PAGE_NEWER = "newer"  # заказы перед курсором (предыдущие страницы)
+PAGE_LAST = "last"  # последняя страница, читается с конца списка
+
+
+def encode_order_cursor(order: Order) -> str:
+    """
+    Кодирует позицию заказа в списке (created_at, id) в компактную строку для callback_data.
+    Формат: YYYYmmddHHMMSS[ffffff]-<id> (без двоеточий, чтобы не конфликтовать с разделителем callback_data).
+    """
+    created_at = order.created_at
+    created_at_key = created_at.strftime('%Y%m%d%H%M%S')
+    if created_at.microsecond:
+        created_at_key += f"{created_at.microsecond:06d}"
+    return f"{created_at_key}-{order.id}"
+
+
+def _decode_order_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Декодирует курсор в значение created_at в формате хранения SQLite ('YYYY-MM-DD HH:MM:SS[.ffffff]')
+    и ID заказа. При неверном формате выбрасывает ValueError.
+    """
+    created_at_key, order_id = cursor.split("-")
+    created_at = datetime.strptime(created_at_key[:14], '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
+    if len(created_at_key) > 14:
+        created_at += f".{created_at_key[14:]}"
+    return created_at, int(order_id)
+
+
+def last_page_size(total_items: int, per_page: int) -> int:
+    """
+    Возвращает количество элементов на последней странице списка.
+    """
+    return total_items % per_page or per_page
+
+
+def _apply_keyset_page(
+        stmt: Select,
+        offset: int,
+        limit: Optional[int],
+        cursor: Optional[str],
+        direction: str
+) -> Tuple[Select, bool]:
+    """
+    Применяет к запросу заказов сортировку и keyset-пагинацию по (created_at, id).
+    Вместо пропуска offset строк от начала списка запрос переходит к курсору по индексу,
+    поэтому стоимость страницы не зависит от ее номера. offset здесь - небольшое смещение
+    от курсора (для перехода сразу на несколько страниц).
+    Возвращает запрос и флаг, нужно ли развернуть результат (страница читалась в обратном порядке).
+    """
+    # Сравниваем created_at как строку хранения, чтобы параметр не переформатировался типом DateTime
+    created_at = type_coerce(Order.created_at, String)
+    newest_first = (Order.created_at.desc(), Order.id.desc())
+    oldest_first = (Order.created_at.asc(), Order.id.asc())
+    reverse = False
+
+    if cursor is not None:
+        created_at_key, order_id = _decode_order_cursor(cursor)
+        if direction == PAGE_NEWER:
+            stmt = stmt.where(or_(
+                created_at > created_at_key,
+                and_(created_at == created_at_key, Order.id > order_id)
+            )).order_by(*oldest_first)
+            reverse = True
+        elif direction == PAGE_FROM_CURSOR:
+            stmt = stmt.where(or_(
+                created_at < created_at_key,
+                and_(created_at == created_at_key, Order.id <= order_id)
+            )).order_by(*newest_first)
+        else:
+            stmt = stmt.where(or_(
+                created_at < created_at_key,
+                and_(created_at == created_at_key, Order.id < order_id)
+            )).order_by(*newest_first)
+    elif direction == PAGE_LAST:
+        stmt = stmt.order_by(*oldest_first)
+        reverse = True
+    else:
+        stmt = stmt.order_by(*newest_first)
+
+    return stmt.offset(offset).limit(limit), reverse
+
+
+async def get_all_orders(
+        offset: int = 0,
+        limit: Optional[int] = 10,
+        cursor: Optional[str] = None,
+        direction: str = PAGE_OLDER,
+        session: Optional[AsyncSession] = None
+) -> Tuple[List[Order], int]:
     """
     Получает все заказы из базы данных с пагинацией, отсортированные по дате создания в убывающем порядке.
+    Если передан cursor (см. encode_order_cursor), страница ищется относительно него в направлении direction;
+    direction=PAGE_LAST возвращает последнюю страницу без курсора.
     Возвращает список заказов и общее количество заказов.
     """
-    async with get_db_session() as db:
+    async with get_db_session(session) as db:
         # Запрос для получения общего количества заказов
         count_stmt = select(func.count()).select_from(Order)
         total_orders = (await db.execute(count_stmt)).scalar_one()
 
+        if direction == PAGE_LAST and limit:
+            limit = last_page_size(total_orders, limit)
+
         # Запрос для получения заказов с пагинацией
-        stmt = select(Order).order_by(Order.created_at.desc()).offset(offset).limit(limit)
+        stmt, reverse = _apply_keyset_page(select(Order), offset, limit, cursor, direction)
         result = await db.execute(stmt)
-        orders = result.scalars().all()
+        orders = list(result.scalars().all())
+        if reverse:
+            orders.reverse()
         return orders, total_orders
 
 
-async def search_orders(search_query: str, offset: int = 0, limit: int = 10) -> Tuple[List[Order], int]:
+def _fts_phrase(search_query: str) -> str:
     """
-    Ищет заказы по ID, части username или части текста заказа.
-    Поиск по тексту и username регистронезависимый.
-    Возвращает список найденных заказов и их общее количество.
+    Превращает поисковый запрос в фразу FTS5: весь запрос ищется как одна подстрока,
+    кавычки внутри экранируются удвоением.
     """
-    async with get_db_session() as db:
-        search_pattern = f"%{search_query.lower()}%"
-        try:
-            # Попытка преобразовать search_query в int для поиска по ID
-            search_id = int(search_query)
-        except ValueError:
-            search_id = None
+    return '"' + search_query.replace('"', '""') + '"'
 
-        # Базовый запрос для подсчета
-        count_stmt = select(func.count()).select_from(Order)
-        # Базовый запрос для данных
-        data_stmt = select(Order)
 
-        conditions = []
+def _fts_matches_subquery(search_query: str, search_id: Optional[int]):
+    """
+    Подзапрос (order_id, rank) совпадений из полнотекстового индекса orders_fts.
+    Меньше rank - релевантнее; точное совпадение по ID получает EXACT_ID_MATCH_RANK.
+    """
+    matches_stmt = select(
+        orders_fts.c.rowid.label("order_id"),
+        orders_fts.c.rank.label("rank")
+    ).where(literal_column("orders_fts").op("MATCH")(_fts_phrase(search_query)))
+
+    if search_id is None:
+        return matches_stmt.subquery()
+
+    # Точное совпадение по ID поднимаем в начало выдачи
+    id_match_stmt = select(
+        Order.id.label("order_id"),
+        literal(EXACT_ID_MATCH_RANK, Float).label("rank")
+    ).where(Order.id == search_id)
+    union_stmt = union_all(matches_stmt, id_match_stmt).subquery()
+    return select(
+        union_stmt.c.order_id,
+        func.min(union_stmt.c.rank).label("rank")
+    ).group_by(union_stmt.c.order_id).subquery()
+
+
+def _parse_search_id(search_query: str) -> Optional[int]:
+    """
+    Возвращает ID заказа, если поисковый запрос является числом.
+    """
+    try:
+        return int(search_query)
+    except ValueError:
+        return None
 
-        if search_id is not None:
-            conditions.append(Order.id == search_id)
 
-        # Добавляем условия для текстового поиска, используя LOWER для регистронезависимости
-        # Используем func.lower() для совместимости с SQLAlchemy
-        conditions.append(func.lower(Order.username).like(search_pattern))
-        conditions.append(func.lower(Order.order_text).like(search_pattern))
-        conditions.append(func.lower(Order.full_name).like(search_pattern))
-        conditions.append(func.lower(Order.delivery_address).like(search_pattern))
-        conditions.append(func.lower(Order.contact_phone).like(search_pattern))
-        conditions.append(func.lower(Order.delivery_notes).like(search_pattern))
+async def search_orders(
+        search_query: str,
+        offset: int = 0,
+        limit: int = 10,
+        session: Optional[AsyncSession] = None
+) -> Tuple[List[Order], int]:
+    """
+    Ищет заказы по ID или по подстроке в username, тексте заказа, ФИО, адресе, телефоне и примечаниях.
+    Поиск выполняется по полнотекстовому индексу orders_fts (FTS5, trigram) и регистронезависим,
+    результаты отсортированы по релевантности (bm25), точное совпадение по ID идет первым.
+    Возвращает список найденных заказов и их общее количество.
+    """
+    search_query = search_query.strip()
+    # Попытка преобразовать search_query в int для поиска по ID
+    search_id = _parse_search_id(search_query)
 
-        # Комбинируем условия с OR
-        combined_condition = or_(*conditions)
+    if len(search_query) < FTS_MIN_QUERY_LENGTH:
+        # Триграммный индекс не работает с запросами короче трех символов
+        return await _search_orders_by_like(search_query, search_id, offset, limit, session)
 
-        # Применяем условие к запросам
-        count_stmt = count_stmt.where(combined_condition)
-        data_stmt = data_stmt.where(combined_condition)
+    async with get_db_session(session) as db:
+        matches = _fts_matches_subquery(search_query, search_id)
 
         # Выполняем подсчет
+        count_stmt = select(func.count()).select_from(matches)
         total_orders = (await db.execute(count_stmt)).scalar_one()
 
-        # Выполняем запрос данных с сортировкой и пагинацией
-        data_stmt = data_stmt.order_by(Order.created_at.desc()).offset(offset).limit(limit)
+        # Выполняем запрос данных с сортировкой по релевантности и пагинацией
+        data_stmt = (
+            select(Order)
+            .join(matches, Order.id == matches.c.order_id)
+            .order_by(matches.c.rank, Order.created_at.desc())
+            .offset(offset)
+            .limit(limit)
+        )
         result = await db.execute(data_stmt)
         orders = result.scalars().all()
 
         return orders, total_orders
 
 
-async def get_user_orders_paginated(user_id: int, offset: int = 0, limit: int = 5) -> List[Order]:
+def _like_search_condition(search_query: str, search_id: Optional[int]):
     """
-    Получает заказы конкретного пользователя с пагинацией, отсортированные по дате создания в убывающем порядке.
+    Условие резервного поиска: LOWER(col) LIKE '%q%' по текстовым полям или совпадение по ID.
+    """
+    search_pattern = f"%{search_query.lower()}%"
+
+    conditions = []
+
+    if search_id is not None:
+        conditions.append(Order.id == search_id)
+
+    # Добавляем условия для текстового поиска, используя LOWER для регистронезависимости
+    conditions.append(func.lower(Order.username).like(search_pattern))
+    conditions.append(func.lower(Order.order_text).like(search_pattern))
+    conditions.append(func.lower(Order.full_name).like(search_pattern))
+    conditions.append(func.lower(Order.delivery_address).like(search_pattern))
+    conditions.append(func.lower(Order.contact_phone).like(search_pattern))
+    conditions.append(func.lower(Order.delivery_notes).like(search_pattern))
+
+    # Комбинируем условия с OR
+    return or_(*conditions)
+
+
+async def _search_orders_by_like(
+        search_query: str,
+        search_id: Optional[int],
+        offset: int,
+        limit: int,
+        session: Optional[AsyncSession] = None
+) -> Tuple[List[Order], int]:
     """
+    Резервный поиск для коротких запросов через LOWER(col) LIKE '%q%' (полный просмотр таблицы).
+    """
+    async with get_db_session(session) as db:
+        combined_condition = _like_search_condition(search_query, search_id)
+
+        count_stmt = select(func.count()).select_from(Order).where(combined_condition)
+        total_orders = (await db.execute(count_stmt)).scalar_one()
+
+        data_stmt = select(Order).where(combined_condition).order_by(Order.created_at.desc()).offset(offset).limit(limit)
+        result = await db.execute(data_stmt)
+        orders = result.scalars().all()
+
+        return orders, total_orders
+
+
+async def stream_orders(
+        columns: Sequence[str],
+        search_query: Optional[str] = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Построчно читает заказы для экспорта и отдает их пачками по chunk_size строк.
+    Выбираются только колонки columns (кортежи значений, без ORM-объектов), курсор читается
+    через fetchmany, поэтому в памяти одновременно находится не больше одной пачки.
+    Без search_query отдает все заказы (новые первыми), с ним - результаты поиска в порядке search_orders.
+    """
+    selected_columns = [Order.__table__.c[column] for column in columns]
+
+    if search_query is None:
+        stmt = select(*selected_columns).order_by(Order.created_at.desc(), Order.id.desc())
+    else:
+        search_query = search_query.strip()
+        search_id = _parse_search_id(search_query)
+        if len(search_query) < FTS_MIN_QUERY_LENGTH:
+            stmt = (
+                select(*selected_columns)
+                .where(_like_search_condition(search_query, search_id))
+                .order_by(Order.created_at.desc())
+            )
+        else:
+            matches = _fts_matches_subquery(search_query, search_id)
+            stmt = (
+                select(*selected_columns)
+                .join(matches, Order.id == matches.c.order_id)
+                .order_by(matches.c.rank, Order.created_at.desc())
+            )
+
     async with get_db_session() as db:
-        stmt = select(Order).where(Order.user_id == user_id).order_by(Order.created_at.desc()).offset(offset).limit(
-            limit)
+        result = await db.stream(stmt, execution_options={"yield_per": chunk_size})
+        async for partition in result.partitions(chunk_size):
+            yield [tuple(row) for row in partition]
+
+
+async def count_orders(search_query: Optional[str] = None, session: Optional[AsyncSession] = None) -> int:
+    """
+    Подсчитывает заказы, которые выгрузит stream_orders с тем же search_query
+    (без search_query - все заказы). Используется для отображения прогресса экспорта.
+    """
+    if search_query is None:
+        count_stmt = select(func.count()).select_from(Order)
+    else:
+        search_query = search_query.strip()
+        search_id = _parse_search_id(search_query)
+        if len(search_query) < FTS_MIN_QUERY_LENGTH:
+            count_stmt = select(func.count()).select_from(Order).where(_like_search_condition(search_query, search_id))
+        else:
+            count_stmt = select(func.count()).select_from(_fts_matches_subquery(search_query, search_id))
+
+    async with get_db_session(session) as db:
+        return (await db.execute(count_stmt)).scalar_one()
+
+
+async def get_user_orders_paginated(
+        user_id: int,
+        offset: int = 0,
+        limit: int = 5,
+        cursor: Optional[str] = None,
+        direction: str = PAGE_OLDER,
+        session: Optional[AsyncSession] = None
+) -> List[Order]:
+    """
+    Получает заказы конкретного пользователя с пагинацией, отсортированные по дате создания в убывающем порядке.
+    Поддерживает keyset-пагинацию по cursor/direction так же, как get_all_orders
+    (для PAGE_LAST limit должен быть размером последней страницы, см. last_page_size).
+    """
+    async with get_db_session(session) as db:
+        stmt, reverse = _apply_keyset_page(
+            select(Order).where(Order.user_id == user_id), offset, limit, cursor, direction
+        )
         result = await db.execute(stmt)
-        return result.scalars().all()
+        orders = list(result.scalars().all())
+        if reverse:
+            orders.reverse()
+        return orders
 
 
-async def count_user_orders(user_id: int) -> int:
+async def count_user_orders(user_id: int, session: Optional[AsyncSession] = None) -> int:
     """
     Подсчитывает общее количество заказов конкретного пользователя.
     """
-    async with get_db_session() as db:
+    async with get_db_session(session) as db:
         stmt = select(func.count()).where(Order.user_id == user_id)
         result = await db.execute(stmt)
         return result.scalar_one()
@@ -370,12 +1278,67 @@ async def count_user_orders(user_id: int) -> int:
 
 # --- Функции для работы с сообщениями помощи ---
 
-async def add_help_message(message_text: str, language_code: str, is_active: bool = False) -> HelpMessage:
+# Кэш активных сообщений помощи: код языка -> сообщение. None - кэш не загружен или сброшен.
+_active_help_messages: Optional[Dict[str, HelpMessage]] = None
+_active_help_messages_loaded_at = 0.0
+# Счетчик сбросов кэша: загрузка, начатая до сброса, не сохраняет устаревший результат
+_help_messages_cache_generation = 0
+
+
+def _mark_help_messages_changed(session: AsyncSession):
+    """
+    Отмечает, что транзакция сессии изменяет сообщения помощи: кэш сбрасывается сразу и после фиксации
+    (чтение, выполненное между изменением и фиксацией, могло снова загрузить старые данные).
+    """
+    invalidate_help_messages_cache()
+    if invalidate_help_messages_cache not in session.info.get("after_commit_callbacks", ()):
+        _call_after_commit(session, invalidate_help_messages_cache)
+
+
+def invalidate_help_messages_cache():
+    """
+    Сбрасывает кэш активных сообщений помощи; следующий запрос загрузит его заново.
+    """
+    global _active_help_messages, _help_messages_cache_generation
+    _active_help_messages = None
+    _help_messages_cache_generation += 1
+
+
+async def get_active_help_messages() -> Dict[str, HelpMessage]:
+    """
+    Возвращает активные сообщения помощи для всех языков (код языка -> сообщение).
+    Сообщения загружаются одним запросом и кэшируются в памяти до изменения сообщений помощи
+    (и не дольше HELP_MESSAGES_CACHE_TTL секунд, если он задан).
+    """
+    global _active_help_messages, _active_help_messages_loaded_at
+    if _active_help_messages is not None and (
+            not HELP_MESSAGES_CACHE_TTL or time.monotonic() - _active_help_messages_loaded_at < HELP_MESSAGES_CACHE_TTL):
+        return _active_help_messages
+
+    generation = _help_messages_cache_generation
+    # Отдельная сессия: закэшированные объекты не должны принадлежать сессии обновления
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(HelpMessage).where(HelpMessage.is_active == True))
+        active_messages = {message.language_code: message for message in result.scalars().all()}
+    if generation == _help_messages_cache_generation:
+        _active_help_messages = active_messages
+        _active_help_messages_loaded_at = time.monotonic()
+        logger.debug(f"Кэш активных сообщений помощи загружен: {sorted(active_messages)}.")
+    return active_messages
+
+
+async def add_help_message(
+        message_text: str,
+        language_code: str,
+        is_active: bool = False,
+        session: Optional[AsyncSession] = None
+) -> HelpMessage:
     """
     Добавляет новое сообщение помощи в базу данных.
     Если is_active=True, деактивирует все другие активные сообщения для этого языка.
     """
-    async with get_db_session() as db:
+    async with get_write_session(session) as db:
+        _mark_help_messages_changed(db)
         if is_active:
             # Деактивируем все текущие активные сообщения для этого языка
             active_messages = (await db.execute(
@@ -397,11 +1360,11 @@ async def add_help_message(message_text: str, language_code: str, is_active: boo
         return new_message
 
 
-async def get_help_message_by_id(message_id: int) -> Optional[HelpMessage]:
+async def get_help_message_by_id(message_id: int, session: Optional[AsyncSession] = None) -> Optional[HelpMessage]:
     """
     Получает сообщение помощи по его ID.
     """
-    async with get_db_session() as db:
+    async with get_db_session(session) as db:
         stmt = select(HelpMessage).where(HelpMessage.id == message_id)
         result = await db.execute(stmt)
         return result.scalar_one_or_none()
@@ -409,21 +1372,22 @@ async def get_help_message_by_id(message_id: int) -> Optional[HelpMessage]:
 
 async def get_active_help_message_from_db(language_code: str) -> Optional[HelpMessage]:
     """
-    Получает активное сообщение помощи для указанного языка из базы данных.
+    Получает активное сообщение помощи для указанного языка (из кэша get_active_help_messages).
     """
-    async with get_db_session() as db:
-        stmt = select(HelpMessage).where(HelpMessage.is_active == True, HelpMessage.language_code == language_code)
-        result = await db.execute(stmt)
-        return result.scalar_one_or_none()
+    return (await get_active_help_messages()).get(language_code)
 
 
-async def set_active_help_message(message_id: int, language_code: str) -> Optional[HelpMessage]:
+async def set_active_help_message(
+        message_id: int,
+        language_code: str,
+        session: Optional[AsyncSession] = None
+) -> Optional[HelpMessage]:
     """
     Устанавливает сообщение помощи с заданным ID как активное для указанного языка.
     Деактивирует все другие активные сообщения для этого языка.
     Возвращает активированное сообщение или None, если сообщение не найдено или язык не совпадает.
     """
-    async with get_db_session() as db:
+    async with get_write_session(session) as db:
         try:
             selected_message = await db.get(HelpMessage, message_id)
             if not selected_message:
@@ -439,6 +1403,7 @@ async def set_active_help_message(message_id: int, language_code: str) -> Option
                 )
                 return None
 
+            _mark_help_messages_changed(db)
             # Деактивируем все текущие активные сообщения для этого языка
             active_messages = (await db.execute(
                 select(HelpMessage).where(HelpMessage.language_code == language_code, HelpMessage.is_active == True)
@@ -449,22 +1414,24 @@ async def set_active_help_message(message_id: int, language_code: str) -> Option
 
             selected_message.is_active = True
             selected_message.updated_at = func.now()
+            await db.flush()
+            await db.refresh(selected_message, ["updated_at"])
             logger.info(f"Сообщение помощи ID {message_id} для языка '{language_code}' успешно активировано.")
             return selected_message
         except Exception as e:
-            await db.rollback()
             logger.error(f"Ошибка при установке активного сообщения помощи ID {message_id}: {e}. Транзакция отменена.")
             raise
 
 
-async def deactivate_help_message(message_id: int) -> bool:
+async def deactivate_help_message(message_id: int, session: Optional[AsyncSession] = None) -> bool:
     """
     Деактивирует сообщение помощи по его ID.
     Возвращает True, если сообщение было успешно деактивировано, False в противном случае.
     """
-    async with get_db_session() as db:
+    async with get_write_session(session) as db:
         message = await db.get(HelpMessage, message_id)
         if message:
+            _mark_help_messages_changed(db)
             message.is_active = False
             message.updated_at = func.now()
             logger.info(f"Сообщение помощи ID {message_id} деактивировано.")
@@ -473,14 +1440,15 @@ async def deactivate_help_message(message_id: int) -> bool:
         return False
 
 
-async def delete_help_message(message_id: int) -> bool:
+async def delete_help_message(message_id: int, session: Optional[AsyncSession] = None) -> bool:
     """
     Удаляет сообщение помощи из базы данных по ID.
     Возвращает True, если сообщение было успешно удалено, False в противном случае.
     """
-    async with get_db_session() as db:
+    async with get_write_session(session) as db:
         message = await db.get(HelpMessage, message_id)
         if message:
+            _mark_help_messages_changed(db)
             await db.delete(message)
             logger.info(f"Сообщение помощи ID {message_id} успешно удалено из БД.")
             return True
@@ -488,12 +1456,15 @@ async def delete_help_message(message_id: int) -> bool:
         return False
 
 
-async def get_all_help_messages(language_code: Optional[str] = None) -> List[HelpMessage]:
+async def get_all_help_messages(
+        language_code: Optional[str] = None,
+        session: Optional[AsyncSession] = None
+) -> List[HelpMessage]:
     """
     Получает все сообщения помощи из базы данных, отсортированные по дате создания в убывающем порядке.
     Можно отфильтровать по language_code.
     """
-    async with get_db_session() as db:
+    async with get_db_session(session) as db:
         stmt = select(HelpMessage).order_by(HelpMessage.created_at.desc())
         if language_code:
             stmt = stmt.where(HelpMessage.language_code == language_code)
@@ -501,15 +1472,20 @@ async def get_all_help_messages(language_code: Optional[str] = None) -> List[Hel
         return result.scalars().all()
 
 
-async def update_help_message_language(message_id: int, new_language_code: str) -> Optional[HelpMessage]:
+async def update_help_message_language(
+        message_id: int,
+        new_language_code: str,
+        session: Optional[AsyncSession] = None
+) -> Optional[HelpMessage]:
     """
     Обновляет язык сообщения помощи по его ID.
     Если сообщение было активно для старого языка, оно остается активным для нового языка,
     при этом деактивируются другие активные сообщения для нового языка.
     """
-    async with get_db_session() as db:
+    async with get_write_session(session) as db:
         message = await db.get(HelpMessage, message_id)
         if message:
+            _mark_help_messages_changed(db)
             old_language_code = message.language_code
             is_currently_active = message.is_active
 
@@ -528,9 +1504,230 @@ async def update_help_message_language(message_id: int, new_language_code: str)
             # Если сообщение было активно, оно остается активным для нового языка
             # Если не было активно, остается неактивным.
             message.is_active = is_currently_active  # Сохраняем статус активности
+            # updated_at вычисляет БД: загружаем значение, пока сессия записи доступна
+            await db.flush()
+            await db.refresh(message, ["updated_at"])
 
             logger.info(
                 f"Язык сообщения помощи ID {message_id} изменен с '{old_language_code}' на '{new_language_code}'.")
             return message
         logger.warning(f"Попытка обновить язык несуществующего сообщения помощи ID {message_id}.")
         return None
+
+
+# --- Функции для работы с рассылками ---
+
+# Статусы рассылок
+BROADCAST_QUEUED = "queued"
+BROADCAST_RUNNING = "running"
+BROADCAST_DONE = "done"
+BROADCAST_CANCELLED = "cancelled"
+BROADCAST_UNFINISHED_STATUSES = (BROADCAST_QUEUED, BROADCAST_RUNNING)
+
+
+def _broadcast_recipients_condition():
+    return User.notifications_enabled == True
+
+
+async def count_broadcast_recipients(session: Optional[AsyncSession] = None) -> int:
+    """
+    Подсчитывает получателей рассылки: пользователей с включенными уведомлениями.
+    """
+    async with get_db_session(session) as db:
+        stmt = select(func.count()).select_from(User).where(_broadcast_recipients_condition())
+        return (await db.execute(stmt)).scalar_one()
+
+
+async def stream_broadcast_recipients(
+        after_user_id: Optional[int] = None,
+        chunk_size: int = BROADCAST_CHUNK_SIZE
+) -> AsyncIterator[List[int]]:
+    """
+    Отдает Telegram ID получателей рассылки пачками по chunk_size в порядке возрастания user_id,
+    начиная после after_user_id. Каждая пачка читается отдельным keyset-запросом (user_id > последнего),
+    поэтому между пачками не держится открытая транзакция, а в памяти находится только одна пачка.
+    """
+    while True:
+        stmt = select(User.user_id).where(_broadcast_recipients_condition()).order_by(User.user_id).limit(chunk_size)
+        if after_user_id is not None:
+            stmt = stmt.where(User.user_id > after_user_id)
+        async with get_db_session() as db:
+            user_ids = list((await db.execute(stmt)).scalars().all())
+        if not user_ids:
+            return
+        yield user_ids
+        if len(user_ids) < chunk_size:
+            return
+        after_user_id = user_ids[-1]
+
+
+async def create_broadcast(
+        message_text: str,
+        created_by: int,
+        total_count: int,
+        status_chat_id: Optional[int] = None,
+        status_message_id: Optional[int] = None,
+        session: Optional[AsyncSession] = None
+) -> Broadcast:
+    """
+    Создает рассылку в статусе 'queued' одним запросом INSERT ... RETURNING.
+    """
+    async with get_write_session(session) as db:
+        stmt = insert(Broadcast).values(
+            message_text=message_text,
+            created_by=created_by,
+            status=BROADCAST_QUEUED,
+            total_count=total_count,
+            status_chat_id=status_chat_id,
+            status_message_id=status_message_id
+        ).returning(Broadcast)
+        broadcast = (await db.execute(stmt)).scalar_one()
+    logger.info(f"Рассылка ID {broadcast.id} создана админом {created_by}, получателей: {total_count}.")
+    return broadcast
+
+
+async def get_broadcast(broadcast_id: int, session: Optional[AsyncSession] = None) -> Optional[Broadcast]:
+    """
+    Получает рассылку по ее ID.
+    """
+    async with get_db_session(session) as db:
+        return (await db.execute(select(Broadcast).where(Broadcast.id == broadcast_id))).scalar_one_or_none()
+
+
+async def get_unfinished_broadcasts(session: Optional[AsyncSession] = None) -> List[Broadcast]:
+    """
+    Получает рассылки, которые ожидают выполнения или были прерваны остановкой бота, в порядке создания.
+    """
+    async with get_db_session(session) as db:
+        stmt = select(Broadcast).where(Broadcast.status.in_(BROADCAST_UNFINISHED_STATUSES)).order_by(Broadcast.id)
+        return list((await db.execute(stmt)).scalars().all())
+
+
+async def save_broadcast_progress(
+        broadcast_id: int,
+        last_user_id: Optional[int],
+        sent_count: int,
+        failed_count: int,
+        blocked_count: int,
+        status: str = BROADCAST_RUNNING,
+        session: Optional[AsyncSession] = None
+) -> bool:
+    """
+    Сохраняет прогресс рассылки (курсор и счетчики) и ее статус. Отмененная рассылка не обновляется.
+    Возвращает False, если рассылка не найдена или уже отменена.
+    """
+    values = dict(
+        last_user_id=last_user_id,
+        sent_count=sent_count,
+        failed_count=failed_count,
+        blocked_count=blocked_count,
+        status=status,
+        updated_at=func.now()
+    )
+    if status == BROADCAST_DONE:
+        values["finished_at"] = func.now()
+    async with get_write_session(session) as db:
+        stmt = (
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status.in_(BROADCAST_UNFINISHED_STATUSES))
+            .values(**values)
+            .returning(Broadcast.id)
+        )
+        return (await db.execute(stmt)).scalar_one_or_none() is not None
+
+
+async def cancel_broadcast(broadcast_id: int, session: Optional[AsyncSession] = None) -> bool:
+    """
+    Отменяет ожидающую или выполняемую рассылку. Возвращает False, если она уже завершена или не найдена.
+    """
+    async with get_write_session(session) as db:
+        stmt = (
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status.in_(BROADCAST_UNFINISHED_STATUSES))
+            .values(status=BROADCAST_CANCELLED, updated_at=func.now(), finished_at=func.now())
+            .returning(Broadcast.id)
+        )
+        cancelled = (await db.execute(stmt)).scalar_one_or_none() is not None
+    if cancelled:
+        logger.info(f"Рассылка ID {broadcast_id} отменена.")
+    return cancelled
+
+
+# --- Функции для хранилища FSM (fsm_storage.py) ---
+
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], str]]:
+    """
+    Получает состояние и данные (JSON) ключа FSM. Возвращает None, если записи нет.
+    """
+    async with get_db_session() as db:
+        row = (await db.execute(select(FsmRecord.state, FsmRecord.data).where(FsmRecord.key == key))).one_or_none()
+    return (row.state, row.data) if row is not None else None
+
+
+async def save_fsm_records(
+        records: Sequence[Tuple[str, Optional[str], Optional[str]]],
+        on_commit: Optional[Callable[[], None]] = None
+):
+    """
+    Сохраняет записи FSM (ключ, состояние, данные в JSON) одной транзакцией.
+    Запись без состояния и без данных (data is None) удаляется, чтобы таблица не росла от завершенных диалогов.
+    on_commit вызывается после фиксации транзакции, в которой записаны records (не вызывается при откате).
+    """
+    deleted_keys = [key for key, state, data in records if state is None and data is None]
+    upserted = [{"key": key, "state": state, "data": data or "{}"}
+                for key, state, data in records if state is not None or data is not None]
+    async with get_write_session() as db:
+        if deleted_keys:
+            await db.execute(delete(FsmRecord).where(FsmRecord.key.in_(deleted_keys)))
+        if upserted:
+            insert_stmt = sqlite_insert(FsmRecord)
+            await db.execute(insert_stmt.on_conflict_do_update(
+                index_elements=[FsmRecord.key],
+                set_={
+                    "state": insert_stmt.excluded.state,
+                    "data": insert_stmt.excluded.data,
+                    "updated_at": func.now(),
+                }
+            ), upserted)
+        if on_commit is not None:
+            _call_after_commit(db, on_commit)
+
+
+# --- Функции для служебных настроек бота ---
+
+async def get_bot_setting(key: str) -> Optional[str]:
+    """
+    Получает значение служебной настройки бота. Возвращает None, если настройка не сохранена.
+    """
+    async with get_db_session() as db:
+        return (await db.execute(select(BotSetting.value).where(BotSetting.key == key))).scalar_one_or_none()
+
+
+async def get_bot_setting_with_time(key: str) -> Optional[Tuple[str, Optional[datetime]]]:
+    """
+    Получает значение служебной настройки бота и время его последнего изменения (UTC).
+    Возвращает None, если настройка не сохранена.
+    """
+    async with get_db_session() as db:
+        row = (await db.execute(
+            select(BotSetting.value, BotSetting.updated_at).where(BotSetting.key == key)
+        )).one_or_none()
+    if row is None:
+        return None
+    updated_at = row.updated_at
+    if updated_at is not None and updated_at.tzinfo is None:
+        # SQLite возвращает время CURRENT_TIMESTAMP без часового пояса, в UTC
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return row.value, updated_at
+
+
+async def set_bot_setting(key: str, value: str):
+    """
+    Сохраняет значение служебной настройки бота (создает или заменяет).
+    """
+    async with get_write_session() as db:
+        insert_stmt = sqlite_insert(BotSetting).values(key=key, value=value)
+        await db.execute(insert_stmt.on_conflict_do_update(
+            index_elements=[BotSetting.key],
+            set_={"value": insert_stmt.excluded.value, "updated_at": func.now()}
+        ))
@@ -0,0 +1,183 @@
+"""
+Инструментирование SQL-запросов на уровне движка SQLAlchemy (before/after_cursor_execute).
+
+Для каждого выполненного запроса измеряется задержка и определяется функция db.py, из которой он выполнен.
+Собираются гистограммы задержек по функциям и статистика по отдельным запросам (функция + текст SQL);
+запросы дольше DB_SLOW_QUERY_MS пишутся в лог медленных запросов со скрытыми значениями параметров.
+Статистика накапливается в памяти процесса с момента запуска и показывается админу командой /dbstats.
+"""
+import logging
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from greenlet import getcurrent
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import DB_SLOW_QUERY_MS
+
+slow_query_logger = logging.getLogger("db.slow_queries")
+
+# Верхние границы интервалов гистограммы задержек, мс (последний интервал - все, что дольше)
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+# Максимум отдельно учитываемых запросов; остальные учитываются только в гистограмме функции
+MAX_TRACKED_STATEMENTS = 500
+# Имя модуля, функции которого считаются источником запросов
+DB_MODULE_NAME = "db"
+# Источник запросов, выполненных не из db.py (например, скриптами бенчмарков)
+UNKNOWN_SOURCE = "<other>"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Имена точек сохранения SQLAlchemy уникальны (sa_savepoint_1, ...), в статистике они объединяются
+_SAVEPOINT_NAME_RE = re.compile(r"sa_savepoint_\d+")
+
+
+@dataclass
+class QueryStats:
+    """
+    Накопленная статистика задержек: количество, сумма, максимум и гистограмма по HISTOGRAM_BUCKETS_MS.
+    """
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BUCKETS_MS) + 1))
+
+    def add(self, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for index, upper_bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if elapsed_ms <= upper_bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile_ms(self, fraction: float) -> float:
+        """
+        Оценка перцентиля по гистограмме: верхняя граница интервала, в который он попадает
+        (для последнего интервала - максимум).
+        """
+        threshold = self.count * fraction
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= threshold and bucket_count:
+                return HISTOGRAM_BUCKETS_MS[index] if index < len(HISTOGRAM_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+
+# Статистика по функциям db.py и по отдельным запросам (функция, нормализованный текст SQL)
+_function_stats: Dict[str, QueryStats] = {}
+_statement_stats: Dict[Tuple[str, str], QueryStats] = {}
+# Время запуска сбора статистики (time.time())
+started_at = time.time()
+
+
+def _find_query_source() -> str:
+    """
+    Находит функцию db.py, выполняющую запрос. Асинхронный движок выполняет запрос в отдельном greenlet,
+    поэтому после его стека просматривается стек родительского greenlet, где находятся корутины вызывающего кода.
+    """
+    frame = sys._getframe(2)
+    current = getcurrent()
+    while True:
+        while frame is not None:
+            if frame.f_globals.get("__name__") == DB_MODULE_NAME:
+                return frame.f_code.co_name
+            frame = frame.f_back
+        current = current.parent
+        if current is None:
+            return UNKNOWN_SOURCE
+        frame = current.gr_frame
+
+
+def _redact_parameters(parameters: Any, executemany: bool) -> str:
+    """
+    Описывает параметры запроса без значений: имена именованных параметров и количество позиционных.
+    """
+    if executemany:
+        return f"<{len(parameters)} наборов параметров>"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: ?" for name in parameters) + "}"
+    if parameters:
+        return "(" + ", ".join("?" for _ in parameters) + ")"
+    return "()"
+
+
+def _before_cursor_execute(connection, _cursor, _statement, _parameters, _context, _executemany):
+    connection.info.setdefault("query_started_at", []).append((time.perf_counter(), _find_query_source()))
+
+
+def _after_cursor_execute(connection, _cursor, statement, parameters, _context, executemany):
+    query_started_at, source = connection.info["query_started_at"].pop()
+    elapsed_ms = (time.perf_counter() - query_started_at) * 1000
+    record_query(source, statement, elapsed_ms)
+    if elapsed_ms >= DB_SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            f"Медленный запрос ({elapsed_ms:.1f} мс) в {source}: {_normalize_statement(statement)} "
+            f"| параметры: {_redact_parameters(parameters, executemany)}"
+        )
+
+
+def _handle_error(exception_context):
+    """
+    Убирает замер запроса, завершившегося ошибкой (after_cursor_execute для него не вызывается).
+    """
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started_at"):
+        connection.info["query_started_at"].pop()
+
+
+def _normalize_statement(statement: str) -> str:
+    return _SAVEPOINT_NAME_RE.sub("sa_savepoint_N", _WHITESPACE_RE.sub(" ", statement).strip())
+
+
+def record_query(source: str, statement: str, elapsed_ms: float):
+    """
+    Учитывает выполненный запрос в статистике функции и запроса.
+    """
+    _function_stats.setdefault(source, QueryStats()).add(elapsed_ms)
+    key = (source, _normalize_statement(statement))
+    statement_stats = _statement_stats.get(key)
+    if statement_stats is None:
+        if len(_statement_stats) >= MAX_TRACKED_STATEMENTS:
+            return
+        statement_stats = _statement_stats[key] = QueryStats()
+    statement_stats.add(elapsed_ms)
+
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    Подключает сбор статистики запросов к движку.
+    """
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+def get_function_stats() -> List[Tuple[str, QueryStats]]:
+    """
+    Статистика по функциям db.py, от наибольшего суммарного времени к наименьшему.
+    """
+    return sorted(_function_stats.items(), key=lambda item: item[1].total_ms, reverse=True)
+
+
+def get_slowest_statements(limit: int) -> List[Tuple[Tuple[str, str], QueryStats]]:
+    """
+    Запросы с наибольшей максимальной задержкой.
+    """
+    return sorted(_statement_stats.items(), key=lambda item: item[1].max_ms, reverse=True)[:limit]
+
+
+def get_most_frequent_statements(limit: int) -> List[Tuple[Tuple[str, str], QueryStats]]:
+    """
+    Самые часто выполняемые запросы.
+    """
+    return sorted(_statement_stats.items(), key=lambda item: item[1].count, reverse=True)[:limit]
@@ -0,0 +1,148 @@
+import csv
+import io
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+
+# Модуль не импортирует ни БД, ни aiogram, ни локализацию: его функции выполняются в пуле экспорта,
+# в том числе в отдельных процессах, и получают все локализованные строки через контекст рендеринга.
+
+# Колонки заказа в порядке их вывода в файл экспорта.
+# Дополнительные поля, которые не являются частью ORDER_FIELDS_CONFIG, но есть в модели Order
+EXPORT_COLUMNS = [
+    "id", "user_id", "username", "order_text", "full_name",
+    "delivery_address", "payment_method", "contact_phone",
+    "delivery_notes", "status", "created_at", "sent_at", "received_at"
+]
+
+# Формат даты и времени в CSV
+EXPORT_DATETIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+
+def format_order_value(key: str, value: Any, context: Dict[str, Any]) -> Any:
+    """
+    Преобразует значение колонки заказа для вывода в файл экспорта.
+    Даты возвращаются как datetime (форматирование зависит от формата файла), остальное - как строки.
+
+    :param key: Название колонки из EXPORT_COLUMNS.
+    :param value: Значение колонки.
+    :param context: Контекст рендеринга (см. admin_export.build_render_context).
+    """
+    # Специальная обработка для некоторых полей
+    if key == "payment_method" and value:
+        # Ищем локализованное название выбранного способа оплаты
+        return context["payment_methods"].get(value, str(value))
+    if key == "delivery_notes" and (value is None or str(value).strip() == '-'
+                                    or str(value).strip().lower() == context["no_notes_keyword"]):
+        return context["no_notes_display"]
+    if key.endswith("_at") and isinstance(value, datetime):
+        return value
+    if value is None:
+        return context["not_specified"]  # Для всех остальных None значений
+    if key == "status":
+        return context["statuses"].get(value, f"order_status_{value}")  # Локализуем статус
+    return str(value)
+
+
+def render_csv_header(context: Dict[str, Any]) -> str:
+    """
+    Возвращает строку заголовков CSV.
+    """
+    output = io.StringIO()
+    csv.writer(output).writerow(context["headers"])
+    return output.getvalue()
+
+
+def render_csv_chunk(order_rows: Sequence[Tuple[Any, ...]], context: Dict[str, Any]) -> str:
+    """
+    Формирует текст CSV для пачки заказов (значения колонок в порядке EXPORT_COLUMNS).
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for order_row in order_rows:
+        row: List[str] = []
+        for key, value in zip(EXPORT_COLUMNS, order_row):
+            value = format_order_value(key, value, context)
+            if isinstance(value, datetime):
+                value = value.strftime(EXPORT_DATETIME_FORMAT)  # Форматируем дату и время
+            row.append(value)
+        writer.writerow(row)
+    return output.getvalue()
+
+
+# Числовые колонки, которые в XLSX записываются числами, а не текстом
+XLSX_NUMERIC_COLUMNS = {"id", "user_id"}
+# Формат ячеек с датой и временем в XLSX
+XLSX_DATETIME_FORMAT = 'DD.MM.YYYY HH:MM:SS'
+# Ширина колонок XLSX (в символах), для остальных колонок используется ширина по умолчанию
+XLSX_COLUMN_WIDTHS = {
+    "order_text": 40, "full_name": 25, "delivery_address": 35, "contact_phone": 16,
+    "delivery_notes": 30, "created_at": 20, "sent_at": 20, "received_at": 20,
+}
+
+
+def create_xlsx_workbook(context: Dict[str, Any], sheet_title: str = "Orders") -> Tuple[Workbook, WriteOnlyWorksheet]:
+    """
+    Создает потоковую (write-only) книгу XLSX с листом заказов и строкой заголовков.
+    Строки такой книги сразу сбрасываются во временный файл openpyxl, поэтому память не растет с числом заказов.
+    Книга не потокобезопасна: все вызовы для одной книги должны выполняться последовательно.
+
+    :return: Книга и лист для append_xlsx_chunk.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_title)
+
+    for column_index, key in enumerate(EXPORT_COLUMNS, start=1):
+        if key in XLSX_COLUMN_WIDTHS:
+            worksheet.column_dimensions[get_column_letter(column_index)].width = XLSX_COLUMN_WIDTHS[key]
+    worksheet.freeze_panes = "A2"
+
+    header_cells = []
+    for header in context["headers"]:
+        cell = WriteOnlyCell(worksheet, value=_clean_xlsx_text(header))
+        cell.font = Font(bold=True)
+        header_cells.append(cell)
+    worksheet.append(header_cells)
+    return workbook, worksheet
+
+
+def append_xlsx_chunk(worksheet: WriteOnlyWorksheet, order_rows: Sequence[Tuple[Any, ...]], context: Dict[str, Any]):
+    """
+    Дописывает пачку заказов (значения колонок в порядке EXPORT_COLUMNS) в лист XLSX.
+    Даты записываются как значения даты и времени, ID - как числа.
+    """
+    for order_row in order_rows:
+        row: List[Any] = []
+        for key, value in zip(EXPORT_COLUMNS, order_row):
+            if key in XLSX_NUMERIC_COLUMNS and isinstance(value, int):
+                row.append(value)
+                continue
+            value = format_order_value(key, value, context)
+            if isinstance(value, datetime):
+                # Excel не поддерживает часовые пояса
+                cell = WriteOnlyCell(worksheet, value=value.replace(tzinfo=None))
+                cell.number_format = XLSX_DATETIME_FORMAT
+                row.append(cell)
+            else:
+                row.append(_clean_xlsx_text(value))
+        worksheet.append(row)
+
+
+def save_xlsx_workbook(workbook: Workbook, file_path: str):
+    """
+    Сохраняет потоковую книгу XLSX в файл (для write-only книги возможно только один раз).
+    """
+    workbook.save(file_path)
+
+
+def _clean_xlsx_text(value: str) -> str:
+    """
+    Удаляет управляющие символы, которые недопустимы в XML ячеек XLSX.
+    """
+    return ILLEGAL_CHARACTERS_RE.sub("", value)
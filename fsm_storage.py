@@ -0,0 +1,406 @@
+"""
+Хранилища FSM вместо MemoryStorage aiogram.
+
+SQLiteStorage - состояние в базе данных бота (таблица fsm_records): незавершенные заказы
+(OrderStates) и действия админов переживают перезапуск бота.
+Горячие записи хранятся в памяти (LRU, FSM_CACHE_SIZE ключей), поэтому чтение состояния на каждое
+обновление не обращается к БД. Изменения внутри обновления (несколько state.update_data в хендлере)
+только помечают ключ измененным, а в БД записываются одной транзакцией в конце обновления
+(FsmWriteMiddleware). Изменения вне обновлений (фоновые задачи) записываются сразу.
+Кэш в памяти предполагает, что обновления одного пользователя обрабатывает один процесс.
+Если процессов несколько и обновления пользователя могут попасть в любой из них,
+кэш нужно отключить (FSM_CACHE_SIZE=0): тогда состояние читается из общей БД на каждое обновление.
+
+BoundedMemoryStorage - состояние только в памяти, но с ограниченным объемом: записи без состояния и данных
+не хранятся, брошенные диалоги удаляются через FSM_STATE_TTL секунд простоя (периодическая очистка
+и проверка при чтении), а число записей ограничено FSM_MAX_RECORDS (вытесняются давно не использованные).
+
+BoundedEventIsolation - блокировки обновлений по ключу FSM, которые удаляются, как только ключ никем
+не используется (SimpleEventIsolation хранит блокировку каждого ключа вечно).
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterable, Mapping, Optional, Set, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from config import FSM_CACHE_SIZE, FSM_STATE_TTL, FSM_MAX_RECORDS, FSM_SWEEP_INTERVAL
+from db import get_fsm_record, save_fsm_records
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _FsmRecord:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class _WriteBatch:
+    """
+    Ключи, измененные во время обработки одного обновления. После записи пакет закрывается:
+    изменения из задач, созданных хендлером и переживших обновление, записываются сразу.
+    """
+    keys: Set[str] = field(default_factory=set)
+    closed: bool = False
+
+
+def _approximate_size(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Приблизительный размер объекта в памяти с вложенными контейнерами и строками, байт.
+    Общие объекты (одинаковые строки, ключи) учитываются один раз.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approximate_size(key, seen) + _approximate_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_approximate_size(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_approximate_size(getattr(obj, slot), seen) for slot in obj.__slots__)
+    elif hasattr(obj, "__dict__"):
+        size += _approximate_size(obj.__dict__, seen)
+    return size
+
+
+# Пакет записи текущего обновления (None вне обновления)
+_write_batch: ContextVar[Optional[_WriteBatch]] = ContextVar("_fsm_write_batch", default=None)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_records с кэшем горячих записей и объединением записей (см. описание модуля).
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE):
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._cache_size = cache_size
+        self._records: "OrderedDict[str, _FsmRecord]" = OrderedDict()
+        # Ключи, измененные в памяти, но еще не записанные в БД; не вытесняются из кэша
+        self._dirty: Set[str] = set()
+        # Номер последнего изменения ключа: запись в БД снимает отметку, только если ключ с тех пор не менялся
+        self._versions: Dict[str, int] = {}
+
+    async def _get_record(self, key: str) -> _FsmRecord:
+        record = self._records.get(key)
+        if record is not None:
+            self._records.move_to_end(key)
+            return record
+
+        row = await get_fsm_record(key)
+        # Пока запись читалась, ее мог загрузить или изменить другой вызов
+        record = self._records.get(key)
+        if record is None:
+            record = _FsmRecord(state=row[0], data=json.loads(row[1])) if row is not None else _FsmRecord()
+            self._records[key] = record
+            self._evict()
+        return record
+
+    def _evict(self):
+        """
+        Вытесняет из кэша самые давние записанные в БД ключи сверх cache_size.
+        Измененные ключи из начала кэша переносятся в конец: просматриваются только они и вытесняемые ключи.
+        """
+        excess = len(self._records) - self._cache_size
+        for _ in range(len(self._records)):
+            if excess <= 0:
+                break
+            key, record = self._records.popitem(last=False)
+            if key in self._dirty:
+                self._records[key] = record
+            else:
+                excess -= 1
+
+    async def _mark_dirty(self, key: str, record: _FsmRecord):
+        # Запись могла быть вытеснена сразу после чтения (cache_size=0): измененная хранится до записи в БД
+        self._records[key] = record
+        self._dirty.add(key)
+        self._versions[key] = self._versions.get(key, 0) + 1
+        batch = _write_batch.get()
+        if batch is not None and not batch.closed:
+            batch.keys.add(key)
+        else:
+            await self.flush([key])
+
+    def _mark_saved(self, versions: Dict[str, int]):
+        """
+        Снимает отметку изменения с ключей, записанных в БД в версии versions (вызывается после фиксации
+        транзакции записи). Ключи, измененные после начала записи, остаются измененными.
+        """
+        for key, version in versions.items():
+            if self._versions.get(key) == version:
+                self._dirty.discard(key)
+                del self._versions[key]
+        self._evict()
+
+    async def flush(self, keys: Iterable[str]):
+        """
+        Записывает измененные ключи в БД одной транзакцией. Ключи остаются измененными, пока транзакция
+        не зафиксирована: при ошибке или откате они будут записаны при следующей записи или при закрытии хранилища.
+        """
+        keys = [key for key in keys if key in self._dirty]
+        if not keys:
+            return
+        records = []
+        for key in keys:
+            record = self._records[key]
+            data = json.dumps(record.data, ensure_ascii=False) if record.data else None
+            records.append((key, record.state, data))
+        versions = {key: self._versions[key] for key in keys}
+        try:
+            await save_fsm_records(records, on_commit=lambda: self._mark_saved(versions))
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояния FSM ({len(keys)} ключей): {e}", exc_info=True)
+
+    @asynccontextmanager
+    async def coalesce_writes(self) -> AsyncIterator[None]:
+        """
+        Откладывает запись изменений до выхода из блока и записывает все измененные ключи одной транзакцией.
+        """
+        batch = _WriteBatch()
+        token = _write_batch.set(batch)
+        try:
+            yield
+        finally:
+            _write_batch.reset(token)
+            batch.closed = True
+            await self.flush(batch.keys)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key_builder.build(key)
+        record = await self._get_record(storage_key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._mark_dirty(storage_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(self._key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        storage_key = self._key_builder.build(key)
+        record = await self._get_record(storage_key)
+        record.data = data.copy()
+        await self._mark_dirty(storage_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_record(self._key_builder.build(key))).data.copy()
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        record = await self._get_record(self._key_builder.build(storage_key))
+        return copy(record.data.get(dict_key, default))
+
+    def memory_stats(self) -> Dict[str, int]:
+        """
+        Объем кэша в памяти: количество записей, еще не записанных в БД записей и приблизительный размер, байт.
+        """
+        return {
+            "records": len(self._records),
+            "dirty": len(self._dirty),
+            "approx_bytes": _approximate_size(self._records),
+        }
+
+    async def close(self) -> None:
+        """
+        Записывает все еще не сохраненные изменения. Вызывается при остановке диспетчера.
+        """
+        await self.flush(list(self._dirty))
+        if self._dirty:
+            logger.error(f"При остановке не сохранены состояния FSM: {len(self._dirty)}.")
+
+
+class _MemoryRecord:
+    """
+    Запись BoundedMemoryStorage. __slots__ вместо __dict__: записей могут быть сотни тысяч.
+    """
+    __slots__ = ("state", "data", "touched_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], touched_at: float):
+        self.state = state
+        self.data = data
+        self.touched_at = touched_at
+
+
+def _compact_key(key: StorageKey) -> Tuple:
+    # Кортеж вместо StorageKey (dataclass с __dict__) - в несколько раз меньше в памяти
+    return key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    Хранилище FSM в памяти с ограничением объема (см. описание модуля).
+    Записи упорядочены по последнему обращению, поэтому и просроченные, и вытесняемые по размеру
+    записи находятся в начале словаря.
+    """
+
+    def __init__(self, ttl: float = FSM_STATE_TTL, max_records: int = FSM_MAX_RECORDS,
+                 sweep_interval: float = FSM_SWEEP_INTERVAL):
+        self._ttl = ttl
+        self._max_records = max_records
+        self._sweep_interval = sweep_interval
+        self._records: "OrderedDict[Tuple, _MemoryRecord]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        # Счетчики с момента запуска
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    def _get_record(self, key: StorageKey) -> Optional[_MemoryRecord]:
+        compact_key = _compact_key(key)
+        record = self._records.get(compact_key)
+        if record is None:
+            return None
+        now = time.monotonic()
+        if self._ttl and now - record.touched_at > self._ttl:
+            # Диалог брошен: состояние истекло, даже если очистка до него еще не дошла
+            del self._records[compact_key]
+            self.expired_count += 1
+            return None
+        record.touched_at = now
+        self._records.move_to_end(compact_key)
+        return record
+
+    def _put_record(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        compact_key = _compact_key(key)
+        if state is None and not data:
+            # Пустая запись ничем не отличается от отсутствующей (state.clear())
+            self._records.pop(compact_key, None)
+            return
+        self._records[compact_key] = _MemoryRecord(state, data, time.monotonic())
+        self._records.move_to_end(compact_key)
+        while len(self._records) > self._max_records:
+            self._records.popitem(last=False)
+            self.evicted_count += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get_record(key)
+        self._put_record(key, state.state if isinstance(state, State) else state, record.data if record else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get_record(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = self._get_record(key)
+        self._put_record(key, record.state if record else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get_record(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        record = self._get_record(storage_key)
+        return copy(record.data.get(dict_key, default)) if record else default
+
+    def sweep(self) -> int:
+        """
+        Удаляет записи, простаивающие дольше ttl. Возвращает количество удаленных записей.
+        """
+        if not self._ttl:
+            return 0
+        expired_before = time.monotonic() - self._ttl
+        expired = 0
+        while self._records:
+            compact_key, record = next(iter(self._records.items()))
+            if record.touched_at > expired_before:
+                break
+            del self._records[compact_key]
+            expired += 1
+        self.expired_count += expired
+        return expired
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            expired = self.sweep()
+            if expired:
+                logger.info(f"FSM: удалено брошенных состояний: {expired}, осталось записей: {len(self._records)}.")
+
+    def start_sweeper(self):
+        """
+        Запускает периодическую очистку просроченных записей (раз в sweep_interval секунд).
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._run_sweeper(), name="fsm-sweeper")
+
+    def memory_stats(self) -> Dict[str, int]:
+        """
+        Объем хранилища: количество записей, приблизительный размер (байт) и счетчики удаленных записей.
+        """
+        return {
+            "records": len(self._records),
+            "approx_bytes": _approximate_size(self._records),
+            "expired": self.expired_count,
+            "evicted": self.evicted_count,
+        }
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class BoundedEventIsolation(BaseEventIsolation):
+    """
+    Изоляция обновлений одного ключа FSM (как SimpleEventIsolation), но блокировка ключа удаляется,
+    когда ее не держит и не ждет ни одно обновление.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Tuple, _KeyLock] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncIterator[None]:
+        compact_key = _compact_key(key)
+        key_lock = self._locks.get(compact_key)
+        if key_lock is None:
+            key_lock = self._locks[compact_key] = _KeyLock()
+        key_lock.users += 1
+        try:
+            async with key_lock.lock:
+                yield
+        finally:
+            key_lock.users -= 1
+            # Блокировку могли уже удалить (close) и создать новую для того же ключа: удаляем только свою
+            if not key_lock.users and self._locks.get(compact_key) is key_lock:
+                del self._locks[compact_key]
+
+    def active_keys_count(self) -> int:
+        """
+        Количество ключей, для которых сейчас обрабатываются или ждут обновления.
+        (Не __len__: Dispatcher проверяет изоляцию как bool, и пустая изоляция считалась бы отсутствующей.)
+        """
+        return len(self._locks)
+
+    async def close(self) -> None:
+        """
+        Удаляет неиспользуемые блокировки. Занятые остаются: при поллинге диспетчер закрывает изоляцию
+        раньше, чем main.run_polling дожидается обрабатываемых обновлений.
+        """
+        for compact_key in [compact_key for compact_key, key_lock in self._locks.items() if not key_lock.users]:
+            del self._locks[compact_key]
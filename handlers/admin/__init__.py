@@ -1,11 +1,15 @@
 from aiogram import Router
 
 # Импортируем роутеры из наших новых модулей
+from .admin_broadcast import router as admin_broadcast_router
+from .admin_db_stats import router as admin_db_stats_router
+from .admin_fsm_stats import router as admin_fsm_stats_router
 from .admin_help_messages import router as admin_help_messages_router
 from .admin_main_menu import router as admin_main_menu_router
 from .admin_order_details import router as admin_order_details_router
 from .admin_orders_all import router as admin_orders_all_router
 from .admin_orders_search import router as admin_orders_search_router
+from .admin_send_stats import router as admin_send_stats_router
 
 # Импортируем AdminStates из admin_states.py внутри этого же пакета
 from .admin_states import AdminStates
@@ -14,10 +18,14 @@ from .admin_states import AdminStates
 admin_router = Router()
 
 # Регистрируем все дочерние роутеры
+admin_router.include_router(admin_broadcast_router)
+admin_router.include_router(admin_db_stats_router)
+admin_router.include_router(admin_fsm_stats_router)
 admin_router.include_router(admin_help_messages_router)
 admin_router.include_router(admin_main_menu_router)
 admin_router.include_router(admin_order_details_router)
 admin_router.include_router(admin_orders_all_router)
 admin_router.include_router(admin_orders_search_router)
+admin_router.include_router(admin_send_stats_router)
 
 __all__ = ["admin_router", "AdminStates"]
@@ -0,0 +1,131 @@
+import logging
+
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery
+from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
+from aiogram.fsm.context import FSMContext
+from aiogram.enums import ParseMode
+
+from db import count_broadcast_recipients, create_broadcast, cancel_broadcast
+from .admin_broadcast_jobs import queue_broadcast, request_broadcast_cancel, get_broadcast_cancel_keyboard
+from .admin_filters import IsAdmin
+from .admin_states import AdminStates
+from localization import get_localized_message
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+
+@router.callback_query(F.data == "admin_broadcast_start", IsAdmin())
+async def admin_broadcast_start(
+        callback: CallbackQuery,
+        state: FSMContext,
+        lang: str
+):
+    """
+    Обработчик callback-запроса: начинает создание рассылки и запрашивает ее текст.
+    """
+    logger.info(f"Админ {callback.from_user.id} начал создание рассылки.")
+    await state.set_state(AdminStates.waiting_for_broadcast_text)
+
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(InlineKeyboardButton(text=get_localized_message("button_back_to_admin_panel", lang),
+                                      callback_data="admin_panel_back"))
+    await callback.message.edit_text(get_localized_message("broadcast_prompt_text", lang),
+                                     reply_markup=keyboard.as_markup(), parse_mode=ParseMode.HTML)
+    await callback.answer()
+
+
+@router.message(AdminStates.waiting_for_broadcast_text, IsAdmin())
+async def admin_process_broadcast_text(
+        message: Message,
+        state: FSMContext,
+        lang: str
+):
+    """
+    Обработчик сообщения: получает текст рассылки, показывает его так, как его увидят получатели,
+    и число получателей, и просит подтвердить запуск.
+    """
+    if not message.text or not message.text.strip():
+        await message.answer(get_localized_message("broadcast_empty_text_error", lang))
+        return
+
+    # html_text сохраняет форматирование админа (жирный, ссылки) в виде HTML, которым отправляется рассылка
+    broadcast_text = message.html_text
+    await state.update_data(broadcast_text=broadcast_text)
+    recipients_count = await count_broadcast_recipients()
+    logger.info(f"Админ {message.from_user.id} ввел текст рассылки, получателей: {recipients_count}.")
+
+    keyboard = InlineKeyboardBuilder()
+    if recipients_count:
+        keyboard.button(text=get_localized_message("admin_button_broadcast_confirm", lang),
+                        callback_data="admin_broadcast_confirm")
+    keyboard.row(InlineKeyboardButton(text=get_localized_message("button_back_to_admin_panel", lang),
+                                      callback_data="admin_panel_back"))
+    keyboard.adjust(1)
+
+    await message.answer(broadcast_text, parse_mode=ParseMode.HTML)
+    confirm_key = "broadcast_confirm" if recipients_count else "broadcast_no_recipients"
+    await message.answer(get_localized_message(confirm_key, lang).format(count=recipients_count),
+                         reply_markup=keyboard.as_markup(), parse_mode=ParseMode.HTML)
+
+
+@router.callback_query(F.data == "admin_broadcast_confirm", IsAdmin())
+async def admin_broadcast_confirm(
+        callback: CallbackQuery,
+        state: FSMContext,
+        lang: str
+):
+    """
+    Обработчик callback-запроса: создает рассылку и ставит ее в очередь воркера.
+    Сообщение с подтверждением становится сообщением о состоянии рассылки.
+    """
+    user_id = callback.from_user.id
+    data = await state.get_data()
+    broadcast_text = data.get("broadcast_text")
+
+    if not broadcast_text:
+        logger.error(f"Админ {user_id}: Попытка запустить рассылку без текста.")
+        await callback.answer(get_localized_message("broadcast_error_text_not_found", lang), show_alert=True)
+        await state.clear()
+        return
+
+    await state.clear()
+    recipients_count = await count_broadcast_recipients()
+    broadcast = await create_broadcast(
+        broadcast_text, created_by=user_id, total_count=recipients_count,
+        status_chat_id=callback.message.chat.id, status_message_id=callback.message.message_id
+    )
+    if not queue_broadcast(broadcast.id):
+        # Воркер не запущен: рассылка сохранена и будет выполнена после перезапуска бота
+        logger.error(f"Админ {user_id}: воркер рассылок не запущен, рассылка ID {broadcast.id} отложена.")
+
+    await callback.message.edit_text(
+        get_localized_message("broadcast_queued", lang).format(id=broadcast.id, total=recipients_count),
+        reply_markup=get_broadcast_cancel_keyboard(broadcast.id, lang), parse_mode=ParseMode.HTML
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_broadcast_cancel:"), IsAdmin())
+async def admin_broadcast_cancel(
+        callback: CallbackQuery,
+        lang: str
+):
+    """
+    Обработчик callback-запроса: останавливает рассылку. Воркер завершит текущую пачку и обновит статус.
+    """
+    try:
+        broadcast_id = int(callback.data.split(":")[1])
+    except (IndexError, ValueError):
+        await callback.answer(get_localized_message("error_invalid_callback_data", lang), show_alert=True)
+        return
+
+    if not await cancel_broadcast(broadcast_id):
+        await callback.answer(get_localized_message("broadcast_already_finished", lang), show_alert=True)
+        return
+
+    request_broadcast_cancel(broadcast_id)
+    logger.info(f"Админ {callback.from_user.id} остановил рассылку ID {broadcast_id}.")
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer(get_localized_message("broadcast_cancel_requested", lang), show_alert=True)
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from db import (
+    get_broadcast,
+    get_unfinished_broadcasts,
+    stream_broadcast_recipients,
+    save_broadcast_progress,
+    get_user_language_code,
+    BROADCAST_UNFINISHED_STATUSES,
+    BROADCAST_RUNNING,
+    BROADCAST_DONE,
+)
+from models import Broadcast
+from localization import get_localized_message
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL, NOTIFICATION_MAX_RETRIES
+from outbound import background_priority, is_scheduled, TokenBucket, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Результаты отправки одному получателю
+SEND_SENT = "sent"
+SEND_FAILED = "failed"
+SEND_BLOCKED = "blocked"
+
+# Очередь ID рассылок; рассылки выполняются по одной, чтобы вместе не превышать BROADCAST_RATE
+_broadcast_queue: Optional[asyncio.Queue] = None
+_broadcast_worker: Optional[asyncio.Task] = None
+# Рассылки, отмененные админом во время выполнения; воркер проверяет их между пачками получателей
+_cancelled_broadcasts: Set[int] = set()
+
+
+def start_broadcast_worker(bot: Bot, resume_unfinished: bool = True):
+    """
+    Запускает воркер рассылок. Рассылки, прерванные остановкой бота, продолжаются с сохраненного места,
+    если resume_unfinished. Вызывается при запуске бота.
+    """
+    global _broadcast_queue, _broadcast_worker
+    _broadcast_queue = asyncio.Queue()
+    _broadcast_worker = asyncio.create_task(_run_broadcast_worker(bot, resume_unfinished), name="broadcast")
+    logger.info("Запущен воркер рассылок.")
+
+
+async def stop_broadcast_worker():
+    """
+    Останавливает воркер рассылок. Прогресс сохранен после последней отправленной пачки,
+    после перезапуска рассылка продолжится с нее.
+    """
+    global _broadcast_queue, _broadcast_worker
+    if _broadcast_worker is not None:
+        _broadcast_worker.cancel()
+        await asyncio.gather(_broadcast_worker, return_exceptions=True)
+    _broadcast_queue = None
+    _broadcast_worker = None
+    _cancelled_broadcasts.clear()
+
+
+def queue_broadcast(broadcast_id: int) -> bool:
+    """
+    Ставит созданную рассылку в очередь воркера. Возвращает False, если воркер не запущен.
+    """
+    if _broadcast_queue is None:
+        return False
+    _broadcast_queue.put_nowait(broadcast_id)
+    logger.info(f"Рассылка ID {broadcast_id} поставлена в очередь, рассылок в очереди: {_broadcast_queue.qsize()}.")
+    return True
+
+
+def request_broadcast_cancel(broadcast_id: int):
+    """
+    Просит воркер остановить рассылку после текущей пачки. Статус в БД меняет вызывающий код (db.cancel_broadcast).
+    """
+    _cancelled_broadcasts.add(broadcast_id)
+
+
+def get_broadcast_cancel_keyboard(broadcast_id: int, lang: str) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text=get_localized_message("admin_button_broadcast_cancel", lang),
+                    callback_data=f"admin_broadcast_cancel:{broadcast_id}")
+    return keyboard.as_markup()
+
+
+async def _run_broadcast_worker(bot: Bot, resume_unfinished: bool):
+    """
+    Воркер рассылок: продолжает незавершенные рассылки, затем выполняет новые из очереди по одной.
+    """
+    # Рассылка уступает планировщику исходящих сообщений место ответам пользователям и уведомлениям
+    background_priority(PRIORITY_BULK)
+    try:
+        for broadcast in await get_unfinished_broadcasts() if resume_unfinished else []:
+            logger.info(f"Рассылка ID {broadcast.id} ({broadcast.status}) будет продолжена после пользователя "
+                        f"{broadcast.last_user_id}.")
+            _broadcast_queue.put_nowait(broadcast.id)
+    except Exception as e:
+        logger.error(f"Не удалось загрузить незавершенные рассылки: {e}", exc_info=True)
+
+    while True:
+        broadcast_id = await _broadcast_queue.get()
+        try:
+            await _run_broadcast(bot, broadcast_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка в рассылке ID {broadcast_id}: {e}", exc_info=True)
+        finally:
+            _cancelled_broadcasts.discard(broadcast_id)
+            _broadcast_queue.task_done()
+
+
+async def _run_broadcast(bot: Bot, broadcast_id: int):
+    """
+    Отправляет рассылку получателям пачками в порядке user_id, начиная после сохраненного last_user_id.
+    Внутри пачки отправки идут параллельно (не более BROADCAST_CONCURRENCY), не чаще BROADCAST_RATE в секунду.
+    После каждой пачки курсор и счетчики сохраняются в БД: при перезапуске повторно может быть отправлена
+    только последняя незавершенная пачка.
+    """
+    broadcast = await get_broadcast(broadcast_id)
+    if broadcast is None or broadcast.status not in BROADCAST_UNFINISHED_STATUSES:
+        # Рассылка отменена, пока ждала в очереди, или уже выполнена
+        return
+
+    lang = await get_user_language_code(broadcast.created_by)
+    counts = {SEND_SENT: broadcast.sent_count, SEND_FAILED: broadcast.failed_count,
+              SEND_BLOCKED: broadcast.blocked_count}
+    last_user_id = broadcast.last_user_id
+    bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def _send(user_id: int) -> str:
+        async with semaphore:
+            return await _send_broadcast_message(bot, bucket, user_id, broadcast.message_text)
+
+    if not await save_broadcast_progress(broadcast_id, last_user_id, counts[SEND_SENT], counts[SEND_FAILED],
+                                         counts[SEND_BLOCKED], status=BROADCAST_RUNNING):
+        return
+    logger.info(f"Рассылка ID {broadcast_id} начата, получателей: {broadcast.total_count}.")
+    await _update_broadcast_status(bot, broadcast, "broadcast_progress", counts, lang, with_cancel_button=True)
+    last_progress_at = time.monotonic()
+
+    async for user_ids in stream_broadcast_recipients(after_user_id=last_user_id):
+        if broadcast_id in _cancelled_broadcasts:
+            break
+        for result in await asyncio.gather(*(_send(user_id) for user_id in user_ids)):
+            counts[result] += 1
+        last_user_id = user_ids[-1]
+        if not await save_broadcast_progress(broadcast_id, last_user_id, counts[SEND_SENT], counts[SEND_FAILED],
+                                             counts[SEND_BLOCKED]):
+            # Рассылка отменена админом (в том числе другим) во время отправки пачки
+            break
+        if time.monotonic() - last_progress_at >= BROADCAST_PROGRESS_INTERVAL:
+            last_progress_at = time.monotonic()
+            await _update_broadcast_status(bot, broadcast, "broadcast_progress", counts, lang,
+                                           with_cancel_button=True)
+    else:
+        await save_broadcast_progress(broadcast_id, last_user_id, counts[SEND_SENT], counts[SEND_FAILED],
+                                      counts[SEND_BLOCKED], status=BROADCAST_DONE)
+        logger.info(f"Рассылка ID {broadcast_id} завершена: {counts}.")
+        await _update_broadcast_status(bot, broadcast, "broadcast_done", counts, lang)
+        return
+
+    logger.info(f"Рассылка ID {broadcast_id} остановлена после пользователя {last_user_id}: {counts}.")
+    await _update_broadcast_status(bot, broadcast, "broadcast_cancelled", counts, lang)
+
+
+async def _send_broadcast_message(bot: Bot, bucket: TokenBucket, user_id: int, text: str) -> str:
+    """
+    Отправляет сообщение рассылки одному получателю. Возвращает SEND_SENT, SEND_BLOCKED (бот заблокирован
+    или пользователь удален) или SEND_FAILED. После ответа "Too Many Requests" приостанавливается вся рассылка;
+    повторяет отправку планировщик исходящих сообщений, если он включен, иначе эта функция.
+    """
+    max_retries = 0 if is_scheduled(bot) else NOTIFICATION_MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            await bot.send_message(user_id, text)
+            return SEND_SENT
+        except TelegramForbiddenError:
+            return SEND_BLOCKED
+        except TelegramRetryAfter as e:
+            logger.warning(f"Лимит Telegram в рассылке (получатель {user_id}), пауза {e.retry_after} с.")
+            bucket.block(e.retry_after)
+        except Exception as e:
+            logger.debug(f"Сообщение рассылки не отправлено пользователю {user_id}: {e}")
+            return SEND_FAILED
+    logger.error(f"Сообщение рассылки не отправлено пользователю {user_id}: лимит Telegram, попыток: "
+                 f"{max_retries + 1}.")
+    return SEND_FAILED
+
+
+async def _update_broadcast_status(bot: Bot, broadcast: Broadcast, message_key: str, counts: dict, lang: str,
+                                   with_cancel_button: bool = False):
+    """
+    Обновляет сообщение о состоянии рассылки у админа. Ошибки Telegram не прерывают рассылку.
+    """
+    if broadcast.status_chat_id is None or broadcast.status_message_id is None:
+        return
+    text = get_localized_message(message_key, lang).format(
+        id=broadcast.id, done=sum(counts.values()), total=broadcast.total_count,
+        sent=counts[SEND_SENT], failed=counts[SEND_FAILED], blocked=counts[SEND_BLOCKED]
+    )
+    reply_markup = get_broadcast_cancel_keyboard(broadcast.id, lang) if with_cancel_button else None
+    try:
+        await bot.edit_message_text(text=text, chat_id=broadcast.status_chat_id,
+                                    message_id=broadcast.status_message_id, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        # Например, "message is not modified" или сообщение удалено админом
+        logger.debug(f"Не удалось обновить статус рассылки ID {broadcast.id}: {e}")
+    except Exception as e:
+        logger.warning(f"Ошибка при обновлении статуса рассылки ID {broadcast.id}: {e}")
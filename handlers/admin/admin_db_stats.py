@@ -0,0 +1,77 @@
+import html
+import logging
+import time
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+
+from .admin_filters import IsAdmin
+from config import DB_QUERY_STATS, DB_QUERY_STATS_TOP
+from db_metrics import QueryStats, get_function_stats, get_slowest_statements, get_most_frequent_statements, started_at
+from localization import get_localized_message
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+# Максимальная длина текста SQL в отчете (сообщение Telegram ограничено 4096 символами)
+STATEMENT_PREVIEW_LENGTH = 120
+MAX_TOP_N = 25
+
+
+def _format_statement_line(source: str, statement: str, stats: QueryStats, lang: str) -> str:
+    preview = statement if len(statement) <= STATEMENT_PREVIEW_LENGTH else statement[:STATEMENT_PREVIEW_LENGTH] + "..."
+    return get_localized_message("db_stats_statement_line", lang).format(
+        source=html.escape(source), count=stats.count, mean=f"{stats.mean_ms:.1f}", max=f"{stats.max_ms:.1f}",
+        statement=html.escape(preview)
+    )
+
+
+@router.message(Command("dbstats"), IsAdmin())
+async def admin_db_stats_command(message: Message, command: CommandObject, lang: str):
+    """
+    Обрабатывает команду /dbstats [N].
+    Показывает статистику SQL-запросов с момента запуска: задержки по функциям db.py,
+    N самых медленных и N самых частых запросов.
+    """
+    logger.info(f"Админ {message.from_user.id} запросил статистику SQL-запросов.")
+
+    if not DB_QUERY_STATS:
+        await message.answer(get_localized_message("db_stats_disabled", lang))
+        return
+
+    top_n = DB_QUERY_STATS_TOP
+    if command.args and command.args.strip().isdigit():
+        top_n = max(1, min(int(command.args.strip()), MAX_TOP_N))
+
+    function_stats = get_function_stats()
+    if not function_stats:
+        await message.answer(get_localized_message("db_stats_empty", lang))
+        return
+
+    uptime_minutes = (time.time() - started_at) / 60
+    lines = [get_localized_message("db_stats_title", lang).format(minutes=f"{uptime_minutes:.0f}"), "",
+             get_localized_message("db_stats_functions", lang)]
+    for source, stats in function_stats[:top_n]:
+        lines.append(get_localized_message("db_stats_function_line", lang).format(
+            source=html.escape(source), count=stats.count, p50=f"{stats.percentile_ms(0.5):.0f}",
+            p95=f"{stats.percentile_ms(0.95):.0f}", max=f"{stats.max_ms:.1f}", total=f"{stats.total_ms / 1000:.2f}"
+        ))
+
+    lines += ["", get_localized_message("db_stats_slowest", lang).format(count=top_n)]
+    lines += [_format_statement_line(source, statement, stats, lang)
+              for (source, statement), stats in get_slowest_statements(top_n)]
+
+    lines += ["", get_localized_message("db_stats_frequent", lang).format(count=top_n)]
+    lines += [_format_statement_line(source, statement, stats, lang)
+              for (source, statement), stats in get_most_frequent_statements(top_n)]
+
+    # Отчет делится на сообщения по строкам, чтобы не превысить лимит длины сообщения Telegram
+    chunk = ""
+    for line in lines:
+        if len(chunk) + len(line) + 1 > 4000:
+            await message.answer(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk.strip():
+        await message.answer(chunk)
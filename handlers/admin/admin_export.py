@@ -1,41 +1,86 @@
-import csv
-import io
-from datetime import datetime
-from typing import List, Dict, Any
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from models import Order
-from localization import get_localized_message, get_available_languages
-from config import ORDER_FIELD_NAMES_KEYS, ORDER_FIELD_MAP
+from db import stream_orders
+from localization import get_localized_message
+from config import ORDER_FIELD_NAMES_KEYS, ORDER_FIELD_MAP, ORDER_STATUS_KEYS, EXPORT_TMP_DIR, EXPORT_EXECUTOR, \
+    EXPORT_WORKERS
+from export_rendering import EXPORT_COLUMNS, render_csv_header, render_csv_chunk, create_xlsx_workbook, \
+    append_xlsx_chunk, save_xlsx_workbook
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def generate_orders_csv(orders: List[Order], lang: str) -> io.BytesIO:
+# Форматы файлов экспорта (используются в callback_data и ключах локализации)
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_XLSX = "xlsx"
+
+# Функция, которую генерация экспорта вызывает после каждой записанной пачки с числом выгруженных заказов
+ProgressCallback = Callable[[int], Awaitable[None]]
+
+# Пул процессов для рендеринга CSV при EXPORT_EXECUTOR=process (создается при первом экспорте)
+_export_executor: Optional[Executor] = None
+# Пул потоков экспорта. XLSX всегда рендерится в нем: книга openpyxl хранит состояние
+# и не может передаваться между процессами
+_xlsx_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_xlsx_executor() -> ThreadPoolExecutor:
+    """
+    Возвращает пул потоков экспорта, создавая его при первом обращении.
     """
-    Генерирует CSV-файл со списком заказов.
+    global _xlsx_executor
+    if _xlsx_executor is None:
+        _xlsx_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+        logger.info(f"Создан пул потоков экспорта, воркеров: {EXPORT_WORKERS}.")
+    return _xlsx_executor
 
-    :param orders: Список объектов Order для экспорта.
-    :param lang: Код языка для локализации заголовков и значений.
-    :return: Объект io.BytesIO, содержащий данные CSV.
+
+def _get_export_executor() -> Executor:
+    """
+    Возвращает пул рендеринга CSV, создавая его при первом обращении.
+    EXPORT_EXECUTOR=process использует отдельные процессы (рендеринг не конкурирует с event loop за GIL),
+    иначе используется общий пул потоков экспорта.
+    """
+    global _export_executor
+    if EXPORT_EXECUTOR != "process":
+        return _get_xlsx_executor()
+    if _export_executor is None:
+        # spawn вместо fork: родительский процесс уже содержит потоки aiosqlite
+        _export_executor = ProcessPoolExecutor(
+            max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Создан пул процессов экспорта, воркеров: {EXPORT_WORKERS}.")
+    return _export_executor
+
+
+def shutdown_export_executor():
+    """
+    Останавливает пулы рендеринга экспорта. Вызывается при остановке бота.
     """
-    logger.info(f"Начало генерации CSV для {len(orders)} заказов на языке '{lang}'.")
+    global _export_executor, _xlsx_executor
+    for executor in (_export_executor, _xlsx_executor):
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    if _export_executor is not None or _xlsx_executor is not None:
+        logger.info("Пулы экспорта остановлены.")
+    _export_executor = None
+    _xlsx_executor = None
 
-    output = io.StringIO()
-    writer = csv.writer(output)
 
-    # Определяем заголовки CSV
+def _get_localized_headers(lang: str) -> List[str]:
+    """
+    Возвращает локализованные заголовки для колонок EXPORT_COLUMNS.
+    """
     # Используем ORDER_FIELD_NAMES_KEYS для получения локализованных названий полей
-    # Дополнительные поля, которые не являются частью ORDER_FIELDS_CONFIG, но есть в модели Order
-    header_keys = [
-        "id", "user_id", "username", "order_text", "full_name",
-        "delivery_address", "payment_method", "contact_phone",
-        "delivery_notes", "status", "created_at", "sent_at", "received_at"
-    ]
-
-    # Локализуем заголовки
     localized_headers = []
-    for key in header_keys:
+    for key in EXPORT_COLUMNS:
         if key in ORDER_FIELD_NAMES_KEYS:
             localized_headers.append(get_localized_message(ORDER_FIELD_NAMES_KEYS[key], lang))
         elif key == "id": # ID заказа
@@ -43,46 +88,166 @@ async def generate_orders_csv(orders: List[Order], lang: str) -> io.BytesIO:
         elif key == "user_id": # ID пользователя
             localized_headers.append(get_localized_message("order_details_user", lang).split("(ID:")[0].strip())
         elif key == "username": # Юзернейм
-            localized_headers.append(get_localized_message("field_name_username", lang)) # Добавим этот ключ в ru.json
+            localized_headers.append(get_localized_message("field_name_username", lang))
         elif key == "status": # Статус
             localized_headers.append(get_localized_message("order_details_status_prefix", lang))
         elif key == "created_at": # Дата создания
             localized_headers.append(get_localized_message("order_details_created_at", lang).replace(":", "").strip())
-        elif key == "sent_at": # Дата отправки (новое поле)
-            localized_headers.append(get_localized_message("field_name_sent_at", lang)) # Добавим этот ключ
-        elif key == "received_at": # Дата получения (новое поле)
-            localized_headers.append(get_localized_message("field_name_received_at", lang)) # Добавим этот ключ
+        elif key == "sent_at": # Дата отправки
+            localized_headers.append(get_localized_message("field_name_sent_at", lang))
+        elif key == "received_at": # Дата получения
+            localized_headers.append(get_localized_message("field_name_received_at", lang))
         else:
             localized_headers.append(key) # Fallback для неизвестных ключей
+    return localized_headers
+
+
+@lru_cache(maxsize=None)
+def build_render_context(lang: str) -> Dict[str, Any]:
+    """
+    Заранее собирает все локализованные строки, нужные для рендеринга экспорта на языке lang.
+    Контекст состоит только из строк и словарей, поэтому передается в пул процессов без модуля локализации.
+    Каталоги локализаций неизменяемы, поэтому контекст собирается один раз на язык; изменять его нельзя.
+    """
+    payment_options = ORDER_FIELD_MAP.get("payment_method", {}).get("options_keys", {})
+    return {
+        "headers": _get_localized_headers(lang),
+        "payment_methods": {
+            value: get_localized_message(localization_key, lang)
+            for localization_key, value in payment_options.items()
+        },
+        "statuses": {status: get_localized_message(f"order_status_{status}", lang) for status in ORDER_STATUS_KEYS},
+        "no_notes_keyword": get_localized_message("no_notes_keyword", lang).lower(),
+        "no_notes_display": get_localized_message("no_notes_display", lang),
+        "not_specified": get_localized_message("not_specified", lang),
+    }
+
+
+async def generate_orders_csv(
+        lang: str,
+        search_query: Optional[str] = None,
+        progress_callback: Optional[ProgressCallback] = None
+) -> Tuple[Optional[str], int]:
+    """
+    Генерирует CSV-файл с заказами во временном файле на диске.
+    Заказы читаются из БД пачками (db.stream_orders), каждая пачка рендерится в пуле экспорта,
+    пока из БД читается следующая, и сразу дописывается в файл. Потребление памяти не зависит
+    от количества выгружаемых заказов, а event loop не блокируется рендерингом.
+
+    :param lang: Код языка для локализации заголовков и значений.
+    :param search_query: Поисковый запрос; если не указан, выгружаются все заказы.
+    :param progress_callback: Вызывается после каждой пачки с количеством уже выгруженных заказов.
+    :return: Путь к временному файлу и количество выгруженных заказов. Если заказов нет, путь равен None.
+             Вызывающий код должен удалить файл после отправки (remove_export_file).
+    """
+    logger.info(f"Начало генерации CSV на языке '{lang}' (поиск: {search_query!r}).")
+
+    loop = asyncio.get_running_loop()
+    executor = _get_export_executor()
+    render_context = build_render_context(lang)
+
+    file_descriptor, file_path = tempfile.mkstemp(prefix="orders_export_", suffix=".csv", dir=EXPORT_TMP_DIR)
+    orders_count = 0
+    pending_chunk = None
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8", newline="") as output:
+            output.write(render_csv_header(render_context))
+
+            async for orders_chunk in stream_orders(EXPORT_COLUMNS, search_query=search_query):
+                rendered_chunk = loop.run_in_executor(executor, render_csv_chunk, orders_chunk, render_context)
+                if pending_chunk is not None:
+                    output.write(await pending_chunk)
+                    if progress_callback is not None:
+                        await progress_callback(orders_count)
+                pending_chunk = rendered_chunk
+                orders_count += len(orders_chunk)
+
+            if pending_chunk is not None:
+                output.write(await pending_chunk)
+    except BaseException:
+        if pending_chunk is not None:
+            pending_chunk.cancel()
+        remove_export_file(file_path)
+        raise
+
+    if orders_count == 0:
+        remove_export_file(file_path)
+        logger.info("Нет заказов для генерации CSV.")
+        return None, 0
 
-    writer.writerow(localized_headers)
-
-    # Записываем данные заказов
-    for order in orders:
-        row = []
-        for key in header_keys:
-            value = getattr(order, key)
-
-            # Специальная обработка для некоторых полей
-            if key == "payment_method" and value:
-                payment_options = ORDER_FIELD_MAP.get("payment_method", {}).get("options_keys", {})
-                # Ищем ключ локализации для выбранного значения
-                localized_payment_method_key = next((k for k, v in payment_options.items() if v == value), None)
-                if localized_payment_method_key:
-                    value = get_localized_message(localized_payment_method_key, lang)
-            elif key == "delivery_notes" and (value is None or str(value).strip() == '-' or str(value).strip().lower() == get_localized_message("no_notes_keyword", lang).lower()):
-                value = get_localized_message("no_notes_display", lang)
-            elif key.endswith("_at") and isinstance(value, datetime):
-                value = value.strftime('%d.%m.%Y %H:%M:%S') # Форматируем дату и время
-            elif value is None:
-                value = get_localized_message("not_specified", lang) # Для всех остальных None значений
-            elif key == "status":
-                value = get_localized_message(f"order_status_{value}", lang) # Локализуем статус
-
-            row.append(str(value)) # Преобразуем все в строку
-
-        writer.writerow(row)
-
-    output.seek(0) # Перемещаем указатель в начало потока
-    logger.info(f"CSV-файл успешно сгенерирован для {len(orders)} заказов.")
-    return io.BytesIO(output.getvalue().encode('utf-8')) # Возвращаем BytesIO с UTF-8 кодировкой
+    logger.info(f"CSV-файл успешно сгенерирован для {orders_count} заказов: {file_path}")
+    return file_path, orders_count
+
+
+async def generate_orders_xlsx(
+        lang: str,
+        search_query: Optional[str] = None,
+        progress_callback: Optional[ProgressCallback] = None
+) -> Tuple[Optional[str], int]:
+    """
+    Генерирует XLSX-файл с заказами во временном файле на диске.
+    Используется потоковая (write-only) книга openpyxl: пачки заказов из db.stream_orders последовательно
+    дописываются в нее в пуле потоков экспорта, пока из БД читается следующая пачка.
+    Даты сохраняются как значения даты и времени, заголовки локализуются.
+
+    :param lang: Код языка для локализации заголовков и значений.
+    :param search_query: Поисковый запрос; если не указан, выгружаются все заказы.
+    :param progress_callback: Вызывается после каждой пачки с количеством уже выгруженных заказов.
+    :return: Путь к временному файлу и количество выгруженных заказов. Если заказов нет, путь равен None.
+             Вызывающий код должен удалить файл после отправки (remove_export_file).
+    """
+    logger.info(f"Начало генерации XLSX на языке '{lang}' (поиск: {search_query!r}).")
+
+    loop = asyncio.get_running_loop()
+    executor = _get_xlsx_executor()
+    render_context = build_render_context(lang)
+
+    file_descriptor, file_path = tempfile.mkstemp(prefix="orders_export_", suffix=".xlsx", dir=EXPORT_TMP_DIR)
+    os.close(file_descriptor)
+    orders_count = 0
+    pending_chunk = None
+    try:
+        workbook, worksheet = await loop.run_in_executor(executor, create_xlsx_workbook, render_context)
+
+        async for orders_chunk in stream_orders(EXPORT_COLUMNS, search_query=search_query):
+            # Книга не потокобезопасна: следующая пачка дописывается только после предыдущей
+            if pending_chunk is not None:
+                await pending_chunk
+                if progress_callback is not None:
+                    await progress_callback(orders_count)
+            pending_chunk = loop.run_in_executor(executor, append_xlsx_chunk, worksheet, orders_chunk,
+                                                 render_context)
+            orders_count += len(orders_chunk)
+
+        if pending_chunk is not None:
+            await pending_chunk
+
+        if orders_count > 0:
+            await loop.run_in_executor(executor, save_xlsx_workbook, workbook, file_path)
+    except BaseException:
+        if pending_chunk is not None:
+            pending_chunk.cancel()
+        remove_export_file(file_path)
+        raise
+
+    if orders_count == 0:
+        remove_export_file(file_path)
+        logger.info("Нет заказов для генерации XLSX.")
+        return None, 0
+
+    logger.info(f"XLSX-файл успешно сгенерирован для {orders_count} заказов: {file_path}")
+    return file_path, orders_count
+
+
+def remove_export_file(file_path: Optional[str]):
+    """
+    Удаляет временный файл экспорта, если он существует.
+    """
+    if not file_path:
+        return
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Не удалось удалить временный файл экспорта {file_path}: {e}")
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, FSInputFile
+
+from db import count_orders
+from localization import get_localized_message
+from config import EXPORT_MAX_CONCURRENT, EXPORT_PROGRESS_INTERVAL
+from outbound import background_priority
+from .admin_export import generate_orders_csv, generate_orders_xlsx, remove_export_file, EXPORT_FORMAT_XLSX
+
+logger = logging.getLogger(__name__)
+
+# Ключ задания экспорта: (формат, язык, поисковый запрос). Одинаковые ожидающие задания объединяются.
+ExportJobKey = Tuple[str, str, Optional[str]]
+
+
+@dataclass
+class ExportRecipient:
+    """
+    Админ, ожидающий файл экспорта, и его сообщение, в котором показывается состояние задания.
+    """
+    chat_id: int
+    status_message_id: int
+
+
+@dataclass
+class ExportJob:
+    """
+    Задание экспорта заказов в очереди. Файл генерируется один раз и отправляется всем получателям.
+    """
+    export_format: str
+    lang: str
+    filename: str
+    search_query: Optional[str] = None
+    recipients: List[ExportRecipient] = field(default_factory=list)
+
+    @property
+    def key(self) -> ExportJobKey:
+        return self.export_format, self.lang, self.search_query
+
+
+# Очередь заданий экспорта и ожидающие (еще не начатые) задания по ключу
+_export_queue: Optional[asyncio.Queue] = None
+_pending_jobs: Dict[ExportJobKey, ExportJob] = {}
+# Задачи воркеров; их количество - глобальный лимит одновременно выполняемых экспортов
+_export_workers: List[asyncio.Task] = []
+
+
+def start_export_workers(bot: Bot):
+    """
+    Запускает воркеры очереди экспорта (EXPORT_MAX_CONCURRENT штук). Вызывается при запуске бота.
+    """
+    global _export_queue
+    _export_queue = asyncio.Queue()
+    for worker_number in range(EXPORT_MAX_CONCURRENT):
+        _export_workers.append(asyncio.create_task(_export_worker(bot, worker_number), name=f"export-{worker_number}"))
+    logger.info(f"Запущены воркеры очереди экспорта: {EXPORT_MAX_CONCURRENT}.")
+
+
+async def stop_export_workers():
+    """
+    Останавливает воркеры очереди экспорта. Выполняемые экспорты прерываются, ожидающие задания отбрасываются.
+    """
+    global _export_queue
+    for worker in _export_workers:
+        worker.cancel()
+    await asyncio.gather(*_export_workers, return_exceptions=True)
+    if _pending_jobs:
+        logger.warning(f"Очередь экспорта остановлена, отброшено ожидающих заданий: {len(_pending_jobs)}.")
+    _export_workers.clear()
+    _pending_jobs.clear()
+    _export_queue = None
+
+
+async def queue_orders_export(
+        callback: CallbackQuery,
+        lang: str,
+        export_format: str,
+        filename: str,
+        search_query: Optional[str] = None
+):
+    """
+    Ставит экспорт заказов в очередь и сразу отвечает на callback.
+    Если такое же задание (формат, язык, запрос) еще ожидает в очереди, админ добавляется к его получателям.
+    Состояние задания показывается в отдельном сообщении, которое обновляет воркер.
+
+    :param export_format: EXPORT_FORMAT_CSV или EXPORT_FORMAT_XLSX.
+    :param filename: Имя файла без расширения, под которым он будет отправлен.
+    :param search_query: Поисковый запрос; если не указан, выгружаются все заказы.
+    """
+    user_id = callback.from_user.id
+
+    if _export_queue is None:
+        logger.error(f"Админ {user_id}: очередь экспорта не запущена, экспорт в {export_format} невозможен.")
+        await callback.answer(get_localized_message(f"export_{export_format}_error_alert", lang), show_alert=True)
+        return
+
+    key = (export_format, lang, search_query)
+    if key in _pending_jobs and any(recipient.chat_id == user_id for recipient in _pending_jobs[key].recipients):
+        await callback.answer(get_localized_message("export_job_already_queued", lang), show_alert=False)
+        return
+
+    status_message = await callback.message.answer(
+        get_localized_message("export_job_queued", lang).format(
+            format=export_format.upper(), position=_export_queue.qsize() + 1)
+    )
+    recipient = ExportRecipient(chat_id=user_id, status_message_id=status_message.message_id)
+
+    # Между проверкой и постановкой в очередь нет await: воркер не может забрать задание без получателя
+    job = _pending_jobs.get(key)
+    if job is None:
+        job = ExportJob(export_format=export_format, lang=lang, filename=filename, search_query=search_query,
+                        recipients=[recipient])
+        _pending_jobs[key] = job
+        _export_queue.put_nowait(job)
+        logger.info(f"Админ {user_id} поставил в очередь экспорт {key}, заданий в очереди: {_export_queue.qsize()}.")
+    else:
+        job.recipients.append(recipient)
+        logger.info(f"Админ {user_id} присоединен к ожидающему экспорту {key}.")
+
+    await callback.answer(get_localized_message("thank_you_processing", lang), show_alert=False)
+
+
+async def _export_worker(bot: Bot, worker_number: int):
+    """
+    Воркер очереди экспорта: выполняет задания по одному.
+    """
+    # Файлы и статусы экспорта отправляются с фоновым приоритетом планировщика исходящих сообщений
+    background_priority()
+    while True:
+        job = await _export_queue.get()
+        # Задание начато: новые такие же запросы создадут новое задание с актуальными данными
+        _pending_jobs.pop(job.key, None)
+        try:
+            logger.info(f"Воркер экспорта {worker_number} начал задание {job.key}.")
+            await _run_export_job(bot, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка воркера экспорта {worker_number} в задании {job.key}: {e}",
+                         exc_info=True)
+        finally:
+            _export_queue.task_done()
+
+
+async def _run_export_job(bot: Bot, job: ExportJob):
+    """
+    Генерирует файл задания, сообщая о прогрессе не чаще раза в EXPORT_PROGRESS_INTERVAL секунд,
+    и отправляет его всем получателям (файл загружается в Telegram один раз).
+    """
+    export_format = job.export_format
+    generate_orders_file = generate_orders_xlsx if export_format == EXPORT_FORMAT_XLSX else generate_orders_csv
+
+    progress_text = get_localized_message("export_job_progress", job.lang)
+    total_orders = 0
+    last_progress_at = time.monotonic()
+
+    async def _report_progress(orders_done: int):
+        nonlocal last_progress_at
+        if time.monotonic() - last_progress_at < EXPORT_PROGRESS_INTERVAL:
+            return
+        last_progress_at = time.monotonic()
+        await _update_job_status(
+            bot, job, progress_text.format(format=export_format.upper(), done=orders_done, total=total_orders)
+        )
+
+    export_file_path = None
+    try:
+        total_orders = await count_orders(job.search_query)
+        await _update_job_status(
+            bot, job, progress_text.format(format=export_format.upper(), done=0, total=total_orders)
+        )
+
+        export_file_path, orders_count = await generate_orders_file(
+            job.lang, search_query=job.search_query, progress_callback=_report_progress
+        )
+
+        if export_file_path is None:
+            await _update_job_status(bot, job, get_localized_message(f"export_{export_format}_no_data_alert", job.lang))
+            logger.warning(f"Нет данных для экспорта {job.key}.")
+            return
+
+        document = FSInputFile(export_file_path, filename=f"{job.filename}.{export_format}")
+        caption = get_localized_message(f"export_{export_format}_success_alert", job.lang)
+        delivered, failed = [], []
+        for recipient in job.recipients:
+            # Ошибка отправки одному админу не прерывает доставку остальным
+            try:
+                sent_message = await bot.send_document(chat_id=recipient.chat_id, document=document, caption=caption)
+            except Exception as e:
+                logger.error(f"Не удалось отправить экспорт {job.key} админу {recipient.chat_id}: {e}")
+                failed.append(recipient)
+                continue
+            delivered.append(recipient)
+            if isinstance(document, FSInputFile):
+                # Остальным получателям отправляем уже загруженный файл по file_id
+                document = sent_message.document.file_id
+
+        if failed:
+            await _update_job_status(
+                bot, job, get_localized_message(f"export_{export_format}_error_alert", job.lang), failed
+            )
+        if not delivered:
+            logger.error(f"Экспорт {job.key} не доставлен ни одному админу.")
+            return
+        await _update_job_status(
+            bot, job, get_localized_message("export_job_done", job.lang).format(
+                format=export_format.upper(), count=orders_count), delivered
+        )
+        logger.info(f"Экспорт {job.key} ({orders_count} заказов) отправлен админам: "
+                    f"{[recipient.chat_id for recipient in delivered]}.")
+
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении экспорта {job.key}: {e}", exc_info=True)
+        await _update_job_status(bot, job, get_localized_message(f"export_{export_format}_error_alert", job.lang))
+    finally:
+        remove_export_file(export_file_path)
+
+
+async def _update_job_status(
+        bot: Bot,
+        job: ExportJob,
+        text: str,
+        recipients: Optional[List[ExportRecipient]] = None
+):
+    """
+    Обновляет сообщения о состоянии задания у получателей (по умолчанию у всех). Ошибки Telegram не прерывают экспорт.
+    """
+    for recipient in job.recipients if recipients is None else recipients:
+        try:
+            await bot.edit_message_text(text=text, chat_id=recipient.chat_id, message_id=recipient.status_message_id)
+        except TelegramBadRequest as e:
+            # Например, "message is not modified" или сообщение удалено админом
+            logger.debug(f"Не удалось обновить статус экспорта {job.key} у админа {recipient.chat_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Ошибка при обновлении статуса экспорта {job.key} у админа {recipient.chat_id}: {e}")
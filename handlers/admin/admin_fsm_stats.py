@@ -0,0 +1,42 @@
+import logging
+from typing import Optional
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.types import Message
+
+from .admin_filters import IsAdmin
+from localization import get_localized_message
+from fsm_storage import BoundedEventIsolation
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+
+@router.message(Command("fsmstats"), IsAdmin())
+async def admin_fsm_stats_command(message: Message, lang: str, fsm_storage: BaseStorage,
+                                  fsm_isolation: Optional[BoundedEventIsolation] = None):
+    """
+    Обрабатывает команду /fsmstats.
+    Показывает, сколько памяти занимает хранилище FSM: количество записей, их приблизительный размер,
+    удаленные брошенные и вытесненные состояния, а также количество активных блокировок обновлений.
+    """
+    logger.info(f"Админ {message.from_user.id} запросил статистику хранилища FSM.")
+
+    memory_stats = getattr(fsm_storage, "memory_stats", None)
+    if memory_stats is None:
+        await message.answer(get_localized_message("fsm_stats_unavailable", lang))
+        return
+
+    stats = memory_stats()
+    lines = [get_localized_message("fsm_stats_title", lang).format(
+        storage=type(fsm_storage).__name__, records=stats["records"], size_kb=f"{stats['approx_bytes'] / 1024:.0f}",
+        locks=fsm_isolation.active_keys_count() if fsm_isolation is not None else 0
+    )]
+    if "expired" in stats:
+        lines.append(get_localized_message("fsm_stats_evictions", lang).format(
+            expired=stats["expired"], evicted=stats["evicted"]))
+    if "dirty" in stats:
+        lines.append(get_localized_message("fsm_stats_dirty", lang).format(dirty=stats["dirty"]))
+    await message.answer("\n".join(lines))
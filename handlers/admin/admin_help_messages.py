@@ -10,7 +10,7 @@ from aiogram.enums import ParseMode
 from aiogram.filters import StateFilter
 
 from db import (
-    get_active_help_message_from_db,
+    get_active_help_messages,
     add_help_message,
     get_help_message_by_id,
     set_active_help_message,
@@ -43,9 +43,10 @@ async def _display_help_messages_menu(
 
     # Получаем статус активных сообщений для всех языков
     available_langs = get_available_languages()
+    active_messages = await get_active_help_messages()
     active_status_parts = []
     for l_code in available_langs:
-        active_message = await get_active_help_message_from_db(l_code)
+        active_message = active_messages.get(l_code)
         if active_message:
             status_text = get_localized_message("admin_help_active_message_status_lang", lang).format(
                 lang_code=l_code.upper(), message_id=active_message.id
@@ -1,13 +1,14 @@
 import logging
 import html
 import urllib.parse
-from typing import Union
+from typing import Optional, Union
 
 from aiogram import Router, F, Bot # Импортируем Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from db import get_order_by_id, update_order_status, update_order_text, delete_order, get_user_language_code # Импортируем get_user_language_code
 from config import ORDER_STATUS_KEYS, ORDER_FIELD_NAMES_KEYS, ORDER_FIELD_MAP
@@ -119,7 +120,8 @@ async def _display_order_details(
     back_callback_data = "admin_panel_back" # Дефолтное значение, если нет информации об источнике
 
     if origin_type == "all":
-        back_callback_data = f"admin_all_orders_page:{origin_page}"
+        # Callback_data страницы с курсором сохраняется при ее отображении (см. _display_orders_paginated)
+        back_callback_data = data.get("orders_page_callback") or f"admin_all_orders_page:{origin_page}"
     elif origin_type == "search" and origin_search_query:
         encoded_query = urllib.parse.quote_plus(origin_search_query)
         back_callback_data = f"admin_search_page:{origin_page}:{encoded_query}"
@@ -180,7 +182,8 @@ async def admin_change_order_status_callback(
         callback: CallbackQuery,
         state: FSMContext,
         lang: str,
-        bot: Bot # ДОБАВЛЕНО: Параметр bot для отправки уведомлений
+        bot: Bot, # ДОБАВЛЕНО: Параметр bot для отправки уведомлений
+        db_session: Optional[AsyncSession] = None
 ):
     """
     Обрабатывает изменение статуса заказа.
@@ -199,19 +202,11 @@ async def admin_change_order_status_callback(
 
     logger.info(f"Админ {user_id} меняет статус заказа ID: {order_id} на {new_status}.")
 
-    # Получаем заказ до обновления статуса, чтобы получить user_id
-    order = await get_order_by_id(order_id)
-    if not order:
-        alert_text = get_localized_message("admin_status_change_failed_alert", lang).format(order_id=order_id)
-        await callback.answer(alert_text, show_alert=True)
-        logger.error(f"Админ {user_id}: Не удалось найти заказ ID {order_id} для изменения статуса.")
-        await _display_order_details(callback, state, order_id, lang)
-        return
-
-    success = await update_order_status(order_id, new_status)
+    # UPDATE ... RETURNING: обновленный заказ (и ID его автора) возвращается без отдельного чтения
+    order = await update_order_status(order_id, new_status, session=db_session)
     status_name_for_admin = get_localized_message(f"order_status_{new_status}", lang)
 
-    if success:
+    if order:
         alert_text = get_localized_message("admin_status_changed_alert", lang).format(
             order_id=order_id, status_name=status_name_for_admin
         )
@@ -219,7 +214,7 @@ async def admin_change_order_status_callback(
 
         # --- ДОБАВЛЕНО: Отправка уведомления пользователю ---
         user_order_id = order.user_id # ID пользователя, который сделал заказ
-        user_lang = await get_user_language_code(user_order_id) # Получаем язык пользователя
+        user_lang = await get_user_language_code(user_order_id, session=db_session) # Получаем язык пользователя
         status_name_for_user = get_localized_message(f"order_status_{new_status}", user_lang) # Локализуем статус для языка пользователя
 
         await send_user_notification(
@@ -1,14 +1,16 @@
 import logging
 
-from aiogram import Router, F, Bot
-from aiogram.types import CallbackQuery, BufferedInputFile # ИЗМЕНЕНО: Импортируем BufferedInputFile
+from aiogram import Router, F
+from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from .admin_utils import _display_orders_paginated
 from .admin_filters import IsAdmin
-from db import get_or_create_user, get_all_orders
+from db import get_or_create_user
 from localization import get_localized_message
-from .admin_export import generate_orders_csv
+from handlers.pagination import parse_keyset_page_callback
+from .admin_export import EXPORT_FORMAT_CSV, EXPORT_FORMAT_XLSX
+from .admin_export_jobs import queue_orders_export
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -48,11 +50,12 @@ async def admin_paginate_all_orders(
 ):
     """
     Обрабатывает пагинацию для просмотра всех заказов.
-    Извлекает номер страницы из callback_data и вызывает вспомогательную функцию для отображения.
+    Извлекает номер страницы и курсор keyset-пагинации из callback_data
+    и вызывает вспомогательную функцию для отображения.
     """
     try:
-        # Ожидаемый формат: "admin_all_orders_page:1"
-        current_page = int(callback.data.split(':')[1])
+        # Ожидаемый формат: "admin_all_orders_page:<page>[:<anchor_page>:<cursor> | :end]"
+        current_page, cursor, direction, skip_pages = parse_keyset_page_callback(callback.data)
     except (ValueError, IndexError):
         logger.error(
             f"Админ {callback.from_user.id}: Неверный формат callback_data для пагинации всех заказов: {callback.data}")
@@ -61,44 +64,20 @@ async def admin_paginate_all_orders(
         return
 
     logger.info(f"Админ {callback.from_user.id} переключает страницу всех заказов на {current_page}.")
-    await _display_orders_paginated(callback, state, lang=lang, current_page=current_page, is_search=False)
+    await _display_orders_paginated(callback, state, lang=lang, current_page=current_page, is_search=False,
+                                    cursor=cursor, direction=direction, skip_pages=skip_pages)
 
 
-@router.callback_query(F.data == "export_all_orders_csv", IsAdmin())
-async def export_all_orders_csv_callback(
+@router.callback_query(F.data.in_({"export_all_orders_csv", "export_all_orders_xlsx"}), IsAdmin())
+async def export_all_orders_callback(
         callback: CallbackQuery,
-        bot: Bot,
         lang: str
 ):
     """
-    Обрабатывает запрос на выгрузку всех заказов в CSV.
+    Обрабатывает запрос на выгрузку всех заказов в CSV или XLSX.
+    Экспорт ставится в очередь и выполняется в фоне, хендлер сразу возвращает управление.
     """
-    user_id = callback.from_user.id
-    logger.info(f"Админ {user_id} запросил выгрузку всех заказов в CSV.")
+    export_format = EXPORT_FORMAT_XLSX if callback.data.endswith(EXPORT_FORMAT_XLSX) else EXPORT_FORMAT_CSV
+    logger.info(f"Админ {callback.from_user.id} запросил выгрузку всех заказов в {export_format}.")
 
-    await callback.answer(get_localized_message("thank_you_processing", lang), show_alert=False)
-
-    try:
-        all_orders, total_count = await get_all_orders(offset=0, limit=None)
-
-        if not all_orders:
-            await callback.message.answer(get_localized_message("export_csv_no_data_alert", lang))
-            await callback.answer(get_localized_message("export_csv_no_data_alert", lang), show_alert=True)
-            logger.warning(f"Админ {user_id}: Нет данных для экспорта всех заказов в CSV.")
-            return
-
-        csv_file_in_memory = await generate_orders_csv(all_orders, lang)
-
-        # ИЗМЕНЕНО: Используем BufferedInputFile вместо FSInputFile
-        await bot.send_document(
-            chat_id=user_id,
-            document=BufferedInputFile(csv_file_in_memory.getvalue(), filename="all_orders.csv"), # .getvalue() для получения байтов
-            caption=get_localized_message("export_csv_success_alert", lang)
-        )
-        logger.info(f"Админу {user_id} успешно отправлен CSV-файл со всеми заказами.")
-        await callback.answer(get_localized_message("export_csv_success_alert", lang), show_alert=True)
-
-    except Exception as e:
-        logger.error(f"Ошибка при выгрузке всех заказов в CSV для админа {user_id}: {e}", exc_info=True)
-        await callback.message.answer(get_localized_message("export_csv_error_alert", lang))
-        await callback.answer(get_localized_message("export_csv_error_alert", lang), show_alert=True)
+    await queue_orders_export(callback, lang, export_format, filename="all_orders")
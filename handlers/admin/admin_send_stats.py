@@ -0,0 +1,40 @@
+import logging
+from typing import Optional
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from .admin_filters import IsAdmin
+from localization import get_localized_message
+from outbound import OutboundScheduler, PRIORITY_NAMES
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+
+@router.message(Command("sendstats"), IsAdmin())
+async def admin_send_stats_command(message: Message, lang: str, outbound_scheduler: Optional[OutboundScheduler]):
+    """
+    Обрабатывает команду /sendstats.
+    Показывает метрики планировщика исходящих сообщений: глубину очереди, время ожидания по приоритетам,
+    количество отправленных сообщений и повторов после лимитов Telegram.
+    """
+    logger.info(f"Админ {message.from_user.id} запросил статистику исходящих сообщений.")
+
+    if outbound_scheduler is None:
+        await message.answer(get_localized_message("send_stats_disabled", lang))
+        return
+
+    queue_depth = outbound_scheduler.queue_depth()
+    lines = [get_localized_message("send_stats_title", lang).format(
+        sent=outbound_scheduler.sent_count, retries=outbound_scheduler.retry_count,
+        max_depth=outbound_scheduler.max_queue_depth
+    )]
+    for priority, name in PRIORITY_NAMES.items():
+        stats = outbound_scheduler.wait_stats[priority]
+        lines.append(get_localized_message("send_stats_priority_line", lang).format(
+            priority=name, depth=queue_depth[name], count=stats.count, mean=f"{stats.mean_ms:.0f}",
+            p95=f"{stats.percentile_ms(0.95):.0f}", max=f"{stats.max_ms:.0f}"
+        ))
+    await message.answer("\n".join(lines))
@@ -5,3 +5,4 @@ class AdminStates(StatesGroup):
     waiting_for_new_order_text = State()  # Пользователь вводит новый текст для заказа
     waiting_for_help_message_text = State()  # Пользователь вводит новое сообщение помощи
     waiting_for_help_message_selection = State()  # Пользователь выбирает сообщение активным/удаляет
+    waiting_for_broadcast_text = State()  # Админ вводит текст рассылки
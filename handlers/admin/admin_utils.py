@@ -1,7 +1,7 @@
 import logging
 import math
 import urllib.parse
-from typing import Union
+from typing import Union, Optional
 
 from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
@@ -9,8 +9,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from aiogram.enums import ParseMode
 
 from config import ORDERS_PER_PAGE, MAX_PREVIEW_TEXT_LENGTH
-from db import get_all_orders, search_orders
+from db import get_all_orders, search_orders, encode_order_cursor, PAGE_OLDER, PAGE_LAST
 from localization import get_localized_message
+from handlers.pagination import build_pagination_buttons, keyset_page_callback, page_reopen_callback
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,7 @@ def _get_admin_main_menu_keyboard(lang: str) -> InlineKeyboardBuilder:
     builder.button(text=get_localized_message("admin_button_find_orders", lang), callback_data="admin_find_orders")
     builder.button(text=get_localized_message("admin_button_manage_help", lang),
                    callback_data="admin_manage_help_messages")
+    builder.button(text=get_localized_message("admin_button_broadcast", lang), callback_data="admin_broadcast_start")
     builder.adjust(1)
     return builder
 
@@ -65,7 +67,10 @@ async def _display_orders_paginated(
         state: FSMContext,
         current_page: int,
         lang: str,
-        is_search: bool = False
+        is_search: bool = False,
+        cursor: Optional[str] = None,
+        direction: str = PAGE_OLDER,
+        skip_pages: int = 0
 ):
     """
     Отображает список заказов с пагинацией в админ-панели.
@@ -81,9 +86,16 @@ async def _display_orders_paginated(
     :param lang: Язык для локализации сообщений.
     :param is_search: Булевый флаг, указывающий, является ли текущее отображение результатами поиска.
                       (True для поиска, False для всех заказов).
+    :param cursor: Курсор keyset-пагинации для списка всех заказов (см. handlers.pagination).
+    :param direction: Направление перехода относительно курсора (PAGE_OLDER, PAGE_NEWER, PAGE_FROM_CURSOR, PAGE_LAST).
+    :param skip_pages: Сколько страниц пропустить от курсора (для переходов на 5 страниц).
     """
     user_id = update_object.from_user.id
-    offset = (current_page - 1) * ORDERS_PER_PAGE
+    if is_search or (cursor is None and direction != PAGE_LAST):
+        # Поиск (ранжированный по релевантности) и переход по номеру страницы используют OFFSET
+        offset = (current_page - 1) * ORDERS_PER_PAGE
+    else:
+        offset = skip_pages * ORDERS_PER_PAGE
     query_text = None
 
     if is_search:
@@ -99,11 +111,25 @@ async def _display_orders_paginated(
 
         orders, total_orders = await search_orders(search_query=query_text, offset=offset, limit=ORDERS_PER_PAGE)
     else:
-        orders, total_orders = await get_all_orders(offset=offset, limit=ORDERS_PER_PAGE)
-
-    await state.update_data(current_page=current_page)
+        orders, total_orders = await get_all_orders(offset=offset, limit=ORDERS_PER_PAGE,
+                                                    cursor=cursor, direction=direction)
 
     total_pages = math.ceil(total_orders / ORDERS_PER_PAGE) if total_orders > 0 else 1
+    if direction == PAGE_LAST:
+        current_page = total_pages
+
+    # Курсоры первой и последней строки страницы для keyset-пагинации
+    first_cursor = encode_order_cursor(orders[0]) if orders else None
+    last_cursor = encode_order_cursor(orders[-1]) if orders else None
+
+    if is_search:
+        await state.update_data(current_page=current_page)
+    else:
+        # Сохраняем callback_data текущей страницы, чтобы кнопка "Назад" из деталей заказа вела сюда без OFFSET
+        await state.update_data(
+            current_page=current_page,
+            orders_page_callback=page_reopen_callback("admin_all_orders_page", current_page, first_cursor)
+        )
 
     # --- Формирование текста заголовка ---
     if query_text:
@@ -143,41 +169,35 @@ async def _display_orders_paginated(
     order_buttons_builder.adjust(1)
 
     # --- Кнопки пагинации ---
-    pagination_builder = InlineKeyboardBuilder()
     page_base_prefix = "admin_search_page" if is_search else "admin_all_orders_page"
     encoded_query_text = urllib.parse.quote_plus(query_text) if query_text else ""
     query_param_suffix = f":{encoded_query_text}" if encoded_query_text else ""
 
-    if current_page > 1:
-        pagination_builder.button(text="⏮️", callback_data=f"{page_base_prefix}:1{query_param_suffix}")
-        if current_page > 5:
-            pagination_builder.button(text=get_localized_message("pagination_prev_5", lang),
-                                      callback_data=f"{page_base_prefix}:{max(1, current_page - 5)}{query_param_suffix}")
-        pagination_builder.button(text=get_localized_message("pagination_prev", lang),
-                                  callback_data=f"{page_base_prefix}:{current_page - 1}{query_param_suffix}")
-
-    if current_page < total_pages:
-        pagination_builder.button(text=get_localized_message("pagination_next", lang),
-                                  callback_data=f"{page_base_prefix}:{current_page + 1}{query_param_suffix}")
-        if current_page < total_pages - 4:
-            pagination_builder.button(text=get_localized_message("pagination_next_5", lang),
-                                      callback_data=f"{page_base_prefix}:{min(total_pages, current_page + 5)}{query_param_suffix}")
-        pagination_builder.button(text="⏭️",
-                                  callback_data=f"{page_base_prefix}:{total_pages}{query_param_suffix}")
+    if is_search:
+        def page_callback(page: int) -> str:
+            return f"{page_base_prefix}:{page}{query_param_suffix}"
+    else:
+        page_callback = keyset_page_callback(page_base_prefix, current_page, total_pages, first_cursor, last_cursor)
+
+    pagination_buttons = build_pagination_buttons(current_page, total_pages, page_callback, lang)
 
     # Комбинируем клавиатуры: сначала кнопки заказов, затем пагинация, затем кнопка "назад"
     final_keyboard = InlineKeyboardBuilder()
     final_keyboard.attach(order_buttons_builder)
 
     if total_orders > ORDERS_PER_PAGE:  # Показываем пагинацию только если есть больше одной страницы
-        final_keyboard.row(*pagination_builder.buttons)
+        final_keyboard.row(*pagination_buttons)
 
-    # --- Кнопка "Выгрузить в CSV" ---
-    export_callback_data = "export_all_orders_csv" if not is_search else f"export_search_orders_csv:{encoded_query_text}"
-    final_keyboard.row(InlineKeyboardButton(
-        text=get_localized_message("button_export_csv", lang),
-        callback_data=export_callback_data
-    ))
+    # --- Кнопки "Выгрузить в CSV" и "Выгрузить в XLSX" ---
+    if not is_search:
+        csv_callback_data, xlsx_callback_data = "export_all_orders_csv", "export_all_orders_xlsx"
+    else:
+        csv_callback_data = f"export_search_orders_csv:{encoded_query_text}"
+        xlsx_callback_data = f"export_search_orders_xlsx:{encoded_query_text}"
+    final_keyboard.row(
+        InlineKeyboardButton(text=get_localized_message("button_export_csv", lang), callback_data=csv_callback_data),
+        InlineKeyboardButton(text=get_localized_message("button_export_xlsx", lang), callback_data=xlsx_callback_data)
+    )
 
     final_keyboard.row(InlineKeyboardButton(
         text=get_localized_message("button_back_to_admin_panel", lang),
@@ -0,0 +1,126 @@
+import logging
+import re
+from typing import Callable, List, Optional, Tuple
+
+from aiogram.utils.keyboard import InlineKeyboardButton
+
+from db import PAGE_OLDER, PAGE_NEWER, PAGE_FROM_CURSOR, PAGE_LAST
+from localization import get_localized_message
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина callback_data в Telegram (в байтах)
+MAX_CALLBACK_DATA_LENGTH = 64
+# Маркер перехода на последнюю страницу в callback_data
+LAST_PAGE_MARKER = "end"
+# Формат курсора заказа (см. db.encode_order_cursor)
+ORDER_CURSOR_REGEX = re.compile(r"^\d{14}(\d{6})?-\d+$")
+
+
+def build_pagination_buttons(
+        current_page: int,
+        total_pages: int,
+        page_callback: Callable[[int], str],
+        lang: str
+) -> List[InlineKeyboardButton]:
+    """
+    Формирует ряд кнопок пагинации: первая страница, -5, назад, вперед, +5, последняя страница.
+
+    :param current_page: Текущий номер страницы.
+    :param total_pages: Общее количество страниц.
+    :param page_callback: Функция, возвращающая callback_data для перехода на страницу с указанным номером.
+    :param lang: Язык для локализации кнопок.
+    """
+    buttons = []
+
+    if current_page > 1:
+        buttons.append(InlineKeyboardButton(text="⏮️", callback_data=page_callback(1)))
+        if current_page > 5:
+            buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_prev_5", lang),
+                                                callback_data=page_callback(max(1, current_page - 5))))
+        buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_prev", lang),
+                                            callback_data=page_callback(current_page - 1)))
+
+    if current_page < total_pages:
+        buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_next", lang),
+                                            callback_data=page_callback(current_page + 1)))
+        if current_page < total_pages - 4:
+            buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_next_5", lang),
+                                                callback_data=page_callback(min(total_pages, current_page + 5))))
+        buttons.append(InlineKeyboardButton(text="⏭️", callback_data=page_callback(total_pages)))
+
+    return buttons
+
+
+def keyset_page_callback(
+        prefix: str,
+        current_page: int,
+        total_pages: int,
+        first_cursor: Optional[str],
+        last_cursor: Optional[str]
+) -> Callable[[int], str]:
+    """
+    Возвращает функцию построения callback_data для keyset-пагинации.
+
+    Форматы callback_data:
+        <prefix>:1                               - первая страница;
+        <prefix>:<page>:end                      - последняя страница (читается с конца списка);
+        <prefix>:<page>:<anchor_page>:<cursor>   - страница относительно курсора страницы anchor_page
+                                                   (последний заказ, если page > anchor_page, первый - если меньше).
+    """
+
+    def _page_callback(target_page: int) -> str:
+        if target_page <= 1:
+            return f"{prefix}:1"
+        if target_page >= total_pages:
+            return f"{prefix}:{total_pages}:{LAST_PAGE_MARKER}"
+
+        cursor = last_cursor if target_page > current_page else first_cursor
+        callback_data = f"{prefix}:{target_page}:{current_page}:{cursor}"
+        if cursor is None or len(callback_data.encode()) > MAX_CALLBACK_DATA_LENGTH:
+            # Откат на переход по номеру страницы (OFFSET)
+            return f"{prefix}:{target_page}"
+        return callback_data
+
+    return _page_callback
+
+
+def page_reopen_callback(prefix: str, current_page: int, first_cursor: Optional[str]) -> str:
+    """
+    Возвращает callback_data для повторного открытия текущей страницы (например, кнопкой "Назад").
+    """
+    if current_page <= 1 or first_cursor is None:
+        return f"{prefix}:{current_page}"
+    callback_data = f"{prefix}:{current_page}:{current_page}:{first_cursor}"
+    if len(callback_data.encode()) > MAX_CALLBACK_DATA_LENGTH:
+        return f"{prefix}:{current_page}"
+    return callback_data
+
+
+def parse_keyset_page_callback(callback_data: str) -> Tuple[int, Optional[str], str, int]:
+    """
+    Разбирает callback_data keyset-пагинации (см. keyset_page_callback).
+    Возвращает номер страницы, курсор, направление для db.py и смещение от курсора в страницах.
+    Формат '<prefix>:<page>' без курсора обрабатывается как переход по номеру страницы (OFFSET).
+    При неверном формате выбрасывает ValueError или IndexError.
+    """
+    parts = callback_data.split(":")
+    page = int(parts[1])
+    if page < 1:
+        raise ValueError(f"Неверный номер страницы: {page}")
+
+    if len(parts) == 2:
+        return page, None, PAGE_OLDER, page - 1
+
+    if parts[2] == LAST_PAGE_MARKER:
+        return page, None, PAGE_LAST, 0
+
+    anchor_page = int(parts[2])
+    cursor = parts[3]
+    if not ORDER_CURSOR_REGEX.fullmatch(cursor):
+        raise ValueError(f"Неверный формат курсора: {cursor}")
+    if page > anchor_page:
+        return page, cursor, PAGE_OLDER, page - anchor_page - 1
+    if page < anchor_page:
+        return page, cursor, PAGE_NEWER, anchor_page - page - 1
+    return page, cursor, PAGE_FROM_CURSOR, 0
@@ -1,5 +1,5 @@
 import logging
-from typing import Union
+from typing import Optional, Union
 import html
 
 from aiogram import Router, F, Bot
@@ -13,6 +13,7 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from db import add_new_order, get_or_create_user # Добавлен get_or_create_user для получения username
 from config import (
@@ -439,7 +440,8 @@ async def final_confirm_order(
         callback: CallbackQuery,
         state: FSMContext,
         bot: Bot,
-        lang: str
+        lang: str,
+        db_session: Optional[AsyncSession] = None
 ):
     """
     Обрабатывает окончательное подтверждение заказа пользователем.
@@ -454,7 +456,8 @@ async def final_confirm_order(
         user_id=user_id,
         username=callback.from_user.username, # Передаем username из callback
         first_name=callback.from_user.first_name,
-        last_name=callback.from_user.last_name
+        last_name=callback.from_user.last_name,
+        session=db_session
     )
     username_to_save = user.username if user else None
 
@@ -466,7 +469,8 @@ async def final_confirm_order(
         delivery_address=user_data.get('delivery_address'),
         payment_method=user_data.get('payment_method'),
         contact_phone=user_data.get('contact_phone'),
-        delivery_notes=user_data.get('delivery_notes', get_localized_message("no_notes_display", lang))
+        delivery_notes=user_data.get('delivery_notes', get_localized_message("no_notes_display", lang)),
+        session=db_session
     )
 
     if new_order:
@@ -474,8 +478,8 @@ async def final_confirm_order(
             get_localized_message("order_placed_success", lang).format(order_id=new_order.id),
             parse_mode=ParseMode.HTML
         )
-        # ИЗМЕНЕНО: Теперь передаем только ID заказа
-        await send_new_order_notification_to_admins(bot, new_order.id)
+        # Заказ передается целиком: уведомление не перечитывает его из БД и отправляется в фоне
+        await send_new_order_notification_to_admins(bot, new_order)
         # Отправляем уведомление пользователю (если уведомления включены)
         await send_user_notification(
             bot,
@@ -1,7 +1,7 @@
 import logging
 import math
 import html
-from typing import Union
+from typing import Union, Optional
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
@@ -9,9 +9,11 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from aiogram.enums import ParseMode
 
-from db import get_user_orders_paginated, count_user_orders
+from db import get_user_orders_paginated, count_user_orders, encode_order_cursor, last_page_size, PAGE_OLDER, \
+    PAGE_LAST
 from config import USER_ORDERS_PER_PAGE, MAX_PREVIEW_TEXT_LENGTH
 from localization import get_localized_message
+from handlers.pagination import build_pagination_buttons, keyset_page_callback, parse_keyset_page_callback
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -43,7 +45,8 @@ async def user_orders_pagination_callback(
     """
     user_id = callback.from_user.id
     try:
-        page = int(callback.data.split(":")[1])
+        # Ожидаемый формат: "user_orders_page:<page>[:<anchor_page>:<cursor> | :end]"
+        page, cursor, direction, skip_pages = parse_keyset_page_callback(callback.data)
     except (ValueError, IndexError):
         logger.error(
             f"Пользователь {user_id}: Неверный формат callback_data для пагинации заказов пользователя: {callback.data}")
@@ -51,29 +54,46 @@ async def user_orders_pagination_callback(
         return
 
     logger.info(f"Пользователь {user_id} переключил страницу заказов на {page}.")
-    await _show_user_orders(callback, state, lang, current_page=page)
+    await _show_user_orders(callback, state, lang, current_page=page,
+                            cursor=cursor, direction=direction, skip_pages=skip_pages)
 
 
 async def _show_user_orders(
         update_object: Union[Message, CallbackQuery],
         state: FSMContext,
         lang: str,
-        current_page: int
+        current_page: int,
+        cursor: Optional[str] = None,
+        direction: str = PAGE_OLDER,
+        skip_pages: int = 0
 ):
     """
     Отображает постраничный список активных заказов пользователя.
+    Страницы ищутся keyset-пагинацией по курсору из callback_data (см. handlers.pagination),
+    без курсора - по номеру страницы.
     """
     user_id = update_object.from_user.id
-    offset = (current_page - 1) * USER_ORDERS_PER_PAGE
+
+    total_orders = await count_user_orders(user_id=user_id)
+    total_pages = math.ceil(total_orders / USER_ORDERS_PER_PAGE) if total_orders > 0 else 1
+
+    limit = USER_ORDERS_PER_PAGE
+    if direction == PAGE_LAST:
+        current_page = total_pages
+        offset = 0
+        limit = last_page_size(total_orders, USER_ORDERS_PER_PAGE)
+    elif cursor is None:
+        offset = (current_page - 1) * USER_ORDERS_PER_PAGE
+    else:
+        offset = skip_pages * USER_ORDERS_PER_PAGE
 
     orders = await get_user_orders_paginated(
         user_id=user_id,
         offset=offset,
-        limit=USER_ORDERS_PER_PAGE
+        limit=limit,
+        cursor=cursor,
+        direction=direction
     )
-    total_orders = await count_user_orders(user_id=user_id)
-
-    total_pages = math.ceil(total_orders / USER_ORDERS_PER_PAGE) if total_orders > 0 else 1
 
     header_text = get_localized_message("my_orders_list_title", lang).format(
         current_page=current_page, total_pages=total_pages
@@ -99,25 +119,15 @@ async def _show_user_orders(
 
     keyboard = InlineKeyboardBuilder()
 
-    # Список для сбора кнопок пагинации
-    pagination_buttons = []
-
-    # Кнопки пагинации
-    if current_page > 1:
-        pagination_buttons.append(InlineKeyboardButton(text="⏮️", callback_data="user_orders_page:1"))
-        if current_page > 5:
-            pagination_buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_prev_5", lang),
-                                                           callback_data=f"user_orders_page:{max(1, current_page - 5)}"))
-        pagination_buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_prev", lang),
-                                                       callback_data=f"user_orders_page:{current_page - 1}"))
-
-    if current_page < total_pages:
-        pagination_buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_next", lang),
-                                                       callback_data=f"user_orders_page:{current_page + 1}"))
-        if current_page < total_pages - 4:
-            pagination_buttons.append(InlineKeyboardButton(text=get_localized_message("pagination_next_5", lang),
-                                                           callback_data=f"user_orders_page:{min(total_pages, current_page + 5)}"))
-        pagination_buttons.append(InlineKeyboardButton(text="⏭️", callback_data=f"user_orders_page:{total_pages}"))
+    # Кнопки пагинации с курсорами первой и последней строки страницы
+    first_cursor = encode_order_cursor(orders[0]) if orders else None
+    last_cursor = encode_order_cursor(orders[-1]) if orders else None
+    pagination_buttons = build_pagination_buttons(
+        current_page,
+        total_pages,
+        keyset_page_callback("user_orders_page", current_page, total_pages, first_cursor, last_cursor),
+        lang
+    )
 
     # Добавляем все кнопки пагинации в один ряд
     if pagination_buttons:  # Добавляем ряд только если есть кнопки пагинации
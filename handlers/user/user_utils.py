@@ -9,9 +9,10 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ParseMode
 
 from localization import get_localized_message
-from db import update_user_language, get_user_language_code, get_user_notifications_status, \
-    update_user_notifications_status, get_or_create_user, get_order_by_id  # Добавлен импорт get_order_by_id
+from db import update_user_language, get_user_notifications_status, update_user_notifications_status, \
+    get_or_create_user, get_users_language_codes
 from config import ADMIN_IDS
+from notifications import fan_out_messages_in_background
 from models import Order, User  # Добавлен импорт User для типизации
 
 logger = logging.getLogger(__name__)
@@ -59,75 +60,54 @@ async def _display_user_main_menu(
 
 
 # --- Вспомогательная функция для уведомления админов о новом заказе ---
-async def send_new_order_notification_to_admins(bot: Bot, order_id: int):
+def _render_new_order_notification(order: Order, lang: str) -> str:
+    """
+    Формирует текст уведомления админам о новом заказе на языке lang.
+    """
+    title = get_localized_message("admin_new_order_notification_title", lang).format(order_id=order.id)
+
+    # Имя пользователя для отображения берется из order.username
+    if order.username:
+        username_text = f"@{order.username}"
+    else:
+        username_text = get_localized_message("not_available", lang)
+
+    full_name_text = order.full_name if order.full_name else get_localized_message("not_provided", lang)
+    phone_number_text = order.contact_phone if order.contact_phone else get_localized_message("not_provided", lang)
+    status_localized = get_localized_message(f"order_status_{order.status}", lang)
+
+    details_template = get_localized_message("admin_new_order_notification_details", lang)
+    return title + "\n\n" + details_template.format(
+        order_id=order.id,
+        user_id=order.user_id,
+        username=username_text,
+        full_name=full_name_text,
+        phone_number=phone_number_text,
+        order_text=order.order_text,
+        status=status_localized,
+        created_at=order.created_at.strftime('%d.%m.%Y %H:%M')
+    )
+
+
+async def send_new_order_notification_to_admins(bot: Bot, order: Order):
     """
     Отправляет уведомление о новом заказе всем администраторам.
-    Получает детали заказа из БД по order_id.
     Уведомления будут отправляться на языке администратора, если он указан в БД,
-    иначе на языке по умолчанию (uk).
+    иначе на языке по умолчанию (uk). Языки админов загружаются одним запросом (или из кэша),
+    текст формируется один раз на язык, а отправка выполняется в фоне параллельно (notifications.py),
+    поэтому вызывающий хендлер не ждет ответов Telegram.
     """
-    logger.info(f"Начало отправки уведомления о новом заказе ID {order_id} администраторам.")
-
-    order = await get_order_by_id(order_id)
-    if not order:
-        logger.error(
-            f"Ошибка: Не удалось найти заказ ID {order_id} для отправки уведомления администраторам. Уведомление не отправлено.")
+    if not ADMIN_IDS:
         return
-    else:
-        logger.info(f"Получен заказ по ID. {order.id}, {order.username}")
-    logger.debug(f"Заказ ID {order_id} успешно получен из БД.")
+    logger.info(f"Начало отправки уведомления о новом заказе ID {order.id} администраторам.")
 
-    for admin_id in ADMIN_IDS:
-        logger.debug(f"Попытка отправить уведомление админу {admin_id} для заказа ID {order_id}.")
-        try:
-            admin_lang = await get_user_language_code(admin_id)
-            logger.debug(f"Для админа {admin_id} определен язык: '{admin_lang}'.")
-
-            # ИЗМЕНЕНО: Удален вызов get_or_create_user для order_user
-            # Теперь username берется напрямую из объекта order
-
-            title = get_localized_message("admin_new_order_notification_title", admin_lang).format(order_id=order.id)
-            logger.debug(f"Заголовок уведомления для админа {admin_id}: '{title}'.")
-
-            # ИЗМЕНЕНО: Формирование имени пользователя для отображения только из order.username
-            if order.username:
-                username_text = f"@{order.username}"
-            else:
-                username_text = get_localized_message("not_available", admin_lang)
-
-            logger.debug(f"Username для уведомления: '{username_text}'.")
-
-            full_name_text = order.full_name if order.full_name else get_localized_message("not_provided", admin_lang)
-            logger.debug(f"Полное имя для уведомления: '{full_name_text}'.")
-
-            phone_number_text = order.contact_phone if order.contact_phone else get_localized_message("not_provided",
-                                                                                                      admin_lang)
-            logger.debug(f"Телефон для уведомления: '{phone_number_text}'.")
-
-            status_localized = get_localized_message(f"order_status_{order.status}", admin_lang)
-            logger.debug(f"Локализованный статус заказа: '{status_localized}'.")
-
-            details_template = get_localized_message("admin_new_order_notification_details", admin_lang)
-            logger.debug(f"Шаблон деталей уведомления: '{details_template[:100]}...'")  # Логируем часть шаблона
-
-            notification_text = title + "\n\n" + details_template.format(
-                order_id=order.id,
-                user_id=order.user_id,
-                username=username_text,
-                full_name=full_name_text,
-                phone_number=phone_number_text,
-                order_text=order.order_text,
-                status=status_localized,
-                created_at=order.created_at.strftime('%d.%m.%Y %H:%M')
-            )
-            logger.debug(
-                f"Полный текст уведомления для админа {admin_id}: '{notification_text[:500]}...'")  # Логируем часть сообщения
-
-            await bot.send_message(admin_id, notification_text, parse_mode='HTML')
-            logger.info(f"Уведомление о заказе ID {order.id} успешно отправлено админу {admin_id}.")
-        except Exception as e:
-            logger.error(f"Критическая ошибка при отправке уведомления о заказе ID {order.id} админу {admin_id}: {e}",
-                         exc_info=True)
+    admin_languages = await get_users_language_codes(ADMIN_IDS)
+    texts_by_lang = {
+        admin_lang: _render_new_order_notification(order, admin_lang)
+        for admin_lang in set(admin_languages.values())
+    }
+    messages = [(admin_id, texts_by_lang[admin_languages[admin_id]]) for admin_id in admin_languages]
+    fan_out_messages_in_background(bot, messages, f"новый заказ {order.id}", parse_mode=ParseMode.HTML)
 
 
 # Отправка уведомлений пользователю
@@ -139,14 +119,8 @@ async def send_user_notification(bot: Bot, user_id: int, message_key: str, lang:
     notifications_enabled = await get_user_notifications_status(user_id)
     if notifications_enabled:
         try:
-            # Получаем объект заказа, чтобы получить актуальные данные
-            order = await get_order_by_id(order_id)
-            if not order:
-                logger.error(f"Не удалось найти заказ ID {order_id} для отправки уведомления пользователю {user_id}.")
-                return
-
-            # Теперь используем order.id для форматирования сообщения
-            text = get_localized_message(message_key, lang).format(order_id=order.id, **kwargs)
+            # Заказ не перечитывается из БД: для текста уведомления нужен только его ID
+            text = get_localized_message(message_key, lang).format(order_id=order_id, **kwargs)
             await bot.send_message(user_id, text, parse_mode=ParseMode.HTML)
             logger.info(f"Уведомление '{message_key}' отправлено пользователю {user_id}.")
         except Exception as e:
@@ -1,19 +1,41 @@
 import json
 import os
 import logging
-from typing import Dict, Any, Optional, List # Добавлено List
+import string
+from types import MappingProxyType
+from typing import Dict, Any, Optional, List, Mapping, Set # Добавлено List
 
 logger = logging.getLogger(__name__)
 
 # Путь к директории с файлами локализаций
 LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
 
-# Словарь для кэширования загруженных локализаций
-_localized_strings: Dict[str, Dict[str, Any]] = {}
+# Язык, сообщениями которого заполняются ключи, отсутствующие в других языках
+DEFAULT_LANGUAGE = 'uk'
 
 # Список доступных языков (коды файлов JSON)
 _available_languages: Optional[List[str]] = None
 
+
+def _template_fields(message: str) -> Optional[frozenset]:
+    """
+    Имена полей шаблона str.format в сообщении или None, если шаблон некорректен.
+    """
+    try:
+        return frozenset(field_name for _, field_name, _, _ in string.Formatter().parse(message)
+                         if field_name is not None)
+    except ValueError:
+        return None
+
+
+# Собранные каталоги: код языка -> неизменяемый словарь ключ -> сообщение. Ключи, отсутствующие в языке,
+# уже заполнены сообщениями языка по умолчанию. Пустой - каталоги еще не собраны (см. preload_locales).
+_catalogs: Dict[str, Mapping[str, str]] = {}
+# Ключи и языки, о которых уже сообщено в лог: ошибка пишется один раз, а не при каждом вызове
+_reported_missing_keys: Set[str] = set()
+_reported_unknown_languages: Set[str] = set()
+
+
 def _load_locale_file(lang_code: str) -> Optional[Dict[str, Any]]:
     """
     Загружает JSON-файл локализации для указанного языка.
@@ -36,43 +58,83 @@ def _load_locale_file(lang_code: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def get_localized_message(key: str, lang_code: str, default_lang_code: str = 'uk') -> str:
+def preload_locales(default_lang_code: str = DEFAULT_LANGUAGE) -> int:
     """
-    Получает локализованное сообщение по ключу для указанного языка.
-    Если сообщение не найдено для указанного языка, пытается найти для языка по умолчанию.
-    Если и там не найдено, возвращает сам ключ.
+    Собирает каталоги всех доступных локализаций. Вызывается при запуске бота (иначе - при первом обращении),
+    чтобы запросы пользователей не ждали чтения файлов.
+    Каждый каталог содержит все ключи языка по умолчанию: отсутствующие в языке ключи заполняются сообщениями
+    языка по умолчанию при сборке.
+    Проблемы локализаций - отсутствующие ключи, некорректные шаблоны и несовпадающие с языком по умолчанию
+    поля шаблонов - пишутся в лог при сборке. Возвращает число найденных проблем.
     """
-    # Загружаем локаль, если она еще не загружена
-    if lang_code not in _localized_strings:
+    global _catalogs
+    locales = {}
+    for lang_code in get_available_languages():
         loaded_data = _load_locale_file(lang_code)
         if loaded_data:
-            _localized_strings[lang_code] = loaded_data
-        else:
-            logger.critical(f"Не удалось загрузить локализацию для '{lang_code}'.")
-            # Если не удалось загрузить запрошенный язык, убедимся, что язык по умолчанию загружен
-            if default_lang_code not in _localized_strings:
-                default_data = _load_locale_file(default_lang_code)
-                if default_data:
-                    _localized_strings[default_lang_code] = default_data
-                else:
-                    logger.critical(f"Не удалось загрузить локализацию для языка по умолчанию '{default_lang_code}'.")
-                    return key # Возвращаем ключ, так как ничего не удалось загрузить
-
-    # Получаем строку для указанного языка
-    message = _localized_strings.get(lang_code, {}).get(key)
-
-    # Если строка не найдена для текущего языка, пробуем язык по умолчанию
-    if message is None and lang_code != default_lang_code:
-        logger.warning(
-            f"Сообщение с ключом '{key}' не найдено для языка '{lang_code}'. Попытка найти для '{default_lang_code}'.")
-        message = _localized_strings.get(default_lang_code, {}).get(key)
-
-    # Если и в языке по умолчанию не найдено, возвращаем сам ключ (как заглушку)
+            locales[lang_code] = {key: str(message) for key, message in loaded_data.items()}
+
+    default_messages = locales.get(default_lang_code)
+    if default_messages is None:
+        logger.critical(f"Не удалось загрузить локализацию для языка по умолчанию '{default_lang_code}'.")
+        default_messages = {}
+    default_fields = {key: _template_fields(message) for key, message in default_messages.items()}
+
+    problems = 0
+    catalogs = {}
+    for lang_code, messages in locales.items():
+        missing_keys = sorted(key for key in default_messages if key not in messages)
+        if missing_keys:
+            problems += len(missing_keys)
+            logger.warning(f"В локализации '{lang_code}' нет ключей ({len(missing_keys)}), будут использованы "
+                           f"сообщения '{default_lang_code}': {', '.join(missing_keys)}.")
+        for key, message in messages.items():
+            fields = default_fields[key] if lang_code == default_lang_code else _template_fields(message)
+            if fields is None:
+                problems += 1
+                logger.warning(f"Некорректный шаблон сообщения '{key}' в локализации '{lang_code}'.")
+                continue
+            expected_fields = default_fields.get(key)
+            if lang_code != default_lang_code and expected_fields is not None and fields != expected_fields:
+                problems += 1
+                logger.warning(f"Поля сообщения '{key}' в локализации '{lang_code}' ({sorted(fields)}) "
+                               f"не совпадают с '{default_lang_code}' ({sorted(expected_fields)}).")
+        catalogs[lang_code] = MappingProxyType({**default_messages, **messages})
+
+    _catalogs = catalogs
+    logger.info(f"Локализации загружены: {sorted(catalogs)}, проблем: {problems}.")
+    return problems
+
+
+def _get_catalog(lang_code: str, default_lang_code: str) -> Mapping[str, str]:
+    """
+    Каталог языка, если его нет в _catalogs: при первом обращении собирает каталоги,
+    для неизвестного языка возвращает каталог языка по умолчанию.
+    """
+    if not _catalogs:
+        preload_locales()
+    catalog = _catalogs.get(lang_code)
+    if catalog is None:
+        if lang_code not in _reported_unknown_languages:
+            _reported_unknown_languages.add(lang_code)
+            logger.critical(f"Не удалось загрузить локализацию для '{lang_code}', используется '{default_lang_code}'.")
+        catalog = _catalogs.get(default_lang_code, MappingProxyType({}))
+    return catalog
+
+
+def get_localized_message(key: str, lang_code: str, default_lang_code: str = DEFAULT_LANGUAGE) -> str:
+    """
+    Получает локализованное сообщение по ключу для указанного языка.
+    Если сообщение не найдено для указанного языка, используется сообщение языка по умолчанию
+    (подставлено при сборке каталога). Если и там не найдено, возвращает сам ключ.
+    """
+    message = (_catalogs.get(lang_code) or _get_catalog(lang_code, default_lang_code)).get(key)
     if message is None:
-        logger.error(f"Сообщение с ключом '{key}' не найдено ни для языка '{lang_code}', ни для '{default_lang_code}'.")
+        if key not in _reported_missing_keys:
+            _reported_missing_keys.add(key)
+            logger.error(f"Сообщение с ключом '{key}' не найдено ни для языка '{lang_code}', ни для '{default_lang_code}'.")
         return key
-
-    return str(message)  # Убедимся, что это строка
+    return message
 
 
 def get_available_languages() -> List[str]:
@@ -89,4 +151,3 @@ def get_available_languages() -> List[str]:
                 languages.append(lang_code)
         _available_languages = sorted(languages) # Сортируем для консистентности
     return _available_languages
-
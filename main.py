@@ -1,58 +1,217 @@
 import asyncio
+import hashlib
+import json
 import logging
+import time
+from typing import Any, Awaitable, Dict, Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.storage.memory import SimpleEventIsolation
+from aiogram.fsm.storage.memory import DisabledEventIsolation
 from aiogram.fsm.middleware import FSMContextMiddleware
 from aiogram.types import BotCommand, BotCommandScopeAllPrivateChats, BotCommandScopeDefault, BotCommandScopeAllGroupChats # Импорт для команд меню
 
-from config import BOT_TOKEN, LOGGING_LEVEL
-from db import create_tables_async
+from config import BOT_TOKEN, LOGGING_LEVEL, DB_UNIT_OF_WORK, OUTBOUND_SCHEDULER, BOT_MODE, UPDATES_CONCURRENCY_LIMIT, \
+    FSM_STORAGE, WORKERS, WORKER_INDEX, FORCE_COMMANDS_SYNC, DROP_PENDING_UPDATES
+from db import create_tables_async, start_user_activity_flusher, stop_user_activity_flusher, start_db_writer, \
+    stop_db_writer, warm_up_db, get_bot_setting, set_bot_setting
 from handlers import user_router, admin_router
+from handlers.admin.admin_broadcast_jobs import start_broadcast_worker, stop_broadcast_worker
+from handlers.admin.admin_export import shutdown_export_executor
+from handlers.admin.admin_export_jobs import start_export_workers, stop_export_workers
+from localization import preload_locales
+from fsm_storage import SQLiteStorage, BoundedMemoryStorage, BoundedEventIsolation
+from middlewares.db_connection_release_middleware import DbConnectionReleaseMiddleware
+from middlewares.db_session_middleware import DbSessionMiddleware
+from middlewares.fsm_write_middleware import FsmWriteMiddleware
+from middlewares.shard_forward_middleware import ShardForwardMiddleware
 from middlewares.localization_middleware import LocalizationMiddleware
+from middlewares.update_offset_middleware import UpdateOffsetMiddleware
+from notifications import wait_background_fan_outs
+from outbound import OutboundScheduler
+from sharding import ShardRouter
+from update_offset import UpdateOffsetTracker, catch_up_updates, wait_polling_updates
+from webhook import run_webhook, SHUTDOWN_TIMEOUT
 
 # Настройка логирования
 logging.basicConfig(level=LOGGING_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-async def set_default_commands(bot: Bot):
-    """
-    Устанавливает стандартные команды для бота.
-    Эти команды будут отображаться в меню Telegram.
-    """
-    commands = [
+# Команды меню по областям видимости. Области без команд очищаются: так из меню удаляются команды,
+# оставшиеся от прежних версий бота
+BOT_COMMANDS = [
+    (BotCommandScopeDefault(), []),
+    # Команды будут видны во всех личных чатах
+    (BotCommandScopeAllPrivateChats(), [
         BotCommand(command="start", description="Start bot"),
         BotCommand(command="admin", description="For admins only"),
         # Добавьте сюда все актуальные команды, которые вы хотите видеть в меню
         # Например, если у вас есть команда /admin для админов, но вы не хотите,
         # чтобы она была в общем меню, не добавляйте ее сюда.
-    ]
+    ]),
+    (BotCommandScopeAllGroupChats(), []),
+]
+
+
+def _bot_commands_hash() -> str:
+    """
+    Хэш команд меню (BOT_COMMANDS) со всеми областями видимости.
+    """
+    payload = [[scope.model_dump(exclude_none=True), [command.model_dump(exclude_none=True) for command in commands]]
+               for scope, commands in BOT_COMMANDS]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_bot_commands(bot: Bot):
+    """
+    Устанавливает команды меню (BOT_COMMANDS) в Telegram, только если они изменились с прошлой установки:
+    хэш установленных команд хранится в БД. При FORCE_COMMANDS_SYNC команды устанавливаются всегда.
+    Запросы для всех областей видимости выполняются одновременно.
+    """
+    setting_key = f"bot_commands_hash:{bot.id}"
+    commands_hash = _bot_commands_hash()
+    if not FORCE_COMMANDS_SYNC:
+        try:
+            if await get_bot_setting(setting_key) == commands_hash:
+                logger.info("Команды бота не изменились, установка пропущена.")
+                return
+        except Exception as e:
+            logger.warning(f"Не удалось получить хэш установленных команд бота: {e}")
+
     try:
-        await bot.set_my_commands(
-            commands,
-            scope=BotCommandScopeAllPrivateChats() # Команды будут видны во всех личных чатах
-        )
+        await asyncio.gather(*(bot.set_my_commands(commands, scope=scope) for scope, commands in BOT_COMMANDS))
         logger.info("Команды бота успешно установлены.")
     except Exception as e:
         logger.error(f"Ошибка при установке команд бота: {e}")
+        return
+
+    try:
+        await set_bot_setting(setting_key, commands_hash)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить хэш установленных команд бота: {e}")
+
+
+async def delete_webhook(bot: Bot):
+    """
+    Удаляет вебхук (если был), чтобы работал поллинг. Накопившиеся обновления пропускаются
+    только при DROP_PENDING_UPDATES, иначе их обрабатывает run_polling.
+    """
+    try:
+        await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        logger.info("Вебхуки удалены, ожидающие обновления пропущены." if DROP_PENDING_UPDATES else "Вебхуки удалены.")
+    except Exception as webhook_error:
+        logger.warning(f"Не удалось удалить вебхуки (возможно, их не было): {webhook_error}")
+
+
+async def _timed(phase: str, timings: Dict[str, float], awaitable: Awaitable):
+    """
+    Выполняет этап запуска и записывает его длительность в timings. Ошибка этапа не прерывает запуск.
+    """
+    started = time.perf_counter()
+    try:
+        await awaitable
+    except Exception as e:
+        logger.exception(f"Ошибка на этапе запуска '{phase}': {e}")
+    finally:
+        timings[phase] = time.perf_counter() - started
+
+
+def _log_startup_timings(timings: Dict[str, float], started: float):
+    phases = ", ".join(f"{phase} {duration * 1000:.0f} мс" for phase, duration in timings.items())
+    logger.info(f"Запуск занял {(time.perf_counter() - started) * 1000:.0f} мс (этапы выполняются одновременно): "
+                f"{phases}.")
+
+
+async def prepare_bot(bot: Bot, timings: Dict[str, float]):
+    """
+    Устанавливает команды меню (если изменились) и, в режиме поллинга, одновременно удаляет вебхук,
+    пропуская накопившиеся обновления.
+    Выполняется процессом, который получает обновления от Telegram (в одиночном режиме или во фронте).
+    """
+    phases = [_timed("команды", timings, sync_bot_commands(bot))]
+    if BOT_MODE == "polling":
+        phases.append(_timed("вебхук", timings, delete_webhook(bot)))
+    await asyncio.gather(*phases)
 
 
-async def clear_all_commands(bot: Bot):
+async def setup_update_offset(dp: Dispatcher, bot: Bot) -> Optional[UpdateOffsetTracker]:
     """
-    Удаляет все команды из меню бота для всех личных чатов.
-    Полезно для очистки старых команд во время разработки.
+    Поллинг: загружает ID последнего обработанного обновления и регистрирует UpdateOffsetMiddleware.
+    Middleware регистрируется первым из outer middleware, до изоляции FSM: обновление, ожидающее блокировку
+    пользователя, уже считается обрабатываемым. Возвращает None при DROP_PENDING_UPDATES.
     """
+    if DROP_PENDING_UPDATES:
+        return None
+    tracker = UpdateOffsetTracker(bot.id)
     try:
-        await bot.set_my_commands([], scope=BotCommandScopeDefault())
-        await bot.set_my_commands([], scope=BotCommandScopeAllPrivateChats())
-        await bot.set_my_commands([], scope=BotCommandScopeAllGroupChats())
-        logger.info("Все команды бота успешно удалены.")
+        saved_id = await tracker.load()
+        logger.info(f"ID последнего обработанного обновления: {saved_id}.")
     except Exception as e:
-        logger.error(f"Ошибка при удалении команд бота: {e}")
+        logger.error(f"Не удалось загрузить ID последнего обработанного обновления: {e}")
+
+    outer_middlewares = list(dp.update.outer_middleware)
+    for middleware in outer_middlewares:
+        dp.update.outer_middleware.unregister(middleware)
+    dp.update.outer_middleware(UpdateOffsetMiddleware(tracker))
+    for middleware in outer_middlewares:
+        dp.update.outer_middleware(middleware)
+    return tracker
+
+
+async def run_polling(dp: Dispatcher, bot: Bot, tracker: Optional[UpdateOffsetTracker], **polling_kwargs: Any):
+    """
+    Поллинг: сначала обрабатывает обновления, накопившиеся за время остановки бота (update_offset.py),
+    затем получает новые. При остановке дожидается обрабатываемых обновлений и сохраняет ID последнего
+    обработанного обновления.
+    """
+    if tracker is None:
+        await dp.start_polling(bot, **polling_kwargs)
+        return
+
+    tracker.start_saver()
+    try:
+        await catch_up_updates(dp, bot, tracker)
+        await dp.start_polling(bot, **polling_kwargs)
+    finally:
+        await wait_polling_updates(dp, timeout=SHUTDOWN_TIMEOUT)
+        await tracker.close()
+
+
+async def run_front():
+    """
+    Фронт-процесс (WORKERS > 1): получает обновления от Telegram и распределяет их по процессам-воркерам
+    по пользователю (sharding.py). Хендлеры выполняются только в воркерах.
+    """
+    logger.info(f"Запуск фронт-процесса с воркерами: {WORKERS}.")
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # FSM и хендлеры во фронте не используются; роутеры подключаются, чтобы запрашивать у Telegram
+    # только нужные типы обновлений (allowed_updates)
+    dp = Dispatcher(disable_fsm=True)
+    dp.include_router(user_router)
+    dp.include_router(admin_router)
+
+    startup_started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    await prepare_bot(bot, timings)
+    _log_startup_timings(timings, startup_started)
+
+    shard_router = ShardRouter()
+    try:
+        await shard_router.start()
+        dp.update.outer_middleware(ShardForwardMiddleware(shard_router))
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Фронт считает обновление обработанным, когда его принял воркер
+            await run_polling(dp, bot, await setup_update_offset(dp, bot))
+    except Exception as front_error:
+        logger.exception(f"Критическая ошибка фронт-процесса ({BOT_MODE}): {front_error}")
+    finally:
+        await shard_router.stop()
+        await bot.session.close()
+        logger.info("Сессия бота закрыта.")
 
 
 async def main():
@@ -60,8 +219,15 @@ async def main():
     Основная функция для запуска Telegram бота.
     Выполняет инициализацию базы данных, бота и диспетчера,
     регистрирует хэндлеры и запускает поллинг.
+    При WORKERS > 1 запускает фронт-процесс, который распределяет обновления по воркерам.
     """
-    logger.info("Запуск бота...")
+    if WORKERS > 1 and WORKER_INDEX is None:
+        await run_front()
+        return
+
+    logger.info("Запуск бота..." if WORKER_INDEX is None else f"Запуск воркера {WORKER_INDEX}...")
+    startup_started = time.perf_counter()
+    timings: Dict[str, float] = {}
 
     try:
         # Инициализируем базу данных: создаем таблицы, если они не существуют
@@ -71,44 +237,96 @@ async def main():
         logger.exception(f"Критическая ошибка при инициализации базы данных: {db_error}")
         return
 
-    # Инициализируем хранилище FSM
-    storage = MemoryStorage()
+    # Инициализируем хранилище FSM: в БД (переживает перезапуск) или в памяти с ограничением объема
+    storage = SQLiteStorage() if FSM_STORAGE == "sqlite" else BoundedMemoryStorage()
+    # Блокировки обновлений по ключу FSM, освобождаемые после обработки
+    events_isolation = BoundedEventIsolation()
 
     # Инициализируем бота
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+    # Запросы к Telegram API (и ожидание планировщика) не держат соединение пула сессии обновления
+    if DB_UNIT_OF_WORK:
+        bot.session.middleware(DbConnectionReleaseMiddleware())
+
+    # Все отправки сообщений проходят через планировщик с ограничением частоты (outbound.py)
+    outbound_scheduler = OutboundScheduler() if OUTBOUND_SCHEDULER else None
+    if outbound_scheduler is not None:
+        bot.session.middleware(outbound_scheduler)
+
     # Инициализируем диспетчер
-    dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
+    dp = Dispatcher(storage=storage, events_isolation=events_isolation, outbound_scheduler=outbound_scheduler,
+                    fsm_isolation=events_isolation)
+
+    # Добавляем FSMContextMiddleware на уровень update. Обновление уже изолировано FSMContextMiddleware
+    # диспетчера (та же блокировка не реентерабельна), поэтому здесь изоляция отключена
+    dp.update.middleware(FSMContextMiddleware(storage=storage, events_isolation=DisabledEventIsolation()))
 
-    # Добавляем FSMContextMiddleware на уровень update
-    dp.update.middleware(FSMContextMiddleware(storage=storage, events_isolation=SimpleEventIsolation()))
+    # Одна сессия БД на обновление: регистрируется до локализации, чтобы и она использовала эту сессию
+    if DB_UNIT_OF_WORK:
+        dp.update.middleware(DbSessionMiddleware())
 
-    # Добавляем наше кастомное middleware для локализации
-    dp.update.middleware(LocalizationMiddleware())
+    # Изменения FSM за обновление записываются в БД одной транзакцией после обработки
+    # (внутри unit of work, если он включен)
+    if isinstance(storage, SQLiteStorage):
+        dp.update.middleware(FsmWriteMiddleware(storage))
+
+    # Добавляем наше кастомное middleware для локализации. Inner middleware: язык определяется
+    # только для обновлений, для которых найден хендлер, и только если хендлер принимает 'lang'
+    localization_middleware = LocalizationMiddleware()
+    dp.message.middleware(localization_middleware)
+    dp.callback_query.middleware(localization_middleware)
 
     # Регистрируем роутеры, которые содержат все хэндлеры
     dp.include_router(user_router)
     dp.include_router(admin_router)
 
-    # ДОБАВЛЕНО: Очистка всех команд перед установкой новых (для разработки/отладки)
-    await clear_all_commands(bot)
+    # Единственный писатель БД: все изменения идут через его очередь
+    start_db_writer()
 
-    # Установка команд меню при запуске бота
-    await set_default_commands(bot)
+    # Независимые этапы подготовки выполняются одновременно: локализации и соединения с БД загружаются
+    # заранее, чтобы первое обновление не ждало их. Воркер получает обновления от фронт-процесса,
+    # который сам настраивает команды и вебхук
+    startup_phases = [
+        _timed("локализации", timings, asyncio.to_thread(preload_locales)),
+        _timed("прогрев БД", timings, warm_up_db()),
+    ]
+    if WORKER_INDEX is None:
+        startup_phases.append(prepare_bot(bot, timings))
+    await asyncio.gather(*startup_phases)
+    _log_startup_timings(timings, startup_started)
 
-    # Удаляем любые предыдущие вебхуки (если были) и игнорируем накопившиеся обновления
-    try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Вебхуки удалены, ожидающие обновления пропущены.")
-    except Exception as webhook_error:
-        logger.warning(f"Не удалось удалить вебхуки или пропустить обновления (возможно, их не было): {webhook_error}")
+    # Фоновые воркеры экспорта: хендлеры только ставят экспорт в очередь
+    start_export_workers(bot)
+    # Воркер рассылок: продолжает рассылки, прерванные предыдущей остановкой бота
+    # (при нескольких процессах - только воркер 0, чтобы рассылка не выполнялась дважды)
+    start_broadcast_worker(bot, resume_unfinished=WORKER_INDEX in (None, 0))
+    # Фоновая пакетная запись времени активности пользователей
+    start_user_activity_flusher()
+    # Периодическое удаление брошенных состояний FSM из памяти
+    if isinstance(storage, BoundedMemoryStorage):
+        storage.start_sweeper()
 
-    logger.info("Бот запущен. Начинаю поллинг...")
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            logger.info("Бот запущен в режиме вебхука.")
+            await run_webhook(dp, bot)
+        else:
+            logger.info("Бот запущен. Начинаю поллинг...")
+            await run_polling(dp, bot, await setup_update_offset(dp, bot),
+                              tasks_concurrency_limit=UPDATES_CONCURRENCY_LIMIT)
     except Exception as polling_error:
-        logger.exception(f"Критическая ошибка при поллинге бота: {polling_error}")
+        logger.exception(f"Критическая ошибка при получении обновлений ({BOT_MODE}): {polling_error}")
     finally:
+        # Даем фоновым рассылкам (уведомления админам) завершиться, пока сессия бота открыта
+        await wait_background_fan_outs(timeout=10)
+        await stop_broadcast_worker()
+        await stop_export_workers()
+        shutdown_export_executor()
+        await stop_user_activity_flusher()
+        await stop_db_writer()
+        if outbound_scheduler is not None:
+            await outbound_scheduler.close()
         await bot.session.close()
         logger.info("Сессия бота закрыта.")
 
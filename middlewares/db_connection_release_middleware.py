@@ -0,0 +1,27 @@
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod, Response
+from aiogram.methods.base import TelegramType
+
+from db import release_update_connection
+
+logger = logging.getLogger(__name__)
+
+
+class DbConnectionReleaseMiddleware(BaseRequestMiddleware):
+    """
+    Request middleware сессии бота: перед запросом к Telegram API завершает транзакцию сессии текущего
+    обновления (unit of work) и возвращает ее соединение в пул (release_update_connection).
+    Регистрируется до планировщика исходящих сообщений, чтобы ожидание в его очереди тоже не держало соединение.
+    """
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        await release_update_connection()
+        return await make_request(bot, method)
@@ -0,0 +1,31 @@
+import logging
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from db import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Middleware, открывающее одну сессию базы данных на каждое обновление (unit of work).
+    Сессия передается в хендлеры как 'db_session' (функции db.py принимают ее параметром session),
+    а функции db.py, вызванные без session во время обработки обновления, используют ее автоматически.
+    Перед запросами к Telegram API транзакция обновления завершается (DbConnectionReleaseMiddleware).
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        """
+        Оборачивает обработку обновления в unit_of_work() и добавляет сессию в 'data'.
+        """
+        async with unit_of_work() as session:
+            data["db_session"] = session
+            return await handler(event, data)
@@ -0,0 +1,28 @@
+import logging
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from fsm_storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+
+class FsmWriteMiddleware(BaseMiddleware):
+    """
+    Middleware, объединяющее все изменения FSM за время обработки обновления (state.set_state,
+    state.update_data, ...) в одну запись в БД после обработки (SQLiteStorage.coalesce_writes).
+    """
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        async with self.storage.coalesce_writes():
+            return await handler(event, data)
@@ -0,0 +1,36 @@
+import logging
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update, User, Chat
+
+from sharding import ShardRouter, select_worker
+
+logger = logging.getLogger(__name__)
+
+
+class ShardForwardMiddleware(BaseMiddleware):
+    """
+    Outer middleware фронт-процесса (WORKERS > 1): пересылает обновление воркеру, выбранному по пользователю
+    (sharding.select_worker), и не передает его хендлерам фронта.
+    Регистрируется после UserContextMiddleware диспетчера, который определяет пользователя и чат обновления.
+    """
+
+    def __init__(self, shard_router: ShardRouter):
+        self.shard_router = shard_router
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        chat: Chat | None = data.get("event_chat")
+        worker_index = select_worker(user.id if user else None, chat.id if chat else None, event.update_id)
+        forwarded = self.shard_router.route(worker_index, event.model_dump_json(by_alias=True, exclude_none=True,
+                                                                                exclude_unset=True))
+        # Обновление считается обработанным фронтом (в том числе для UpdateOffsetTracker), когда его принял воркер
+        await forwarded
+        logger.debug(f"Обновление {event.update_id} передано воркеру {worker_index}.")
+        return None
@@ -0,0 +1,35 @@
+import logging
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from update_offset import UpdateOffsetTracker
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateOffsetMiddleware(BaseMiddleware):
+    """
+    Outer middleware поллинга: отмечает начало и конец обработки обновления для UpdateOffsetTracker
+    и пропускает обновления, обработанные до перезапуска бота (Telegram присылает их повторно,
+    если бот не успел их подтвердить).
+    """
+
+    def __init__(self, tracker: UpdateOffsetTracker):
+        self.tracker = tracker
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        if self.tracker.is_processed(event.update_id):
+            logger.debug(f"Обновление {event.update_id} уже обработано до перезапуска, пропускаем.")
+            return None
+        self.tracker.started(event.update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            self.tracker.finished(event.update_id)
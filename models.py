@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional  # Импортируем Optional для type hints
 
-from sqlalchemy import Integer, String, Text, DateTime, Boolean
+from sqlalchemy import Integer, String, Text, DateTime, Boolean, Index
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
 from sqlalchemy.sql import func
 
@@ -67,8 +67,14 @@ class Order(Base):
         payment_method (str, optional): Предпочитаемый способ оплаты.
         contact_phone (str, optional): Контактный номер телефона клиента.
         delivery_notes (str, optional): Дополнительные примечания к доставке.
+        updated_at (datetime, optional): Дата и время последнего изменения заказа.
     """
     __tablename__ = 'orders'
+    # Составные индексы для keyset-пагинации списков заказов по (created_at, id)
+    __table_args__ = (
+        Index('ix_orders_created_at_id', 'created_at', 'id'),
+        Index('ix_orders_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
 
     # Использование mapped_column для явной типизации и Column для определения настроек
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -86,6 +92,8 @@ class Order(Base):
     payment_method: Mapped[Optional[str]] = mapped_column(String)
     contact_phone: Mapped[Optional[str]] = mapped_column(String)
     delivery_notes: Mapped[Optional[str]] = mapped_column(Text)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), default=func.now(),
+                                                           onupdate=func.now(), index=True)
 
     def __repr__(self) -> str:
         """Представление объекта Order для отладки."""
@@ -126,3 +134,92 @@ class HelpMessage(Base):
         return (f"<HelpMessage(id={self.id}, lang='{self.language_code}', "
                 f"is_active={self.is_active}, text='{self.message_text[:50]}...')>")
 
+
+
+class Broadcast(Base):
+    """
+    Модель рассылки сообщения админа пользователям с включенными уведомлениями.
+    Получатели перебираются по возрастанию user_id; после каждой пачки сохраняется прогресс,
+    поэтому рассылка продолжается с места остановки после перезапуска бота.
+
+    Атрибуты:
+        id (int): Уникальный идентификатор рассылки (первичный ключ).
+        message_text (str): Текст рассылки (HTML).
+        created_by (int): Telegram ID админа, создавшего рассылку.
+        status (str): 'queued', 'running', 'done' или 'cancelled'.
+        last_user_id (int, optional): Telegram ID последнего обработанного получателя (курсор прогресса).
+        total_count (int): Количество получателей на момент запуска.
+        sent_count (int): Количество доставленных сообщений.
+        failed_count (int): Количество сообщений, не доставленных из-за ошибок.
+        blocked_count (int): Количество получателей, заблокировавших бота или удаливших аккаунт.
+        status_chat_id (int, optional): Чат сообщения админа, в котором показывается прогресс.
+        status_message_id (int, optional): ID этого сообщения.
+        created_at (datetime): Дата и время создания рассылки.
+        updated_at (datetime): Дата и время последнего сохранения прогресса.
+        finished_at (datetime, optional): Дата и время завершения или отмены.
+    """
+    __tablename__ = 'broadcasts'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    message_text: Mapped[str] = mapped_column(Text, nullable=False)
+    created_by: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[str] = mapped_column(String, default='queued', nullable=False, index=True)
+    last_user_id: Mapped[Optional[int]] = mapped_column(Integer)
+    total_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    failed_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    blocked_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    status_chat_id: Mapped[Optional[int]] = mapped_column(Integer)
+    status_message_id: Mapped[Optional[int]] = mapped_column(Integer)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
+    def __repr__(self) -> str:
+        """Представление объекта Broadcast для отладки."""
+        return (f"<Broadcast(id={self.id}, status='{self.status}', last_user_id={self.last_user_id}, "
+                f"sent={self.sent_count}, failed={self.failed_count}, blocked={self.blocked_count})>")
+
+
+class FsmRecord(Base):
+    """
+    Модель записи хранилища FSM (fsm_storage.SQLiteStorage): состояние и данные диалога одного ключа FSM,
+    чтобы незавершенные заказы и действия админов не терялись при перезапуске бота.
+
+    Атрибуты:
+        key (str): Ключ FSM (бот, чат, пользователь, ...), см. DefaultKeyBuilder aiogram (первичный ключ).
+        state (str, optional): Текущее состояние FSM.
+        data (str): Данные FSM в JSON.
+        updated_at (datetime): Дата и время последнего изменения.
+    """
+    __tablename__ = 'fsm_records'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String)
+    data: Mapped[str] = mapped_column(Text, default='{}', nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    def __repr__(self) -> str:
+        """Представление объекта FsmRecord для отладки."""
+        return f"<FsmRecord(key='{self.key}', state='{self.state}')>"
+
+
+class BotSetting(Base):
+    """
+    Модель служебной настройки бота (ключ - значение), сохраняемой между запусками,
+    например хэша установленных команд меню.
+
+    Атрибуты:
+        key (str): Ключ настройки (первичный ключ).
+        value (str): Значение настройки.
+        updated_at (datetime): Дата и время последнего изменения.
+    """
+    __tablename__ = 'bot_settings'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[str] = mapped_column(Text, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    def __repr__(self) -> str:
+        """Представление объекта BotSetting для отладки."""
+        return f"<BotSetting(key='{self.key}', value='{self.value}')>"
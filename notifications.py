@@ -0,0 +1,91 @@
+"""
+Рассылка сообщений нескольким получателям: отправки идут параллельно, не более NOTIFICATION_CONCURRENCY
+одновременно, а после ответа Telegram "Too Many Requests" (TelegramRetryAfter) повторяются через
+указанную сервером задержку (планировщиком исходящих сообщений, если он включен, иначе здесь).
+Рассылка может выполняться в фоне, не задерживая ответ пользователю.
+"""
+import asyncio
+import logging
+from typing import Any, Sequence, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import NOTIFICATION_CONCURRENCY, NOTIFICATION_MAX_RETRIES
+from outbound import background_priority, is_scheduled
+
+logger = logging.getLogger(__name__)
+
+# Фоновые рассылки; ссылки хранятся, чтобы задачи не были удалены сборщиком мусора до завершения
+_background_fan_outs: Set[asyncio.Task] = set()
+
+
+async def send_message_with_retry(bot: Bot, chat_id: int, text: str, **kwargs: Any) -> bool:
+    """
+    Отправляет сообщение, повторяя попытку после TelegramRetryAfter (не более NOTIFICATION_MAX_RETRIES раз).
+    Если отправки идут через OutboundScheduler, повторами занимается только он: TelegramRetryAfter
+    доходит сюда, когда его попытки уже исчерпаны.
+    Возвращает True, если сообщение отправлено. Остальные ошибки логируются и не пробрасываются.
+    """
+    max_retries = 0 if is_scheduled(bot) else NOTIFICATION_MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return True
+        except TelegramRetryAfter as e:
+            if attempt == max_retries:
+                logger.error(f"Сообщение в чат {chat_id} не отправлено: лимит Telegram, попыток: {attempt + 1}.")
+                return False
+            logger.warning(f"Лимит Telegram при отправке в чат {chat_id}, повтор через {e.retry_after} с.")
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+            return False
+    return False
+
+
+async def fan_out_messages(bot: Bot, messages: Sequence[Tuple[int, str]], **kwargs: Any) -> int:
+    """
+    Отправляет сообщения (chat_id, текст) параллельно, не более NOTIFICATION_CONCURRENCY одновременно.
+    Возвращает количество успешно отправленных сообщений.
+    """
+    semaphore = asyncio.Semaphore(NOTIFICATION_CONCURRENCY)
+
+    async def _send(chat_id: int, text: str) -> bool:
+        async with semaphore:
+            return await send_message_with_retry(bot, chat_id, text, **kwargs)
+
+    results = await asyncio.gather(*(_send(chat_id, text) for chat_id, text in messages))
+    return sum(results)
+
+
+def fan_out_messages_in_background(bot: Bot, messages: Sequence[Tuple[int, str]], description: str,
+                                   **kwargs: Any) -> asyncio.Task:
+    """
+    Запускает fan_out_messages фоновой задачей и сразу возвращает управление.
+    Вызывающий код не должен обращаться к БД внутри рассылки: задача выполняется вне обновления Telegram.
+    """
+    async def _run():
+        # Рассылка не должна задерживать ответы пользователям в планировщике исходящих сообщений
+        background_priority()
+        sent = await fan_out_messages(bot, messages, **kwargs)
+        logger.info(f"Рассылка '{description}': отправлено {sent} из {len(messages)}.")
+
+    task = asyncio.create_task(_run(), name=f"fan-out:{description}")
+    _background_fan_outs.add(task)
+    task.add_done_callback(_background_fan_outs.discard)
+    return task
+
+
+async def wait_background_fan_outs(timeout: float):
+    """
+    Ждет завершения фоновых рассылок не дольше timeout секунд, оставшиеся отменяет. Вызывается при остановке бота.
+    """
+    if not _background_fan_outs:
+        return
+    _done, pending = await asyncio.wait(set(_background_fan_outs), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"Фоновые рассылки не завершились при остановке и отменены: {len(pending)}.")
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,269 @@
+"""
+Планировщик исходящих запросов к Telegram (request middleware сессии бота).
+
+Запросы, отправляющие или изменяющие сообщения (Send*, Edit*, Copy*, Forward*), проходят через очередь:
+отправка разрешается, только если есть токен в общем ведре (OUTBOUND_GLOBAL_RATE сообщений в секунду)
+и в ведре чата (OUTBOUND_CHAT_RATE для личных чатов, OUTBOUND_GROUP_RATE для групп).
+Интерактивные ответы (по умолчанию) обслуживаются раньше фоновых отправок (background_priority()),
+а массовые рассылки (background_priority(PRIORITY_BULK)) - только когда нет других ожидающих отправок.
+После ответа "Too Many Requests" (TelegramRetryAfter) чат приостанавливается на указанное сервером время,
+а запрос снова ставится в очередь. Остальные запросы (getUpdates, answerCallbackQuery, ...) не ограничиваются.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import math
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, Response
+from aiogram.methods.base import TelegramType
+
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST, \
+    OUTBOUND_MAX_RETRIES
+from db_metrics import QueryStats
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: меньше - раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background", PRIORITY_BULK: "bulk"}
+
+# Префиксы методов Bot API, которые отправляют или изменяют сообщения и учитываются лимитами Telegram
+RATE_LIMITED_METHOD_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+# Сколько ведер чатов хранить, прежде чем удалять неиспользуемые (полные) ведра
+MAX_IDLE_CHAT_BUCKETS = 1000
+
+ChatId = Union[int, str]
+
+# Приоритет отправок текущей задачи; фоновые задачи понижают его через background_priority()
+_send_priority: ContextVar[int] = ContextVar("_send_priority", default=PRIORITY_INTERACTIVE)
+
+
+def background_priority(priority: int = PRIORITY_BACKGROUND):
+    """
+    Понижает приоритет всех отправок текущей задачи (и созданных из нее задач) до фонового (или указанного).
+    Вызывается в начале фоновых задач: уведомлений, экспорта, рассылок.
+    """
+    _send_priority.set(priority)
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не более capacity. Может быть приостановлено до момента blocked_until.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """
+        Через сколько секунд будет доступен токен (0 - доступен сейчас).
+        """
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    async def acquire(self):
+        """
+        Ждет появления токена и забирает его. Для ведер, которыми пользуется одна задача (и ее подзадачи).
+        """
+        while True:
+            delay = self.delay(time.monotonic())
+            if delay <= 0:
+                self.consume()
+                return
+            await asyncio.sleep(delay)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+@dataclass(order=True)
+class _PendingSend:
+    """
+    Запрос, ожидающий разрешения на отправку. Очередь упорядочена по (приоритет, порядковый номер).
+    """
+    priority: int
+    sequence: int
+    chat_id: ChatId = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Request middleware сессии бота, ограничивающее частоту отправки сообщений (см. описание модуля).
+    Подключается через bot.session.middleware(OutboundScheduler()).
+    """
+
+    def __init__(self):
+        self._global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)
+        self._chat_buckets: Dict[ChatId, TokenBucket] = {}
+        self._pending: List[_PendingSend] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        # Метрики с момента запуска
+        self.wait_stats: Dict[int, QueryStats] = {priority: QueryStats() for priority in PRIORITY_NAMES}
+        self.sent_count = 0
+        self.retry_count = 0
+        self.max_queue_depth = 0
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = self._get_rate_limited_chat(method)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _send_priority.get()
+        retries = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+                self.sent_count += 1
+                return response
+            except TelegramRetryAfter as e:
+                if retries >= OUTBOUND_MAX_RETRIES:
+                    raise
+                retries += 1
+                self.retry_count += 1
+                self._get_chat_bucket(chat_id).block(e.retry_after)
+                logger.warning(f"Лимит Telegram для чата {chat_id} ({type(method).__name__}): "
+                               f"повтор через {e.retry_after} с (попытка {retries} из {OUTBOUND_MAX_RETRIES}).")
+
+    @staticmethod
+    def _get_rate_limited_chat(method: TelegramMethod) -> Optional[ChatId]:
+        """
+        Возвращает чат запроса, если запрос учитывается лимитами отправки сообщений, иначе None.
+        """
+        if not type(method).__name__.startswith(RATE_LIMITED_METHOD_PREFIXES):
+            return None
+        return getattr(method, "chat_id", None)
+
+    def _get_chat_bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID - группы и каналы, строковые (@username) - каналы
+            is_private_chat = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(OUTBOUND_CHAT_RATE if is_private_chat else OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: ChatId, priority: int):
+        """
+        Ставит запрос в очередь и ждет разрешения планировщика на отправку.
+        """
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run(), name="outbound-scheduler")
+
+        loop = asyncio.get_running_loop()
+        pending_send = _PendingSend(priority, next(self._sequence), chat_id, loop.create_future(), time.monotonic())
+        bisect.insort(self._pending, pending_send)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+        self._wakeup.set()
+        await pending_send.future
+
+    async def _run(self):
+        """
+        Цикл планировщика: разрешает отправку первому по приоритету запросу, для чата которого есть токен,
+        или ждет появления токена либо нового запроса.
+        """
+        while True:
+            now = time.monotonic()
+            wait = self._global_bucket.delay(now) if self._pending else math.inf
+            if self._pending and wait <= 0:
+                wait = math.inf
+                for pending_send in list(self._pending):
+                    if pending_send.future.done():
+                        # Вызывающий код отменен, пока ждал очереди
+                        self._pending.remove(pending_send)
+                        continue
+                    chat_wait = self._get_chat_bucket(pending_send.chat_id).delay(now)
+                    if chat_wait <= 0:
+                        self._grant(pending_send, now)
+                        wait = 0
+                        break
+                    wait = min(wait, chat_wait)
+            if wait <= 0:
+                continue
+
+            if len(self._chat_buckets) > MAX_IDLE_CHAT_BUCKETS:
+                self._prune_chat_buckets(now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=None if math.isinf(wait) else wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant(self, pending_send: _PendingSend, now: float):
+        self._pending.remove(pending_send)
+        self._global_bucket.consume()
+        self._get_chat_bucket(pending_send.chat_id).consume()
+        self.wait_stats[pending_send.priority].add((now - pending_send.enqueued_at) * 1000)
+        pending_send.future.set_result(None)
+
+    def _prune_chat_buckets(self, now: float):
+        waiting_chats = {pending_send.chat_id for pending_send in self._pending}
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in waiting_chats and bucket.is_idle(now)]:
+            del self._chat_buckets[chat_id]
+
+    def queue_depth(self) -> Dict[str, int]:
+        """
+        Текущее количество ожидающих запросов по приоритетам.
+        """
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for pending_send in self._pending:
+            depth[PRIORITY_NAMES[pending_send.priority]] += 1
+        return depth
+
+    async def close(self):
+        """
+        Останавливает цикл планировщика; ожидающие запросы отменяются. Вызывается при остановке бота.
+        """
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        for pending_send in self._pending:
+            pending_send.future.cancel()
+        self._pending.clear()
+
+
+def is_scheduled(bot: Bot) -> bool:
+    """
+    Проходят ли отправки бота через OutboundScheduler. Тогда планировщик сам повторяет запрос
+    после TelegramRetryAfter, и вызывающему коду не нужно повторять его еще раз.
+    """
+    return any(isinstance(middleware, OutboundScheduler) for middleware in bot.session.middleware)
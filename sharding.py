@@ -0,0 +1,221 @@
+"""
+Обработка обновлений несколькими процессами (WORKERS > 1).
+
+Основной (фронт) процесс получает обновления от Telegram (поллинг или вебхук, BOT_MODE) и пересылает каждое
+одному из WORKERS процессов-воркеров по user_id (обновления без пользователя - по chat_id). Все обновления
+пользователя обрабатывает один и тот же воркер и получает их в порядке поступления, поэтому FSM, блокировки
+и кэши пользователя остаются в одном процессе. Хендлеры во фронте не выполняются.
+
+Воркер - обычный процесс бота (main.py) в режиме вебхука без регистрации в Telegram: он слушает
+127.0.0.1:WORKER_BASE_PORT+номер и принимает обновления только с секретом, который фронт генерирует при запуске.
+Воркеры используют общую базу данных; общий лимит отправки сообщений делится между ними поровну.
+Упавший воркер перезапускается фронтом.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import List, Optional
+
+import aiohttp
+
+from config import WORKERS, WORKER_BASE_PORT, WEBHOOK_PATH, OUTBOUND_GLOBAL_RATE, BROADCAST_RATE
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать готовности воркера после запуска и его завершения при остановке, сек
+WORKER_START_TIMEOUT = 60
+WORKER_STOP_TIMEOUT = 30
+# Сколько раз пытаться переслать обновление недоступному воркеру (например, перезапускаемому)
+FORWARD_RETRIES = 20
+FORWARD_RETRY_DELAY = 0.5
+# Пауза перед перезапуском упавшего воркера, сек
+WORKER_RESTART_DELAY = 1
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def select_worker(user_id: Optional[int], chat_id: Optional[int], update_id: int, workers: int = WORKERS) -> int:
+    """
+    Номер воркера для обновления: по пользователю, иначе по чату, иначе по ID обновления.
+    Остаток от деления, а не hash(): номер одинаков во всех процессах и после перезапуска.
+    """
+    shard_key = user_id if user_id is not None else chat_id if chat_id is not None else update_id
+    return shard_key % workers
+
+
+class _Worker:
+    """
+    Процесс-воркер и очередь пересылаемых ему обновлений (JSON и future результата пересылки). Очередь обслуживается одной задачей,
+    поэтому воркер получает обновления строго в порядке поступления во фронт.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.url = f"http://127.0.0.1:{self.port}{WEBHOOK_PATH}"
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.forwarded_count = 0
+
+
+class ShardRouter:
+    """
+    Запускает воркеры, пересылает им обновления и следит за ними (см. описание модуля).
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self._workers = [_Worker(index) for index in range(workers)]
+        self._secret = secrets.token_urlsafe(32)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def _worker_env(self, worker: _Worker) -> dict:
+        env = dict(os.environ)
+        env.update(
+            WORKER_INDEX=str(worker.index),
+            BOT_MODE="webhook",
+            WEBHOOK_URL="",
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_PORT=str(worker.port),
+            WEBHOOK_SECRET=self._secret,
+            # Лимиты Telegram общие для бота: каждый воркер получает свою долю
+            OUTBOUND_GLOBAL_RATE=str(OUTBOUND_GLOBAL_RATE / len(self._workers)),
+            BROADCAST_RATE=str(min(BROADCAST_RATE, OUTBOUND_GLOBAL_RATE / len(self._workers))),
+        )
+        return env
+
+    async def _spawn(self, worker: _Worker):
+        # Отдельная группа процессов: Ctrl+C в терминале получает только фронт, который останавливает
+        # воркеры сам, после пересылки уже полученных обновлений
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, MAIN_SCRIPT, cwd=os.path.dirname(MAIN_SCRIPT), env=self._worker_env(worker),
+            start_new_session=True
+        )
+        logger.info(f"Запущен воркер {worker.index} (PID {worker.process.pid}, порт {worker.port}).")
+
+    async def _wait_ready(self, worker: _Worker):
+        """
+        Ждет, пока воркер начнет принимать соединения на своем порту.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WORKER_START_TIMEOUT
+        while True:
+            if worker.process.returncode is not None:
+                raise RuntimeError(f"Воркер {worker.index} завершился при запуске с кодом {worker.process.returncode}.")
+            try:
+                _reader, writer = await asyncio.open_connection("127.0.0.1", worker.port)
+                writer.close()
+                await writer.wait_closed()
+                return
+            except OSError:
+                if loop.time() > deadline:
+                    raise RuntimeError(f"Воркер {worker.index} не начал принимать обновления за "
+                                       f"{WORKER_START_TIMEOUT} с.")
+                await asyncio.sleep(0.2)
+
+    async def start(self):
+        """
+        Запускает воркеры и ждет их готовности, затем запускает пересылку обновлений и наблюдение за воркерами.
+        """
+        self._session = aiohttp.ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": self._secret})
+        for worker in self._workers:
+            await self._spawn(worker)
+        await asyncio.gather(*(self._wait_ready(worker) for worker in self._workers))
+        for worker in self._workers:
+            self._tasks.append(asyncio.create_task(self._forward_updates(worker), name=f"forward-{worker.index}"))
+            self._tasks.append(asyncio.create_task(self._supervise(worker), name=f"supervise-{worker.index}"))
+        logger.info(f"Воркеры запущены: {len(self._workers)}.")
+
+    def route(self, worker_index: int, update_json: str) -> asyncio.Future:
+        """
+        Ставит обновление в очередь пересылки воркеру. Очередь пополняется сразу, поэтому порядок обновлений
+        сохраняется, даже если результат не ожидается. Возвращает future, которое завершается после пересылки
+        (True - воркер принял обновление).
+        """
+        forwarded = asyncio.get_running_loop().create_future()
+        self._workers[worker_index].queue.put_nowait((update_json, forwarded))
+        return forwarded
+
+    async def _forward_updates(self, worker: _Worker):
+        while True:
+            update_json, forwarded = await worker.queue.get()
+            try:
+                accepted = await self._post_update(worker, update_json)
+                if not forwarded.done():
+                    forwarded.set_result(accepted)
+            finally:
+                worker.queue.task_done()
+
+    async def _post_update(self, worker: _Worker, update_json: str) -> bool:
+        for attempt in range(FORWARD_RETRIES):
+            try:
+                async with self._session.post(worker.url, data=update_json,
+                                              headers={"Content-Type": "application/json"}) as response:
+                    if response.status == 200:
+                        worker.forwarded_count += 1
+                        return True
+                    logger.error(f"Воркер {worker.index} отклонил обновление: HTTP {response.status}.")
+                    return False
+            except aiohttp.ClientError as e:
+                # Воркер перезапускается: ждем, сохраняя порядок обновлений пользователя
+                logger.warning(f"Воркер {worker.index} недоступен ({e}), повтор {attempt + 1} из {FORWARD_RETRIES}.")
+                await asyncio.sleep(FORWARD_RETRY_DELAY)
+        logger.error(f"Обновление не переслано воркеру {worker.index} после {FORWARD_RETRIES} попыток и потеряно.")
+        return False
+
+    async def _supervise(self, worker: _Worker):
+        """
+        Перезапускает воркер, если он завершился не по команде фронта.
+        """
+        while True:
+            return_code = await worker.process.wait()
+            if self._stopping:
+                return
+            logger.error(f"Воркер {worker.index} завершился с кодом {return_code}, перезапуск.")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            await self._spawn(worker)
+            try:
+                await self._wait_ready(worker)
+            except RuntimeError as e:
+                logger.error(str(e))
+
+    async def stop(self):
+        """
+        Пересылает уже полученные обновления (не дольше WORKER_STOP_TIMEOUT), затем останавливает воркеры
+        сигналом SIGTERM; воркеры завершают обрабатываемые обновления.
+        """
+        self._stopping = True
+        try:
+            await asyncio.wait_for(asyncio.gather(*(worker.queue.join() for worker in self._workers)),
+                                   timeout=WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Не все полученные обновления пересланы воркерам до остановки.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        for worker in self._workers:
+            while not worker.queue.empty():
+                _update_json, forwarded = worker.queue.get_nowait()
+                forwarded.cancel()
+                worker.queue.task_done()
+
+        running = [worker for worker in self._workers
+                   if worker.process is not None and worker.process.returncode is None]
+        for worker in running:
+            worker.process.send_signal(signal.SIGTERM)
+        for worker in running:
+            try:
+                await asyncio.wait_for(worker.process.wait(), timeout=WORKER_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error(f"Воркер {worker.index} не остановился за {WORKER_STOP_TIMEOUT} с и будет завершен.")
+                worker.process.kill()
+                await worker.process.wait()
+        if self._session is not None:
+            await self._session.close()
+        logger.info("Воркеры остановлены. Переслано обновлений: "
+                    f"{ {worker.index: worker.forwarded_count for worker in self._workers} }.")
@@ -0,0 +1,241 @@
+"""
+Обновления, накопившиеся за время остановки бота (поллинг).
+
+Раньше при запуске вызывался deleteWebhook(drop_pending_updates=True), и заказы, отправленные во время
+перезапуска, терялись. Теперь бот сохраняет в БД (bot_settings) ID обновления, до которого включительно
+все обновления обработаны, и при запуске, до начала обычного поллинга, обрабатывает накопившиеся обновления
+пачками по 100 (catch_up_updates): обновления разных пользователей - одновременно (не более
+UPDATES_CATCH_UP_CONCURRENCY), одного пользователя - по порядку. Следующая пачка запрашивается (и тем самым
+предыдущая подтверждается в Telegram) только после обработки предыдущей, поэтому упавший во время догонки бот
+обработает неподтвержденную пачку при следующем запуске, а уже обработанные до сохраненного ID - пропустит.
+
+После недели без обновлений Telegram начинает новую последовательность ID со случайного числа, которое может
+быть меньше сохраненного ID. Поэтому обновления до сохраненного ID считаются повторными, только пока он
+свежее UPDATE_DEDUPE_WINDOW: Telegram хранит неподтвержденные обновления не дольше суток, и повторно
+прийти может только обновление, полученное за последние сутки, а обновление за последние сутки означает,
+что последовательность не сменилась. С более старым сохраненным ID догонка запрашивает обновления без offset,
+а обновление с меньшим ID сбрасывает сохраненный ID (новая последовательность).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+
+from config import UPDATES_CATCH_UP_CONCURRENCY, UPDATE_OFFSET_SAVE_INTERVAL
+from db import get_bot_setting_with_time, set_bot_setting
+
+logger = logging.getLogger(__name__)
+
+# Максимум обновлений в ответе getUpdates
+GET_UPDATES_LIMIT = 100
+# Попытки получить накопившиеся обновления; если Telegram недоступен, их получит обычный поллинг
+GET_UPDATES_RETRIES = 3
+GET_UPDATES_RETRY_DELAY = 1
+# Сколько Telegram хранит неподтвержденные обновления, сек: только в этот срок после сохранения ID
+# обновление с меньшим ID может быть повторной доставкой, а не новой последовательностью ID
+UPDATE_DEDUPE_WINDOW = 24 * 60 * 60
+
+
+class UpdateOffsetTracker:
+    """
+    Отслеживает обрабатываемые обновления и сохраняет в БД ID, до которого включительно все обновления
+    обработаны (не реже раза в UPDATE_OFFSET_SAVE_INTERVAL секунд и при остановке).
+    Обновления обрабатываются одновременно, поэтому это не последний обработанный ID, а ID перед самым
+    ранним еще обрабатываемым обновлением.
+    """
+
+    def __init__(self, bot_id: int, save_interval: float = UPDATE_OFFSET_SAVE_INTERVAL):
+        self._setting_key = f"update_offset:{bot_id}"
+        self._save_interval = save_interval
+        self._in_progress: Set[int] = set()
+        self._last_seen_id: Optional[int] = None
+        # ID, сохраненный в БД: обновления до него включительно уже обработаны
+        self.saved_id: Optional[int] = None
+        # Когда сохранен saved_id (time.time())
+        self._saved_at: Optional[float] = None
+        self._saver: Optional[asyncio.Task] = None
+
+    async def load(self) -> Optional[int]:
+        """
+        Загружает из БД ID последнего обработанного обновления (None - бот еще не сохранял его).
+        """
+        setting = await get_bot_setting_with_time(self._setting_key)
+        if setting is not None:
+            value, updated_at = setting
+            self.saved_id = int(value)
+            self._saved_at = updated_at.timestamp() if updated_at is not None else None
+        self._last_seen_id = self.saved_id
+        return self.saved_id
+
+    def in_current_sequence(self) -> bool:
+        """
+        Может ли Telegram еще прислать обновления до saved_id повторно (см. описание модуля).
+        """
+        return self._saved_at is not None and time.time() - self._saved_at < UPDATE_DEDUPE_WINDOW
+
+    def is_processed(self, update_id: int) -> bool:
+        """
+        Было ли обновление обработано до перезапуска (Telegram присылает его повторно, если бот не успел
+        подтвердить его). Обновление с меньшим, чем saved_id, ID после UPDATE_DEDUPE_WINDOW - начало новой
+        последовательности ID: saved_id сбрасывается, обновление обрабатывается.
+        """
+        if self.saved_id is None or update_id > self.saved_id:
+            return False
+        if self.in_current_sequence():
+            return True
+        logger.warning(f"Получено обновление {update_id} с ID не больше сохраненного {self.saved_id} после "
+                       f"долгого простоя: Telegram начал новую последовательность ID, сохраненный ID сброшен.")
+        self.saved_id = None
+        self._saved_at = None
+        self._last_seen_id = max(self._in_progress) if self._in_progress else None
+        return False
+
+    def started(self, update_id: int):
+        self._in_progress.add(update_id)
+        if self._last_seen_id is None or update_id > self._last_seen_id:
+            self._last_seen_id = update_id
+
+    def finished(self, update_id: int):
+        self._in_progress.discard(update_id)
+
+    @property
+    def processed_id(self) -> Optional[int]:
+        """
+        ID, до которого включительно все полученные обновления обработаны.
+        """
+        if self._in_progress:
+            return min(self._in_progress) - 1
+        return self._last_seen_id
+
+    async def save(self):
+        """
+        Сохраняет processed_id в БД, если он изменился.
+        """
+        processed_id = self.processed_id
+        if processed_id is None or (self.saved_id is not None and processed_id <= self.saved_id):
+            return
+        await set_bot_setting(self._setting_key, str(processed_id))
+        self.saved_id = processed_id
+        self._saved_at = time.time()
+
+    async def _run_saver(self):
+        while True:
+            await asyncio.sleep(self._save_interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить ID последнего обработанного обновления: {e}")
+
+    def start_saver(self):
+        """
+        Запускает периодическое сохранение processed_id.
+        """
+        if self._saver is None:
+            self._saver = asyncio.create_task(self._run_saver(), name="update-offset-saver")
+
+    async def close(self):
+        """
+        Останавливает периодическое сохранение и сохраняет processed_id. Вызывается при остановке бота,
+        после завершения обработки обновлений.
+        """
+        if self._saver is not None:
+            self._saver.cancel()
+            await asyncio.gather(self._saver, return_exceptions=True)
+            self._saver = None
+        try:
+            await self.save()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить ID последнего обработанного обновления при остановке: {e}")
+
+
+def _ordering_key(update: Update) -> int:
+    """
+    Ключ порядка обработки: обновления с одинаковым ключом (одного пользователя, иначе чата)
+    обрабатываются по очереди.
+    """
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.user is not None:
+        return context.user.id
+    if context.chat is not None:
+        return context.chat.id
+    return update.update_id
+
+
+async def _feed_updates_in_order(dp: Dispatcher, bot: Bot, updates: List[Update], semaphore: asyncio.Semaphore,
+                                 **kwargs: Any):
+    for update in updates:
+        async with semaphore:
+            try:
+                await dp.feed_update(bot, update, **kwargs)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке накопившегося обновления {update.update_id}: {e}", exc_info=True)
+
+
+async def catch_up_updates(dp: Dispatcher, bot: Bot, tracker: UpdateOffsetTracker, **kwargs: Any) -> int:
+    """
+    Обрабатывает обновления, накопившиеся за время остановки бота, начиная после tracker.saved_id
+    (см. описание модуля). Возвращает количество обработанных обновлений. Вызывается при запуске
+    перед dp.start_polling, когда все middleware и роутеры уже зарегистрированы.
+
+    :param kwargs: Дополнительные данные для хендлеров (как kwargs в dp.start_polling).
+    """
+    started = time.perf_counter()
+    if tracker.saved_id is not None and tracker.in_current_sequence():
+        offset = tracker.saved_id + 1
+    else:
+        # offset=saved_id+1 подтвердил бы (и Telegram удалил бы) обновления новой последовательности с меньшими ID.
+        # Повторных среди обновлений без offset быть не может: Telegram уже удалил их как слишком старые
+        offset = None
+    allowed_updates = dp.resolve_used_update_types()
+    semaphore = asyncio.Semaphore(UPDATES_CATCH_UP_CONCURRENCY)
+    processed_count = 0
+
+    while True:
+        for attempt in range(GET_UPDATES_RETRIES):
+            try:
+                updates = await bot.get_updates(offset=offset, limit=GET_UPDATES_LIMIT, timeout=0,
+                                                allowed_updates=allowed_updates)
+                break
+            except Exception as e:
+                logger.warning(f"Не удалось получить накопившиеся обновления ({e}), попытка {attempt + 1} "
+                               f"из {GET_UPDATES_RETRIES}.")
+                await asyncio.sleep(GET_UPDATES_RETRY_DELAY)
+        else:
+            logger.error("Накопившиеся обновления не получены, их обработает поллинг без сохранения порядка.")
+            break
+        # Пустой ответ на запрос с offset подтвердил все обработанные пачки
+        if not updates:
+            break
+
+        updates_by_key: Dict[int, List[Update]] = {}
+        for update in updates:
+            if not tracker.is_processed(update.update_id):
+                updates_by_key.setdefault(_ordering_key(update), []).append(update)
+        await asyncio.gather(*(_feed_updates_in_order(dp, bot, key_updates, semaphore, **kwargs)
+                               for key_updates in updates_by_key.values()))
+        processed_count += sum(len(key_updates) for key_updates in updates_by_key.values())
+
+        offset = updates[-1].update_id + 1
+        await tracker.save()
+
+    if processed_count:
+        logger.info(f"Обработаны накопившиеся обновления: {processed_count} за "
+                    f"{time.perf_counter() - started:.1f} с.")
+    return processed_count
+
+
+async def wait_polling_updates(dp: Dispatcher, timeout: float):
+    """
+    Ждет обновления, которые еще обрабатываются после остановки поллинга (не дольше timeout секунд),
+    чтобы не потерять уже подтвержденные в Telegram обновления.
+    """
+    tasks = set(dp._handle_update_tasks)
+    if not tasks:
+        return
+    _done, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        logger.warning(f"Обновления не обработаны до остановки поллинга: {len(pending)}.")
@@ -0,0 +1,119 @@
+"""
+Получение обновлений через вебхук (BOT_MODE=webhook) - альтернатива long polling.
+
+Telegram присылает обновления POST-запросами на WEBHOOK_PATH встроенного aiohttp-сервера. Запрос проверяется
+по секретному заголовку X-Telegram-Bot-Api-Secret-Token (WEBHOOK_SECRET; если он не задан, а вебхук
+регистрируется в Telegram, секрет генерируется при запуске и передается в setWebhook), сервер сразу отвечает 200,
+а обновление обрабатывается фоновой задачей; одновременно обрабатывается не более UPDATES_CONCURRENCY_LIMIT
+обновлений, остальные ждут своей очереди.
+
+Если WEBHOOK_URL не задан, вебхук не регистрируется в Telegram: сервер можно проверить локально
+(без WEBHOOK_SECRET - только на WEBHOOK_HOST=127.0.0.1), отправляя на него сохраненные JSON обновлений, например:
+    curl -X POST -H "Content-Type: application/json" -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+        -d @update.json http://localhost:8080/webhook
+"""
+import asyncio
+import logging
+import secrets
+import signal
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_CONNECTIONS, \
+    UPDATES_CONCURRENCY_LIMIT, WORKER_INDEX, DROP_PENDING_UPDATES
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать завершения обрабатываемых обновлений при остановке сервера, сек
+SHUTDOWN_TIMEOUT = 10
+
+
+class ConcurrencyLimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука aiogram, который отвечает Telegram сразу, а обновления обрабатывает в фоне,
+    не более concurrency_limit одновременно (None - без ограничения).
+    Сессию бота не закрывает: это делает main() после остановки фоновых задач.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency_limit: Optional[int] = None,
+                 secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self._semaphore = asyncio.Semaphore(concurrency_limit) if concurrency_limit else None
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        if self._semaphore is None:
+            return await super()._background_feed_update(bot, update)
+        async with self._semaphore:
+            return await super()._background_feed_update(bot, update)
+
+    async def close(self) -> None:
+        """
+        Ждет обрабатываемые обновления не дольше SHUTDOWN_TIMEOUT секунд, оставшиеся отменяет.
+        """
+        if not self._background_feed_update_tasks:
+            return
+        _done, pending = await asyncio.wait(set(self._background_feed_update_tasks), timeout=SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Обновления не обработаны до остановки вебхука и отменены: {len(pending)}.")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **data: Any):
+    """
+    Запускает aiohttp-сервер вебхука и регистрирует вебхук в Telegram (если задан WEBHOOK_URL).
+    Работает до SIGINT/SIGTERM, после чего останавливает сервер, дождавшись обрабатываемых обновлений.
+    Накопившиеся до запуска обновления Telegram присылает после регистрации вебхука
+    (пропускаются только при DROP_PENDING_UPDATES).
+
+    :param data: Дополнительные данные для хендлеров (как kwargs в dp.start_polling).
+    """
+    # Публичный вебхук без секрета принимал бы поддельные обновления: секрет генерируется,
+    # Telegram получает его при регистрации вебхука
+    secret_token = WEBHOOK_SECRET or (secrets.token_urlsafe(32) if WEBHOOK_URL else None)
+    app = web.Application()
+    ConcurrencyLimitedRequestHandler(
+        dp, bot, concurrency_limit=UPDATES_CONCURRENCY_LIMIT, secret_token=secret_token, **data
+    ).register(app, path=WEBHOOK_PATH)
+    # События startup/shutdown диспетчера вызываются при запуске и остановке приложения
+    setup_application(app, dp, bot=bot, **data)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT).start()
+        logger.info(f"Сервер вебхука слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}.")
+
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=secret_token,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=DROP_PENDING_UPDATES
+            )
+            logger.info(f"Вебхук зарегистрирован в Telegram: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}.")
+        elif WORKER_INDEX is None:
+            logger.warning("WEBHOOK_URL не задан: вебхук не зарегистрирован в Telegram, сервер принимает "
+                           "только локальные запросы.")
+        if secret_token is None:
+            logger.warning("WEBHOOK_SECRET не задан: запросы к локальному серверу вебхука не проверяются.")
+        elif not WEBHOOK_SECRET:
+            logger.info("WEBHOOK_SECRET не задан: для вебхука сгенерирован секрет на время работы бота.")
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, stop_event.set)
+            except NotImplementedError:
+                # Windows: остановка по KeyboardInterrupt
+                pass
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, сервер вебхука останавливается.")
+    finally:
+        await runner.cleanup()